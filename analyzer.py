@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+
+import argparse
+import sys
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict, deque
+from typing import NamedTuple
+
+from capture import CAPTURE_RECORD, FC_TO_HOST, HOST_TO_FC, open_capture
+from msp import MspFramer
+from msp_data import REC_TYPES, MspRecType, msp_code
+
+DIRECTION_NAMES = ('host>fc', 'fc>host')
+
+
+class Stream(NamedTuple):
+    """All bytes of one direction with the end offset and time of every captured chunk."""
+    data: bytes
+    ends: array # cumulative byte offset after each chunk
+    times: array # ns since the capture start
+
+    def time_at(self, offset: int) -> int:
+        """Time the byte before ``offset`` was captured."""
+        idx = bisect_left(self.ends, offset)
+        return self.times[min(idx, len(self.times) - 1)] if self.times else 0
+
+
+class Frame(NamedTuple):
+    time: int
+    code: int
+    type: MspRecType
+    size: int
+
+
+class Report(NamedTuple):
+    duration: float
+    bytes: tuple[int, int]
+    frames: tuple[int, int]
+    checksum_errors: tuple[int, int]
+    skipped: tuple[int, int]
+    counts: dict # (direction, code) -> frames
+    latencies: dict # code -> sorted ns
+    unanswered: Counter
+
+
+def load_streams(path: str) -> tuple[float, tuple[Stream, Stream]]:
+    """Split a capture into one stream per direction, the records are walked once over the mapping."""
+    started, view = open_capture(path)
+    parts = ([], [])
+    ends = (array('Q'), array('Q'))
+    times = (array('Q'), array('Q'))
+    sizes = [0, 0]
+    offset = 0
+    end = len(view)
+    while offset + CAPTURE_RECORD.size <= end:
+        timestamp, direction, size = CAPTURE_RECORD.unpack_from(view, offset)
+        offset += CAPTURE_RECORD.size
+        if offset + size > end:
+            break
+        parts[direction].append(view[offset:offset + size])
+        sizes[direction] += size
+        ends[direction].append(sizes[direction])
+        times[direction].append(timestamp)
+        offset += size
+    return started, tuple(Stream(b''.join(parts[i]), ends[i], times[i]) for i in (HOST_TO_FC, FC_TO_HOST))
+
+def load_raw(host_path: str, fc_path: str) -> tuple[float, tuple[Stream, Stream]]:
+    """Streams from the untimed ``src2dst.dat``/``dst2src.dat`` dumps of the old proxy, all at time 0."""
+    streams = []
+    for path in (host_path, fc_path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        streams.append(Stream(data, array('Q', (len(data),)), array('Q', (0,))))
+    return 0.0, tuple(streams)
+
+def parse_frames(stream: Stream) -> tuple[list[Frame], MspFramer]:
+    """Frame every message of a stream in one pass over the whole buffer."""
+    framer = MspFramer()
+    framer.feed(stream.data)
+    frames = []
+    consumed = 0
+    while (frame := framer.next_frame()) is not None:
+        consumed += len(frame)
+        end = framer.skipped + consumed
+        if frame[1] == 88: # $X
+            code, size = frame[4] | frame[5] << 8, frame[6] | frame[7] << 8
+        else:
+            code = frame[4]
+            size = frame[5] | frame[6] << 8 if frame[3] == 255 else frame[3]
+        frames.append(Frame(stream.time_at(end), code, REC_TYPES[frame[2]], size))
+    return frames, framer
+
+def analyze(streams: tuple[Stream, Stream]) -> Report:
+    parsed = [parse_frames(stream) for stream in streams]
+    counts = Counter()
+    for direction, (frames, _) in enumerate(parsed):
+        counts.update((direction, frame.code) for frame in frames)
+
+    # Responses are matched to requests of the same code, first in first out
+    waiting = defaultdict(deque)
+    latencies = defaultdict(list)
+    requests = iter(parsed[HOST_TO_FC][0])
+    request = next(requests, None)
+    for response in parsed[FC_TO_HOST][0]:
+        while request and request.time <= response.time:
+            if request.type == MspRecType.REQUEST:
+                waiting[request.code].append(request.time)
+            request = next(requests, None)
+        if response.type != MspRecType.REQUEST and waiting[response.code]:
+            latencies[response.code].append(response.time - waiting[response.code].popleft())
+    while request:
+        if request.type == MspRecType.REQUEST:
+            waiting[request.code].append(request.time)
+        request = next(requests, None)
+
+    times = [stream.times[i] for stream in streams for i in (0, -1) if stream.times]
+    return Report(
+        duration=(max(times) - min(times)) / 1e9 if times else 0.0,
+        bytes=tuple(len(stream.data) for stream in streams),
+        frames=tuple(len(frames) for frames, _ in parsed),
+        checksum_errors=tuple(framer.checksum_errors for _, framer in parsed),
+        skipped=tuple(framer.skipped for _, framer in parsed),
+        counts=dict(counts),
+        latencies={code: sorted(values) for code, values in latencies.items()},
+        unanswered=Counter({code: len(queue) for code, queue in waiting.items() if queue}),
+    )
+
+def percentile(values: list, fraction: float) -> float:
+    return values[min(int(len(values) * fraction), len(values) - 1)] if values else 0
+
+def format_report(report: Report) -> str:
+    duration = max(report.duration, 1e-9)
+    lines = [f'Duration {report.duration:.3f}s']
+    for direction in (HOST_TO_FC, FC_TO_HOST):
+        lines.append(f'{DIRECTION_NAMES[direction]}: {report.bytes[direction]} bytes, {report.frames[direction]} frames, '
+                     f'{report.bytes[direction] / duration / 1024:.1f} KB/s, {report.checksum_errors[direction]} checksum errors, '
+                     f'{report.skipped[direction]} bytes skipped')
+    lines.append(f'{"code":<28} {"requests":>8} {"responses":>9} {"Hz":>8} {"p50 ms":>8} {"p95 ms":>8} {"max ms":>8}')
+    for code in sorted({code for _, code in report.counts}):
+        name = getattr(msp_code(code), 'name', str(code))
+        requests = report.counts.get((HOST_TO_FC, code), 0)
+        responses = report.counts.get((FC_TO_HOST, code), 0)
+        latency = report.latencies.get(code, [])
+        lines.append(f'{name:<28} {requests:8d} {responses:9d} {max(requests, responses) / duration:8.1f} '
+                     f'{percentile(latency, 0.5) / 1e6:8.2f} {percentile(latency, 0.95) / 1e6:8.2f} '
+                     f'{(latency[-1] if latency else 0) / 1e6:8.2f}')
+    if report.unanswered:
+        unanswered = ', '.join(f'{getattr(msp_code(code), "name", code)} x{count}' for code, count in report.unanswered.items())
+        lines.append(f'Unanswered: {unanswered}')
+    return '\n'.join(lines)
+
+
+class ReplaySerial:
+    """Read only stand in for ``serial.Serial`` that plays one direction of a capture.
+
+    With ``realtime`` the data becomes readable at its captured time, otherwise all of it
+    is available at once, which makes a deterministic parser benchmark input.
+    """
+
+    def __init__(self, stream: Stream, realtime: bool = False) -> None:
+        self.stream = stream
+        self.realtime = realtime
+        self.timeout = None
+        self.written = bytearray()
+        self._pos = 0
+        self._started = time.monotonic_ns()
+
+    def _available_end(self) -> int:
+        if not self.realtime:
+            return len(self.stream.data)
+        idx = bisect_left(self.stream.times, time.monotonic_ns() - self._started + 1)
+        return self.stream.ends[idx - 1] if idx else 0
+
+    @property
+    def in_waiting(self) -> int:
+        return self._available_end() - self._pos
+
+    def read(self, size: int = 1) -> bytes:
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while self._pos < len(self.stream.data) and self.in_waiting <= 0:
+            if deadline is not None and time.monotonic() >= deadline:
+                return b''
+            time.sleep(0.0005)
+        end = min(self._pos + size, self._available_end())
+        result = self.stream.data[self._pos:end]
+        self._pos = end
+        return result
+
+    def write(self, data: bytes) -> int:
+        self.written += data
+        return len(data)
+
+    def close(self) -> None:
+        pass
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='MSP capture analyzer')
+    parser.add_argument('capture', nargs='+', help='Capture file, or the src2dst.dat and dst2src.dat pair of the old proxy')
+    parser.add_argument('--bench', action='store_true', help='Time the MSP parser on the replayed flight controller side')
+    args = parser.parse_args()
+    if len(args.capture) > 2:
+        parser.error('expected one capture file or the two raw dump files')
+
+    try:
+        if len(args.capture) == 2:
+            _, streams = load_raw(*args.capture)
+        else:
+            _, streams = load_streams(args.capture[0])
+    except (OSError, ValueError) as e:
+        print(f'ERROR: {e}', file=sys.stderr)
+        sys.exit(-1)
+
+    print(format_report(analyze(streams)))
+    if args.bench:
+        port = ReplaySerial(streams[FC_TO_HOST])
+        framer = MspFramer()
+        started = time.perf_counter()
+        frames = 0
+        while chunk := port.read(4096):
+            framer.feed(chunk)
+            while framer.next_frame() is not None:
+                frames += 1
+        elapsed = time.perf_counter() - started
+        print(f'Parser: {frames} frames in {elapsed * 1000:.1f} ms, {frames / max(elapsed, 1e-9):.0f} frames/s, '
+              f'{len(streams[FC_TO_HOST].data) / max(elapsed, 1e-9) / 1e6:.1f} MB/s')
+
+if __name__ == '__main__':
+    main()
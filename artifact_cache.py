@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    import requests
+
+# Access times only order the eviction, a hit writes them out at most this often
+ATIME_SAVE_INTERVAL = 60.0
+
+def atomic_write(path: str, data: bytes) -> None:
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp_')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+class ArtifactCache:
+    """Content addressed store for build info, firmware hex files and parsed images.
+
+    Blobs live in ``objects/<sha256>`` and ``index.json`` maps keys such as
+    ``hex/STM32F405/4.5.1`` to a blob with its HTTP validators and last access time.
+    Least recently used entries are evicted once the total size exceeds ``max_size``,
+    never the one just added. Access times of hits are saved with the next change,
+    every ``ATIME_SAVE_INTERVAL`` or on ``flush``.
+    """
+    INDEX = 'index.json'
+    OBJECTS = 'objects'
+
+    def __init__(self, path: str, max_size: int = 512 * 1024 * 1024, session: Optional['requests.Session'] = None) -> None:
+        self.path = path
+        self.max_size = max_size
+        self.session = session
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(path, ArtifactCache.OBJECTS), exist_ok=True)
+        self._index = self._load_index()
+        self._saved = time.monotonic()
+        self._dirty = False
+
+    @staticmethod
+    def key(kind: str, *parts: str) -> str:
+        return '/'.join((kind, *parts)).lower()
+
+    def _load_index(self) -> dict:
+        try:
+            with open(os.path.join(self.path, ArtifactCache.INDEX), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self) -> None:
+        atomic_write(os.path.join(self.path, ArtifactCache.INDEX), json.dumps(self._index).encode('utf-8'))
+        self._saved = time.monotonic()
+        self._dirty = False
+
+    def flush(self) -> None:
+        """Save access times not written yet."""
+        with self._lock:
+            if self._dirty:
+                self._save_index()
+
+    def object_path(self, digest: str) -> str:
+        return os.path.join(self.path, ArtifactCache.OBJECTS, digest)
+
+    def entry(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._index.get(key)
+            if entry and not os.path.isfile(self.object_path(entry['hash'])):
+                del self._index[key]
+                return None
+            return dict(entry) if entry else None
+
+    def get_path(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._index.get(key)
+            if not entry or not os.path.isfile(self.object_path(entry['hash'])):
+                return None
+            entry['atime'] = time.time()
+            self._dirty = True
+            if time.monotonic() - self._saved > ATIME_SAVE_INTERVAL:
+                self._save_index()
+            return self.object_path(entry['hash'])
+
+    def keys(self, prefix: str = '') -> list[str]:
+        with self._lock:
+            return sorted(key for key in self._index if key.startswith(prefix))
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self.get_path(key)
+        if not path:
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def put(self, key: str, data: bytes, **meta) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.object_path(digest)
+        with self._lock:
+            if not os.path.isfile(path):
+                atomic_write(path, data)
+            now = time.time()
+            self._index[key] = {'hash': digest, 'size': len(data), 'atime': now, 'fetched': now, **meta}
+            self._evict(key)
+            self._save_index()
+        return path
+
+    def _evict(self, keep: str) -> None:
+        sizes = {}
+        for entry in self._index.values():
+            sizes[entry['hash']] = entry['size']
+        total = sum(sizes.values())
+        for key, entry in sorted(self._index.items(), key=lambda item: item[1]['atime']):
+            if total <= self.max_size:
+                break
+            if key == keep:
+                continue
+            del self._index[key]
+            if all(other['hash'] != entry['hash'] for other in self._index.values()):
+                total -= entry['size']
+                try:
+                    os.remove(self.object_path(entry['hash']))
+                except OSError:
+                    pass
+
+    def fetch(self, key: str, url: str, max_age: float = 86400, timeout: float = 10) -> str:
+        """Return the path of the cached ``url``, revalidating it once it is older than ``max_age``."""
+        entry = self.entry(key)
+        if entry and time.time() - entry['fetched'] < max_age:
+            return self.get_path(key)
+
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        import requests # only loaded once something is downloaded
+        with self._lock:
+            if self.session is None:
+                # One pooled session keeps the connections to the build server alive between fetches
+                self.session = requests.Session()
+        try:
+            response = self.session.get(url, headers=headers, timeout=timeout)
+        except requests.RequestException:
+            if entry:
+                return self.get_path(key)
+            raise
+
+        if response.status_code == 304 and entry:
+            with self._lock:
+                if key in self._index:
+                    self._index[key]['fetched'] = time.time()
+                    self._save_index()
+            return self.get_path(key)
+
+        response.raise_for_status()
+        return self.put(key, response.content, url=url,
+                        etag=response.headers.get('ETag'), last_modified=response.headers.get('Last-Modified'))
@@ -0,0 +1,150 @@
+import json
+import os
+import time
+import tomllib
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from typing import Callable, NamedTuple, Optional
+
+import metrics
+
+JOB_FIELDS = ('serial', 'location', 'target', 'release', 'hex', 'config', 'diff', 'cfg_diff')
+PATH_FIELDS = ('hex', 'config')
+DOWNLOADS = 4
+RETRIES = 2
+RETRY_DELAY = 2.0
+
+
+class Job(NamedTuple):
+    """One board of a batch manifest, matched by USB serial number or USB location such as ``1-2.3``."""
+    serial: Optional[str] = None
+    location: Optional[str] = None
+    target: Optional[str] = None
+    release: Optional[str] = None
+    hex: Optional[str] = None
+    config: Optional[str] = None
+    diff: Optional[str] = None # flash page diff, 'readback' or 'manifest'
+    cfg_diff: bool = False
+
+    @property
+    def name(self) -> str:
+        return self.serial or f'usb {self.location}'
+
+    @property
+    def firmware(self) -> Optional[tuple]:
+        """Download key, ``None`` when there is nothing to flash."""
+        if not self.hex and not (self.target and self.release):
+            return None
+        return self.hex, self.target, self.release
+
+
+class Board(NamedTuple):
+    serial: str
+    port: Optional[str] # None while it is in DFU mode
+    location: Optional[str]
+
+
+def load_batch(path: str) -> list[Job]:
+    """Jobs of a ``.toml`` or ``.json`` manifest, ``defaults`` apply to every board.
+
+    TOML lists boards as ``[[board]]`` tables, JSON as a ``boards`` list. Hex and
+    config paths are relative to the manifest.
+    """
+    with open(path, 'rb') as f:
+        manifest = tomllib.load(f) if path.endswith('.toml') else json.load(f)
+    defaults = manifest.get('defaults', {})
+    boards = manifest.get('board', manifest.get('boards', []))
+    if not boards:
+        raise ValueError(f'No boards in {path}')
+    base = os.path.dirname(os.path.abspath(path))
+    jobs = []
+    seen = set()
+    for idx, board in enumerate(boards, 1):
+        values = {**defaults, **board}
+        unknown = set(values) - set(JOB_FIELDS)
+        if unknown:
+            raise ValueError(f'Board {idx}: unknown fields {", ".join(sorted(unknown))}')
+        for name in PATH_FIELDS:
+            if values.get(name):
+                values[name] = os.path.join(base, values[name])
+        job = Job(**values)
+        if not job.serial and not job.location:
+            raise ValueError(f'Board {idx}: serial or location is required')
+        if not job.firmware and not job.config:
+            raise ValueError(f'Board {idx}: nothing to do, set hex, target and release, or config')
+        if job.hex is None and (job.target or job.release) and not job.firmware:
+            raise ValueError(f'Board {idx}: target and release are both required to download firmware')
+        if job.diff not in (None, 'readback', 'manifest'):
+            raise ValueError(f'Board {idx}: diff must be readback or manifest')
+        for name in PATH_FIELDS:
+            if getattr(job, name) and not os.path.isfile(getattr(job, name)):
+                raise ValueError(f'Board {idx}: file not found: {getattr(job, name)}')
+        if job.name in seen:
+            raise ValueError(f'Board {idx}: {job.name} is listed twice')
+        seen.add(job.name)
+        jobs.append(job)
+    return jobs
+
+def location_matches(pattern: str, location: Optional[str]) -> bool:
+    # Serial ports report the interface too, '1-2.3:1.0'
+    return bool(location) and (location == pattern or location.startswith(pattern + ':'))
+
+def match_boards(jobs: list[Job], boards: list[Board]) -> tuple[list[tuple[Job, Board]], list[Job]]:
+    """Pair jobs with attached boards, return the pairs and the jobs with no board attached."""
+    matched = []
+    missing = []
+    for job in jobs:
+        board = next((b for b in boards if (job.serial and b.serial == job.serial)
+                      or (not job.serial and location_matches(job.location, b.location))), None)
+        if board:
+            matched.append((job._replace(serial=board.serial), board))
+        else:
+            missing.append(job)
+    return matched, missing
+
+
+def run_batch(pairs: list[tuple[Job, Board]], fetch: Callable[[Job], tuple[str, dict]],
+              run_job: Callable[[Job, Board, Optional[str], Optional[dict]], None], status,
+              jobs: Optional[int] = None, downloads: int = DOWNLOADS, retries: int = RETRIES,
+              retry_delay: float = RETRY_DELAY, refresh: Optional[Callable[[str], Board]] = None) -> int:
+    """Run every job and return the number of failed boards.
+
+    Firmware is fetched once per hex file or target and release on its own pool, so a
+    board starts flashing as soon as its firmware is there while the rest still
+    downloads. A failed board is retried ``retries`` times, ``refresh`` looks up where
+    the board is attached now, since a failed attempt may leave it in DFU mode.
+    """
+    with ThreadPoolExecutor(max_workers=downloads) as download_pool, \
+         ThreadPoolExecutor(max_workers=jobs or max(len(pairs), 1)) as board_pool:
+        firmware: dict[tuple, Future] = {}
+        for job, _ in pairs:
+            if job.firmware and job.firmware not in firmware:
+                firmware[job.firmware] = download_pool.submit(fetch, job)
+
+        def board_task(job: Job, board: Board) -> None:
+            hex_file, build_info = None, None
+            if job.firmware:
+                status.update(job.name, 'download')
+                with metrics.span('wait_firmware', board=job.serial):
+                    hex_file, build_info = firmware[job.firmware].result()
+            for attempt in range(retries + 1):
+                try:
+                    run_job(job, board, hex_file, build_info)
+                    return
+                except Exception as e:
+                    if attempt == retries:
+                        raise
+                    status.update(job.name, f'retry {attempt + 1}', str(e) or type(e).__name__)
+                    metrics.count('retries', phase='board', board=job.serial)
+                    time.sleep(retry_delay)
+                    if refresh:
+                        board = refresh(job.serial)
+
+        futures = {board_pool.submit(board_task, job, board): job for job, board in pairs}
+        failed = 0
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                failed += 1
+                status.update(futures[future].name, 'FAILED', str(e) or type(e).__name__)
+    return failed
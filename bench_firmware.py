@@ -0,0 +1,44 @@
+"""Compare the IntelHex todict() image build against FirmwareImage on a 1 MB firmware,
+and Intel HEX parsing against loading the pre-parsed image file."""
+import os
+import tempfile
+import time
+import tracemalloc
+
+from firmware import FirmwareImage
+from test_firmware import CUSTOM_DEFAULTS_POINTER_ADDRESS, image_build, intelhex_build, make_hex
+
+CONFIG = b'# Betaflight\n' + b'set gyro_lpf1_static_hz = 250\n' * 100 + b'\0'
+
+def measure(name: str, build, text: str) -> bytes:
+    started = time.perf_counter()
+    result = build(text, CONFIG)
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    build(text, CONFIG)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f'{name:<14} {elapsed * 1000:9.1f} ms {peak / 1e6:8.1f} MB peak')
+    return bytes(result)
+
+def main():
+    text = make_hex(1024 * 1024, (900 * 1024, 16 * 1024))
+    old = measure('IntelHex', intelhex_build, text)
+    new = measure('FirmwareImage', image_build, text)
+    assert old == new, 'images differ'
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'firmware.bfimg')
+        FirmwareImage.from_hex_text(text).save(path)
+
+        def image_file_build(_, config):
+            image = FirmwareImage.load(path)
+            start, size = image.find_gap(CUSTOM_DEFAULTS_POINTER_ADDRESS)
+            if start and size and len(config) <= size:
+                image.write(start, config)
+            return image.tobinary()
+
+        assert measure('.bfimg mmap', image_file_build, text) == new, 'images differ'
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""Start up import time of the real bf_flash commands, best of ``python -X importtime`` runs.
+
+Every command runs ``bf_flash.main()`` end to end against a simulated flight controller
+on a pty. USB is stubbed with a DFU device that fails to open, so the flash commands go
+through their whole import path without hardware. Exits with an error when a command
+goes over its budget."""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+# Runs bf_flash with the DFU device lookup stubbed, the arguments follow ``-c``
+STUB = '''
+import sys
+from types import SimpleNamespace
+import bf_flash
+device = SimpleNamespace(bus=1, port_numbers=None)
+bf_flash.dfu_devices = lambda: [device]
+bf_flash.usb_serial = lambda dev: SERIAL
+sys.argv[0] = 'bf_flash.py'
+bf_flash.main()
+'''
+SERIAL = 'BENCH0001'
+TARGET = 'STM32F405'
+RELEASE = '4.5.1'
+# bf_flash arguments, {port} is the simulator and {tmp} the scratch directory
+COMMANDS = {
+    'restore': ('-p', '{port}', '-c', '{tmp}/config.txt'),
+    'backup': ('-p', '{port}', 'backup', '-o', '{tmp}/board.bfsnap'),
+    'blackbox': ('-p', '{port}', 'blackbox', '-o', '{tmp}/blackbox.bbl'),
+    'telemetry': ('-p', '{port}', 'telemetry', 'ATTITUDE', '-d', '0.1'),
+    'convert': ('convert', '{tmp}/firmware.hex', '-o', '{tmp}/converted.bfimg'),
+    'search --offline': ('--offline', 'search', 'F405'),
+    'prefetch': ('--offline', 'prefetch', TARGET),
+    'flash': ('--offline', '-p', '{port}', '-f', '{tmp}/firmware.bfimg', '-t', TARGET, '-r', RELEASE),
+    'batch': ('batch', '{tmp}/batch.json', '--retries', '0'),
+    'flash --all': ('--offline', '--all', '-f', '{tmp}/firmware.bfimg', '-t', TARGET, '-r', RELEASE),
+}
+# Milliseconds on a desktop, roughly 5x on a Raspberry Pi
+BUDGET_MS = {
+    'restore': 140,
+    'backup': 140,
+    'blackbox': 140,
+    'telemetry': 150,
+    'convert': 140,
+    'search --offline': 300,
+    'prefetch': 300,
+    'flash': 400,
+    'batch': 420,
+    'flash --all': 410,
+}
+# Commands that only talk MSP or CLI to the board must not pay for the HTTP and USB stacks
+LIGHT_COMMANDS = ('restore', 'backup', 'blackbox', 'telemetry', 'convert')
+HEAVY_MODULES = ('requests', 'urllib3', 'pyfu_usb', 'usb', 'semver', 'platformdirs', 'intelhex')
+CONFIG = 'set small_angle = 60\nfeature GPS\n'
+FIRMWARE_SIZE = 64 * 1024
+RUNS = 5
+
+def hex_record(kind: int, address: int, payload: bytes) -> str:
+    record = bytes((len(payload), address >> 8 & 0xFF, address & 0xFF, kind)) + payload
+    return f':{record.hex().upper()}{-sum(record) & 0xFF:02X}'
+
+def hex_text(data: bytes, address: int = 0x08000000) -> str:
+    lines = [hex_record(4, 0, (address >> 16).to_bytes(2, 'big'))]
+    lines += [hex_record(0, address + offset, data[offset:offset + 16]) for offset in range(0, len(data), 16)]
+    return '\n'.join(lines + [hex_record(1, 0, b'')]) + '\n'
+
+def prepare(tmp: str) -> dict:
+    """Files the commands use and the environment that keeps their cache in ``tmp``."""
+    from artifact_cache import ArtifactCache
+    from firmware import FirmwareImage
+
+    text = hex_text(bytes(range(256)) * (FIRMWARE_SIZE // 256))
+    with open(os.path.join(tmp, 'firmware.hex'), 'w', encoding='ascii') as f:
+        f.write(text)
+    FirmwareImage.from_hex_text(text).save(os.path.join(tmp, 'firmware.bfimg'))
+    with open(os.path.join(tmp, 'config.txt'), 'w', encoding='ascii') as f:
+        f.write(CONFIG)
+    with open(os.path.join(tmp, 'batch.json'), 'w', encoding='utf-8') as f:
+        json.dump({'boards': [{'serial': SERIAL, 'hex': 'firmware.bfimg'}]}, f)
+    # Offline index, so search and prefetch find the target and flash gets as far as the DFU device
+    env = {**os.environ, 'XDG_CACHE_HOME': os.path.join(tmp, 'cache')}
+    cache = ArtifactCache(os.path.join(env['XDG_CACHE_HOME'], 'bf_flash'))
+    releases = {'target': TARGET, 'releases': [{'release': RELEASE, 'type': 'Stable'}]}
+    for key, value in ((('index', 'targets'), [TARGET]), (('releases', TARGET), releases),
+                       (('build', TARGET, RELEASE), {'configuration': []})):
+        cache.put(ArtifactCache.key(*key), json.dumps(value).encode())
+    return env
+
+def import_times(args: list[str], env: dict) -> dict[str, tuple[int, int]]:
+    """Cumulative microseconds and nesting of every module the command imports, the interpreter start up left out."""
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', STUB.replace('SERIAL', repr(SERIAL)), *args],
+                            cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True).stderr
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or '|' not in line or 'imported package' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        if name.strip() == 'site' and not name.startswith('  '):
+            times.clear() # everything before belongs to the start up
+            continue
+        times[name.strip()] = (int(cumulative), len(name) - len(name.lstrip()))
+    if 'bf_flash' not in times:
+        raise RuntimeError(f'bf_flash {" ".join(args)} did not start:\n{output[-2000:]}')
+    return times
+
+def total_ms(times: dict) -> float:
+    top = min((indent for _, indent in times.values()), default=0)
+    return sum(cumulative for cumulative, indent in times.values() if indent == top) / 1000
+
+class Bench:
+    """Simulator and scratch files shared by the command runs."""
+
+    def __init__(self) -> None:
+        from fc_sim import open_sim
+        self.tmp = tempfile.TemporaryDirectory()
+        self.env = prepare(self.tmp.name)
+        self.sim, self.port = open_sim(dataflash_size=16 * 1024)
+
+    def run(self, command: str) -> dict[str, tuple[int, int]]:
+        args = [arg.format(port=self.port, tmp=self.tmp.name) for arg in COMMANDS[command]]
+        return import_times(args, self.env)
+
+    def close(self) -> None:
+        self.sim.close()
+        self.tmp.cleanup()
+
+def main():
+    parser = argparse.ArgumentParser(description='bf_flash start up import time')
+    parser.add_argument('-n', dest='runs', type=int, default=RUNS, help='Runs per command, the best one counts')
+    parser.add_argument('--top', type=int, default=0, help='Print the slowest modules of every command')
+    args = parser.parse_args()
+
+    bench = Bench()
+    over = []
+    try:
+        for command in COMMANDS:
+            best = min((bench.run(command) for _ in range(args.runs)), key=total_ms)
+            elapsed = total_ms(best)
+            print(f'{command:<18} {elapsed:8.1f} ms  budget {BUDGET_MS[command]:4d} ms  {len(best)} modules')
+            for name, (cumulative, _) in sorted(best.items(), key=lambda item: -item[1][0])[:args.top]:
+                print(f'    {name:<40} {cumulative / 1000:8.1f} ms')
+            if elapsed > BUDGET_MS[command]:
+                over.append(command)
+    finally:
+        bench.close()
+
+    if over:
+        print(f'ERROR: over budget: {", ".join(over)}', file=sys.stderr)
+        sys.exit(-1)
+
+if __name__ == "__main__":
+    main()
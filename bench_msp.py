@@ -0,0 +1,20 @@
+"""Frames and bytes per second MspCtr.read parses from back to back responses in 512 byte port reads."""
+import time
+
+from fake_serial import FakeSerial, random_frames
+from msp import MspCtr
+
+FRAMES = 20_000
+
+def main():
+    frames = random_frames(FRAMES)
+    capture = b''.join(frames)
+    msp = MspCtr(FakeSerial(capture, chunk=512))
+    started = time.perf_counter()
+    for frame in frames:
+        assert msp.read(timeout=1) == frame, 'frame differs'
+    elapsed = time.perf_counter() - started
+    print(f'{len(frames) / elapsed:.0f} frames/sec, {len(capture) / elapsed / 1e6:.1f} MB/sec')
+
+if __name__ == "__main__":
+    main()
@@ -2,33 +2,68 @@
 # -*- coding: utf-8 -*-"
 
 import argparse
+import atexit
+import hashlib
 import json
 import os
+import re
 import sys
-import tempfile
+import threading
 import time
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 
-import requests
 import serial
-from intelhex import IntelHex
-from platformdirs import user_cache_dir
-from pyfu_usb import _get_dfu_devices as dfu_devices
-from pyfu_usb import download
 from serial.tools.list_ports import comports
 
+from artifact_cache import ArtifactCache
+import blackbox
+from cli import CliSession
+from cli_config import BetaflightConfig
+from dfu_flash import Progress, flash_device, print_progress
+from firmware import FirmwareImage
+import hotplug
+import metrics
 from msp import MspCtr, bit_check
 from msp_codes import MspCodes
 from msp_data import ConfigurationStates, ResetTypes, TargetCapabilitiesFlags
+from msp_snapshot import load_snapshot, read_snapshot, save_snapshot, write_snapshot
+from telemetry import TELEMETRY_CODES, TelemetryPoller
+
+# requests, pyusb, pyfu_usb, platformdirs and concurrent.futures are imported where they are used,
+# most commands need none of them
+if TYPE_CHECKING:
+    import usb
 
 
 APP_NAME = 'bf_flash'
-API_URL = 'https://build.betaflight.com/api'
+BUILD_URL = 'https://build.betaflight.com'
+CACHE_MAX_SIZE = 512 * 1024 * 1024
+IMAGE_EXT = '.bfimg'
+SNAPSHOT_EXT = '.bfsnap'
 BAUDRATE = 115200
 CUSTOM_DEFAULTS_POINTER_ADDRESS = 0x08002800
+MSP_TIMEOUT = 2
+DEFAULT_VALUE_RE = re.compile(r'^Default value: (.*)$', re.MULTILINE)
+BOARD_IDENTIFICATION_CODES = (
+    MspCodes.MSP_API_VERSION,
+    MspCodes.MSP_FC_VARIANT,
+    MspCodes.MSP_FC_VERSION,
+    MspCodes.MSP_BUILD_INFO,
+    MspCodes.MSP_BOARD_INFO,
+)
+VCP_IDS = ((0x0483, 0x5740),) # STM32 virtual COM port used by Betaflight
 
 _port = None
+_cache = None
+_index = None
+_offline = False
+
+
+class FlashError(Exception):
+    """A step failed, the command line reports it and exits, batch and parallel modes retry or fail the board."""
 
+
+@metrics.timed('detect_port')
 def detect_port() -> str:
     global _port
     if _port:
@@ -50,96 +85,151 @@ def detect_port() -> str:
             return None
 
     if not _port:
-        print('ERROR: COM port is not specified', file=sys.stderr)
-        sys.exit(-1)
+        raise FlashError('COM port is not specified')
 
     return _port
 
+def cache_dir() -> str:
+    from platformdirs import user_cache_dir
+    return user_cache_dir(APP_NAME)
+
+def dfu_devices() -> list:
+    from pyfu_usb import _get_dfu_devices
+    return _get_dfu_devices()
+
+def usb_serial(device: 'usb.core.Device') -> Optional[str]:
+    import usb.core
+    import usb.util
+    try:
+        return usb.util.get_string(device, device.iSerialNumber)
+    except (usb.core.USBError, ValueError):
+        return None
+
+def vcp_ports() -> list:
+    return [p for p in comports() if (p.vid, p.pid) in VCP_IDS]
+
+@metrics.timed('wait_dfu')
+def wait_dfu_device(serial_number: str) -> Optional['usb.core.Device']:
+    # The STM32 bootloader and Betaflight VCP report the same MCU UID based serial number
+    return hotplug.wait_for(lambda: next((d for d in dfu_devices() if usb_serial(d) == serial_number), None))
+
+@metrics.timed('wait_vcp')
+def wait_vcp_port(serial_number: str) -> Optional[str]:
+    return hotplug.wait_for(lambda: next((p.device for p in vcp_ports() if p.serial_number == serial_number), None))
+
+@metrics.timed('reboot_dfu')
+def reboot_to_dfu(port: str):
+    cli = CliSession(serial.Serial(port, BAUDRATE), timeout=2)
+    try:
+        try:
+            cli.enter()
+        except TimeoutError:
+            pass # no prompt, send it anyway like the fixed delay did
+        cli.port.write(b'bl\n')
+    finally:
+        cli.close()
+
 def to_dfu_mode(port: Optional[str]):
     if dfu_devices():
         return
 
-    port = port or detect_port()
-    com = serial.Serial(port, BAUDRATE)
-    com.write(b'#\n')
-    time.sleep(0.4)
-    com.write(b'bl\n')
-    com.close()
-
-def flash(hex_file: str, build_info: dict):
-    devices = []
-    for _ in range(10):
-        devices = dfu_devices()
-        if devices:
-            break
+    reboot_to_dfu(port or detect_port())
+
+def manifest_path(serial_number: str) -> str:
+    return os.path.join(cache_dir(), 'manifests', f'{serial_number}.json')
+
+def load_manifest(serial_number: Optional[str]) -> Optional[dict]:
+    if not serial_number or not os.path.isfile(manifest_path(serial_number)):
+        return None
+    with open(manifest_path(serial_number), encoding='utf-8') as f:
+        return {int(page): digest for page, digest in json.load(f).items()}
+
+def clear_manifest(serial_number: Optional[str]):
+    # Erased pages no longer match the manifest, until a flash completes there is none
+    if serial_number and os.path.isfile(manifest_path(serial_number)):
+        os.remove(manifest_path(serial_number))
+
+def save_manifest(serial_number: Optional[str], manifest: dict):
+    if not serial_number:
+        return
+    os.makedirs(os.path.dirname(manifest_path(serial_number)), exist_ok=True)
+    with open(manifest_path(serial_number), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+
+@metrics.timed('load_image')
+def load_image(hex_file: str) -> FirmwareImage:
+    """Load the pre-parsed image for ``hex_file`` from the cache, converting it on first use."""
+    with open(hex_file, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    key = ArtifactCache.key('image', digest)
+    path = artifact_cache().get_path(key)
+    if path:
+        return FirmwareImage.load(path)
+    image = FirmwareImage.from_hex(hex_file)
+    artifact_cache().put(key, image.dumps())
+    return image
+
+def convert(hex_file: str, image_file: Optional[str]):
+    image_file = image_file or os.path.splitext(hex_file)[0] + IMAGE_EXT
+    FirmwareImage.from_hex(hex_file).save(image_file)
+    print(f'Image saved: {image_file}')
+
+@metrics.timed('flash')
+def flash(hex_file: str, build_info: dict, device: Optional['usb.core.Device'] = None,
+          progress: Optional[Progress] = print_progress, diff: Optional[str] = None) -> bool:
+    devices = [device] if device else dfu_devices()
+    if not devices:
         print('Wait DFU device…')
-        time.sleep(1)
+        devices = hotplug.wait_for(dfu_devices)
 
     if not devices:
-        print(f'ERROR not found DFU device: {hex_file}', file=sys.stderr)
-        sys.exit(-1)
+        raise FlashError(f'DFU device not found: {hex_file}')
 
     print(f'Flash: {devices}')
 
-    intel_hex = IntelHex(hex_file)
+    if hex_file.endswith(IMAGE_EXT):
+        image = FirmwareImage.load(hex_file)
+    else:
+        image = load_image(hex_file)
     config = build_info.get('configuration')
 
     if build_info and config:
-        firmware = intel_hex.todict()
-        start = 0
-        size = 0
-        prk = intel_hex.minaddr()
-        for k in sorted(filter(lambda k : isinstance(k, int), firmware)):
-            if prk >= CUSTOM_DEFAULTS_POINTER_ADDRESS and k - prk > 1:
-                start = prk + 1
-                size = k - start
-            prk = k
-
+        start, size = image.find_gap(CUSTOM_DEFAULTS_POINTER_ADDRESS)
         config = '\n'.join(config)
-        config = f'# Betaflight\n${config}\0'
+        config = f'# Betaflight\n${config}\0'.encode('ascii')
         if start and size and len(config) <= size:
-            for b in config:
-                firmware[start] = ord(b)
-                start += 1
-            intel_hex = IntelHex(firmware)
+            image.write(start, config)
 
+    serial_number = usb_serial(devices[0])
+    manifest = load_manifest(serial_number)
+    clear_manifest(serial_number)
     try:
-        bin_tmp = os.path.join(tempfile.gettempdir(), 'betaflight.bin')
-        intel_hex.tofile(bin_tmp, 'bin')
-        download(bin_tmp, address=intel_hex.minaddr())
+        manifest = flash_device(devices[0], image.tobinary(), image.minaddr(), progress=progress,
+                                diff=diff, manifest=manifest)
+        save_manifest(serial_number, manifest)
     except Exception as e:
         print(f'ERROR Exception: {e}', file=sys.stderr)
-    finally:
-        os.remove(bin_tmp)
+        return False
 
     print('Flash done!')
+    return True
 
-def apply_custom_defaults(port: Optional[str]):
+@metrics.timed('wait_port')
+def wait_port(port: Optional[str]) -> str:
     port = port or detect_port()
-    is_found = False
-    for _ in range(10):
-        ports = tuple(map(lambda p: p.device, comports()))
-        if port in ports:
-            is_found = True
-            break
+    if not hotplug.port_exists(port):
         print('Wait COM port…')
-        time.sleep(1)
+        if not hotplug.wait_for(lambda: hotplug.port_exists(port)):
+            raise FlashError(f'COM port not found: {port}')
+    return port
 
-    if not is_found:
-        print(f'ERROR not found COM port: {port}', file=sys.stderr)
-        sys.exit(-1)
+@metrics.timed('custom_defaults')
+def apply_custom_defaults(port: Optional[str]):
+    port = wait_port(port)
 
-    msp = MspCtr(serial.Serial(port, baudrate=BAUDRATE))
-    msp.send(MspCodes.MSP_API_VERSION)
-    msp.decode(msp.read_rec())
-    msp.send(MspCodes.MSP_FC_VARIANT)
-    msp.decode(msp.read_rec())
-    msp.send(MspCodes.MSP_FC_VERSION)
-    msp.decode(msp.read_rec())
-    msp.send(MspCodes.MSP_BUILD_INFO)
-    msp.decode(msp.read_rec())
-    msp.send(MspCodes.MSP_BOARD_INFO)
-    msp.decode(msp.read_rec())
+    msp = MspCtr(serial.Serial(port, baudrate=BAUDRATE), timeout=MSP_TIMEOUT)
+    for rec in msp.request_many(BOARD_IDENTIFICATION_CODES):
+        msp.decode(rec)
 
     print(f'{msp.data.target_name} / {msp.data.board_name} / {msp.data.flight_controller_version} / {msp.data.build_info}')
 
@@ -155,110 +245,438 @@ def apply_custom_defaults(port: Optional[str]):
     else:
         print('SUPPORTS_CUSTOM_DEFAULTS not supported!')
 
+@metrics.timed('detect_target')
 def detect_target(port: Optional[str]) -> str:
     port = port or detect_port()
-    msp = MspCtr(serial.Serial(port, baudrate=BAUDRATE))
-    msp.send(MspCodes.MSP_BOARD_INFO)
-    rec = msp.read_rec()
-    msp.decode(rec)
+    msp = MspCtr(serial.Serial(port, baudrate=BAUDRATE), timeout=MSP_TIMEOUT)
+    for rec in msp.request_many((MspCodes.MSP_API_VERSION, MspCodes.MSP_BOARD_INFO)):
+        msp.decode(rec)
+    msp.close()
     return msp.data.board_name
 
+def artifact_cache() -> ArtifactCache:
+    global _cache
+    if not _cache:
+        _cache = ArtifactCache(cache_dir(), CACHE_MAX_SIZE)
+        atexit.register(_cache.flush)
+    return _cache
+
+def release_index():
+    global _index
+    if not _index:
+        from release_index import ReleaseIndex
+        _index = ReleaseIndex(artifact_cache(), BUILD_URL, offline=_offline)
+    return _index
+
+def index_lookup(func, *args):
+    """Call a release index lookup, ``FlashError`` when neither the server nor the cache has it."""
+    import requests
+    try:
+        return func(*args)
+    except (LookupError, ValueError, OSError, requests.RequestException) as e:
+        raise FlashError(str(e)) from e
+
+@metrics.timed('fetch_releases')
 def get_release(target: str) -> str:
-    response = requests.get(f'{API_URL}/targets/{target}', timeout=10)
-    releases = response.json().get('releases')
+    releases = index_lookup(release_index().stable, target)
     if not releases:
-        print(f'ERROR: Load releases for target: {target}', file=sys.stderr)
-        sys.exit(-1)
+        raise FlashError(f'Load releases for target: {target}')
 
-    releases = tuple(filter(lambda x: x.get('type') == 'Stable', releases))
     for item in enumerate(releases):
-        release = item[1].get('release')
-        print(f'{item[0] + 1} - {release}')
+        print(f'{item[0] + 1} - {item[1]}')
     try:
         selected = int(input('Select release: ')) - 1
-        return releases[selected].get('release')
+        return releases[selected]
     except:
         return None
 
+@metrics.timed('fetch_build_info')
 def get_build_info(target: str, release: str) -> dict:
-    release_clean = release.replace('.', '_')
-    cache_file = f'cfg_{target}_{release_clean}.json'
-    cache_path = user_cache_dir(APP_NAME)
-
-    if not os.path.isdir(cache_path):
-        os.mkdir(cache_path)
-
-    cache = os.path.join(user_cache_dir(APP_NAME), cache_file.lower())
-    if os.path.isfile(cache) and (time.time() - os.path.getmtime(cache)) < 86400: # One day
-        with open(cache, encoding="utf-8") as f:
-            print(f'Build info from cache file: {cache}')
-            return json.load(f)
-
-    response = requests.get(f'{API_URL}/builds/{release}/{target}', timeout=10)
-    obj = response.json()
-    with open(cache, 'w', encoding="utf-8") as f:
-        json.dump(obj, f)
-    return obj
-
-def restore_backup(port: Optional[str], config_file: str):
-    port = port or detect_port()
-    is_found = False
-    for _ in range(10):
-        ports = tuple(map(lambda p: p.device, comports()))
-        if port in ports:
-            is_found = True
-            break
-        print('Wait COM port…')
-        time.sleep(1)
+    return index_lookup(release_index().build_info, target, release)
+
+@metrics.timed('fetch_firmware')
+def fetch_firmware(target: str, release: str, build_info: dict) -> str:
+    return index_lookup(release_index().firmware, target, release, build_info)
+
+@metrics.timed('prefetch')
+def prefetch(targets: list[str], all_releases: bool, firmware: bool):
+    started = time.monotonic()
+    errors = release_index().prefetch(targets, all_releases, firmware)
+    for item, error in errors.items():
+        print(f'ERROR: {" ".join(item) if isinstance(item, tuple) else item}: {error}', file=sys.stderr)
+    print(f'Prefetch done! {len(targets)} targets, {len(errors)} errors in {time.monotonic() - started:.1f}s')
+    return len(errors)
+
+def search_targets(query: str):
+    index = release_index()
+    for target in index_lookup(index.search, query):
+        print(f'{target:<28} {" ".join(index.cached_stable(target)[:5])}')
+
+def default_value(output: str, name: str) -> Optional[str]:
+    """Default value of ``name`` in ``get`` output, which lists every setting containing the name."""
+    lines = iter(output.splitlines())
+    for line in lines:
+        if line.strip().lower().startswith(f'{name.lower()} = '):
+            # The block of the setting ends at the blank line before the next one
+            for line in lines:
+                if not line.strip():
+                    break
+                default = DEFAULT_VALUE_RE.match(line.strip())
+                if default:
+                    return default.group(1).strip()
+            return None
+    return None
 
-    if not is_found:
-        print(f'ERROR not found COM port: {port}', file=sys.stderr)
-        sys.exit(-1)
+def diff_restore_lines(cli: CliSession, lines: list[str]) -> Optional[list[str]]:
+    """Backup lines that differ from the board, or None when the diff can not be applied safely."""
+    backup = BetaflightConfig.parse(lines)
+    current = BetaflightConfig.parse_text(cli.command('diff all').output)
+    changed, extra = backup.diff(current)
+
+    # Settings the backup leaves at default but the board has changed are reset to their default value
+    resets = [key for key in extra if key[1] == 'set']
+    if len(resets) != len(extra):
+        return None
+    for key, result in zip(resets, cli.run(f'get {key[2]}' for key in resets)):
+        default = default_value(result.output, key[2])
+        if default is None:
+            return None
+        changed.append((key, f'set {key[2]} = {default}'))
+    return backup.restore_lines(changed, current.selected)
+
+@metrics.timed('restore_backup')
+def restore_backup(port: Optional[str], config_file: str, diff: bool = False):
+    port = wait_port(port)
 
     with open(config_file, encoding='ascii') as f:
-        com = serial.Serial(port, 115200)
-        com.write(b'#\n')
-        time.sleep(0.4)
+        lines = [line for line in f if line.strip() and line[0] != '#' and line.strip() != 'save']
+
+    cli = CliSession(serial.Serial(port, BAUDRATE))
+    cli.enter()
+    if diff:
+        changed = diff_restore_lines(cli, lines)
+        if changed is None:
+            print('Board settings can not be reset from a diff, restoring every line')
+        elif not changed:
+            cli.close()
+            print('Restore backup done! Board already matches the backup')
+            return
+        else:
+            print(f'Restore {len(changed)} of {len(lines)} lines')
+            lines = changed
+    results = cli.run(lines)
+    for result in results:
+        if result.error:
+            print(f'{result.line}\n    {result.error}', file=sys.stderr)
+
+    error = cli.save()
+    if error:
+        print(f'save\n    {error}', file=sys.stderr)
+        error = cli.save()
+    cli.close()
+    print('--------------------')
+    failed = sum(1 for result in results if result.error)
+    print(f'Restore backup done! {len(results)} lines, {failed} errors{", save failed" if error else ""}')
+
+@metrics.timed('backup_snapshot')
+def backup_snapshot(port: Optional[str], snapshot_file: Optional[str]):
+    msp = MspCtr(serial.Serial(wait_port(port), baudrate=BAUDRATE), timeout=MSP_TIMEOUT)
+    started = time.monotonic()
+    snapshot = read_snapshot(msp)
+    msp.close()
+    snapshot_file = snapshot_file or f'{snapshot["board"] or "board"}_{time.strftime("%Y%m%d_%H%M%S")}{SNAPSHOT_EXT}'
+    save_snapshot(snapshot, snapshot_file)
+    print(f'Backup done! {len(snapshot["blocks"])} config blocks in {time.monotonic() - started:.2f}s: {snapshot_file}')
+
+@metrics.timed('restore_snapshot')
+def restore_snapshot(port: Optional[str], snapshot_file: str):
+    msp = MspCtr(serial.Serial(wait_port(port), baudrate=BAUDRATE), timeout=MSP_TIMEOUT)
+    started = time.monotonic()
+    try:
+        errors = write_snapshot(msp, load_snapshot(snapshot_file))
+    except ValueError as e:
+        raise FlashError(str(e)) from e
+    finally:
+        msp.close()
+    for name in errors:
+        print(f'{name}\n    rejected by the board', file=sys.stderr)
+    print(f'Restore snapshot done! {len(errors)} errors in {time.monotonic() - started:.2f}s')
+
+def restore_config(port: Optional[str], config_file: str, diff: bool = False):
+    if config_file.endswith(SNAPSHOT_EXT):
+        restore_snapshot(port, config_file)
+    else:
+        restore_backup(port, config_file, diff)
+
+@metrics.timed('blackbox')
+def download_blackbox(port: Optional[str], output: Optional[str], erase: bool = False):
+    port = wait_port(port)
+    output = output or f'blackbox_{time.strftime("%Y%m%d_%H%M%S")}.bbl'
+    started = time.monotonic()
+    if os.path.isfile(output):
+        print(f'Resume {output} from {os.path.getsize(output) // 1024} KB')
+    try:
+        size = blackbox.download_file(lambda: MspCtr(serial.Serial(wait_port(port), baudrate=BAUDRATE), timeout=MSP_TIMEOUT),
+                                      output, blackbox.print_progress)
+    except (RuntimeError, serial.SerialException, OSError) as e:
+        print() # end the progress line
+        raise FlashError(f'blackbox download failed: {e}') from e
+    elapsed = time.monotonic() - started
+    print(f'Blackbox done! {size // 1024} KB in {elapsed:.1f}s ({size / 1024 / max(elapsed, 1e-6):.1f} KB/s): {output}')
+    if erase:
+        msp = MspCtr(serial.Serial(port, baudrate=BAUDRATE), timeout=MSP_TIMEOUT)
+        blackbox.erase(msp)
+        msp.close()
+        print('Dataflash erased')
+
+def poll_telemetry(port: Optional[str], codes: Optional[list[str]], rate: float, duration: float):
+    names = {code.name.removeprefix('MSP_'): code for code in TELEMETRY_CODES}
+    codes = codes or list(names)
+    unknown = [code for code in codes if code.upper() not in names]
+    if unknown:
+        raise FlashError(f'Unknown telemetry {", ".join(unknown)}, choose from {", ".join(names)}')
+    msp = MspCtr(serial.Serial(wait_port(port), baudrate=BAUDRATE), timeout=MSP_TIMEOUT)
+    msp.decode(msp.request(MspCodes.MSP_API_VERSION))
+    poller = TelemetryPoller(msp, {names[code.upper()]: rate for code in codes})
+    stats = poller.run(duration)
+    msp.close()
+    for code, item in stats.items():
+        latest = poller.buffers[code].latest()
+        values = ' '.join(f'{name}={value:g}' for name, value in zip(poller.channels[code].fields, latest or ()))
+        print(f'{code.name:<22} {item.achieved_hz:6.1f}/{item.target_hz:g} Hz {item.received:6d} received {item.dropped:4d} dropped')
+        print(f'    {values[:200]}')
+
+class BoardStatus:
+    """Thread safe per board phase table for the parallel mode."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._rows = {}
+
+    def update(self, board: str, phase: str, error: str = '') -> None:
+        with self._lock:
+            started = self._rows.get(board, (None, None, time.monotonic()))[2]
+            self._rows[board] = (phase, error, started)
+            self._print()
+
+    def _print(self) -> None:
+        print('-' * 60)
+        for board, (phase, error, started) in sorted(self._rows.items()):
+            print(f'{board:<26} {phase:<16} {time.monotonic() - started:6.1f}s {error}')
+        print('-' * 60)
+
+    def summary(self) -> int:
+        with self._lock:
+            failed = [board for board, (phase, _, _) in self._rows.items() if phase == 'FAILED']
+            print(f'Summary: {len(self._rows) - len(failed)} done, {len(failed)} failed')
+            self._print()
+        return len(failed)
+
+def flash_board(serial_number: str, port: Optional[str], hex_file: Optional[str], build_info: Optional[dict],
+                cfg: Optional[str], status: BoardStatus, diff: Optional[str] = None, cfg_diff: bool = False):
+    with metrics.span('board', board=serial_number):
+        if hex_file:
+            if port:
+                status.update(serial_number, 'reboot to DFU')
+                reboot_to_dfu(port)
+            status.update(serial_number, 'wait DFU')
+            device = wait_dfu_device(serial_number)
+            if not device:
+                raise RuntimeError('DFU device not found')
+            status.update(serial_number, 'flash')
+            if not flash(hex_file, build_info, device, progress=None, diff=diff):
+                raise RuntimeError('Flash failed')
+            status.update(serial_number, 'wait VCP')
+            port = wait_vcp_port(serial_number)
+            if not port:
+                raise RuntimeError('COM port not found')
+            status.update(serial_number, 'custom defaults')
+            apply_custom_defaults(port)
+        if cfg:
+            status.update(serial_number, 'restore backup')
+            restore_config(port, cfg, cfg_diff)
+        status.update(serial_number, 'DONE')
+
+def board_ports(include_dfu: bool) -> tuple[dict, dict]:
+    """Attached boards by USB serial number, ``None`` as the port of a board in DFU mode, and
+    the serial numbers more than one board reports, with their ports."""
+    found = {}
+    for item in vcp_ports():
+        if item.serial_number:
+            found.setdefault(item.serial_number, []).append(item.device)
+    if include_dfu:
+        for device in dfu_devices():
+            serial_number = usb_serial(device)
+            if serial_number:
+                found.setdefault(serial_number, []).append(None)
+    boards = {sn: ports[0] for sn, ports in found.items() if len(ports) == 1}
+    duplicates = {sn: ports for sn, ports in found.items() if len(ports) > 1}
+    return boards, duplicates
+
+def flash_all(hex_file: Optional[str], build_info: Optional[dict], cfg: Optional[str], jobs: Optional[int],
+              diff: Optional[str] = None, cfg_diff: bool = False) -> int:
+    boards, duplicates = board_ports(bool(hex_file))
+    boards = {sn: port for sn, port in boards.items() if port or hex_file}
+    if not boards and not duplicates:
+        raise FlashError('No boards found')
+
+    status = BoardStatus()
+    # Boards are found again by serial number after every reboot, boards sharing one can not be told apart
+    for sn, ports in duplicates.items():
+        status.update(sn, 'FAILED', f'reported by {len(ports)} boards ({", ".join(port or "DFU" for port in ports)}), '
+                                    'flash them one at a time')
+    if not boards:
+        return status.summary()
+
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    with ThreadPoolExecutor(max_workers=jobs or len(boards)) as pool:
+        futures = {pool.submit(flash_board, sn, port, hex_file, build_info, cfg, status, diff, cfg_diff): sn for sn, port in boards.items()}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                status.update(futures[future], 'FAILED', str(e) or type(e).__name__)
+    return status.summary()
+
+def usb_location(device: 'usb.core.Device') -> Optional[str]:
+    ports = getattr(device, 'port_numbers', None)
+    return f'{device.bus}-{".".join(map(str, ports))}' if ports else None
+
+def attached_boards() -> list:
+    from batch import Board
+    boards = {item.serial_number: Board(item.serial_number, item.device, item.location)
+              for item in vcp_ports() if item.serial_number}
+    for device in dfu_devices():
+        serial_number = usb_serial(device)
+        if serial_number and serial_number not in boards:
+            boards[serial_number] = Board(serial_number, None, usb_location(device))
+    return list(boards.values())
+
+def fetch_job_firmware(job) -> tuple[str, dict]:
+    build_info = get_build_info(job.target, job.release) if job.target and job.release else {}
+    hex_file = job.hex or fetch_firmware(job.target, job.release, build_info)
+    if not hex_file.endswith(IMAGE_EXT):
+        load_image(hex_file) # parsed once here, every board then loads the cached image
+    return hex_file, build_info
+
+def flash_batch(manifest: str, jobs: Optional[int], retries: int) -> int:
+    from batch import Board, load_batch, match_boards, run_batch
+    try:
+        items = load_batch(manifest)
+    except (OSError, ValueError) as e:
+        raise FlashError(str(e)) from e
 
-        for line in f:
-            if not line or line == '\n' or line[0] == '#':
-                continue
-            com.write(line.encode('ascii'))
-            time.sleep(0.01)
-            rs = com.read_all().decode('ascii')
-            if rs and rs != '\n':
-                print(rs)
-
-        time.sleep(1)
-        com.write(b'save\n')
-        time.sleep(0.5)
-        rs = com.read_all().decode('ascii')
-        if rs and rs != '\n':
-            print(rs)
-        if 'ERROR' in rs:
-            time.sleep(1)
-            com.write(b'save\n')
-            time.sleep(0.5)
-        com.close()
-        print('--------------------')
-        print('Restore backup done!')
+    pairs, missing = match_boards(items, attached_boards())
+    status = BoardStatus()
+    for job in missing:
+        status.update(job.name, 'FAILED', 'not attached')
 
-def main() -> None:
+    def run_job(job, board, hex_file, build_info):
+        if not hex_file and not board.port:
+            raise RuntimeError('COM port not found')
+        flash_board(job.serial, board.port, hex_file, build_info, job.config, status, job.diff, job.cfg_diff)
+
+    def refresh(serial_number):
+        return next((board for board in attached_boards() if board.serial == serial_number), Board(serial_number, None, None))
+
+    run_batch(pairs, fetch_job_firmware, run_job, status, jobs, retries=retries, refresh=refresh)
+    return status.summary()
+
+def run() -> None:
     parser = argparse.ArgumentParser(description='Command line Betaflight flasher')
-    parser.add_argument('-f', dest='hex', help='Intel HEX firmware file')
-    parser.add_argument('-c', dest='cfg', required=False, help='Betaflight config txt file path')
+    parser.add_argument('-f', dest='hex', help=f'Intel HEX or pre-parsed {IMAGE_EXT} firmware file')
+    parser.add_argument('--fetch', action='store_true', help='Download the firmware for the target and release')
+    parser.add_argument('-c', dest='cfg', required=False,
+                        help=f'Betaflight config txt file or MSP {SNAPSHOT_EXT} snapshot path')
+    parser.add_argument('--cfg-diff', dest='cfg_diff', action='store_true',
+                        help='Send only the config lines that differ from the board')
     parser.add_argument('-p', dest='port', required=False, help='COM Port')
     parser.add_argument('-t', dest='target', required=False, help='Betaflight target')
     parser.add_argument('-r', dest='release', required=False, help='Target release version')
+    parser.add_argument('--all', '--parallel', dest='all', action='store_true',
+                        help='Flash and restore every connected board in parallel')
+    parser.add_argument('--diff', nargs='?', const='readback', choices=('readback', 'manifest'),
+                        help='Write only changed flash pages, compared by readback or the last flash manifest')
+    parser.add_argument('-j', dest='jobs', type=int, required=False, help='Parallel workers for --all and batch')
+    parser.add_argument('--offline', action='store_true', help='Take targets, releases and firmware from the local index only')
+    parser.add_argument('--metrics', required=False,
+                        help=f'Write phase timings and counters on exit, Prometheus textfile for {metrics.PROMETHEUS_EXT}, else JSON lines')
+    commands = parser.add_subparsers(dest='command')
+    convert_parser = commands.add_parser('convert', help=f'Convert Intel HEX firmware to the pre-parsed {IMAGE_EXT} format')
+    convert_parser.add_argument('source', help='Intel HEX firmware file')
+    convert_parser.add_argument('-o', dest='output', required=False, help='Output image file')
+    backup_parser = commands.add_parser('backup', help=f'Read the board config over MSP into a {SNAPSHOT_EXT} snapshot')
+    backup_parser.add_argument('-o', dest='output', required=False, help='Output snapshot file')
+    blackbox_parser = commands.add_parser('blackbox', help='Download the blackbox logs from the onboard dataflash')
+    blackbox_parser.add_argument('-o', dest='output', required=False, help='Output log file, an existing file is resumed')
+    blackbox_parser.add_argument('--erase', action='store_true', help='Erase the dataflash after the download')
+    telemetry_parser = commands.add_parser('telemetry', help='Poll live MSP telemetry and report the achieved rate')
+    telemetry_parser.add_argument('codes', nargs='*', help='Telemetry to poll, e.g. RAW_IMU ATTITUDE, default all')
+    telemetry_parser.add_argument('--rate', type=float, default=100, help='Poll rate per code in Hz')
+    telemetry_parser.add_argument('-d', dest='duration', type=float, default=10, help='Poll duration in seconds')
+    prefetch_parser = commands.add_parser('prefetch', help='Fill the local release index and build info for offline use')
+    prefetch_parser.add_argument('targets', nargs='+', help='Betaflight targets')
+    prefetch_parser.add_argument('--all-releases', action='store_true', help='Every stable release instead of the latest')
+    prefetch_parser.add_argument('--firmware', action='store_true', help='Download the firmware too')
+    search_parser = commands.add_parser('search', help='Search the targets of the release index')
+    search_parser.add_argument('query', nargs='?', default='', help='Part of the target name')
+    batch_parser = commands.add_parser('batch', help='Flash and configure the boards listed in a JSON or TOML manifest')
+    batch_parser.add_argument('manifest', help='Manifest mapping board serials or USB locations to firmware and config')
+    batch_parser.add_argument('--retries', type=int, default=2, help='Attempts after a failure per board')
     args = parser.parse_args()
+    if args.metrics:
+        metrics.write_on_exit(args.metrics)
+    global _offline
+    _offline = args.offline
+
+    if args.command == 'convert':
+        convert(args.source, args.output)
+        return
+    if args.command == 'backup':
+        backup_snapshot(args.port, args.output)
+        return
+    if args.command == 'blackbox':
+        download_blackbox(args.port, args.output, args.erase)
+        return
+    if args.command == 'telemetry':
+        poll_telemetry(args.port, args.codes, args.rate, args.duration)
+        return
+    if args.command == 'prefetch':
+        sys.exit(1 if prefetch(args.targets, args.all_releases, args.firmware) else 0)
+    if args.command == 'search':
+        search_targets(args.query)
+        return
+    if args.command == 'batch':
+        sys.exit(1 if flash_batch(args.manifest, args.jobs, args.retries) else 0)
 
     port = args.port
 
-    if args.hex:
-        if not os.path.isfile(args.hex):
+    if args.all:
+        if args.cfg and not os.path.isfile(args.cfg):
+            print(f'File not fount: {args.cfg}', file=sys.stderr)
+            sys.exit(-1)
+        build_info = None
+        hex_file = args.hex
+        if args.hex or args.fetch:
+            if args.hex and not os.path.isfile(args.hex):
+                print(f'File not fount: {args.hex}', file=sys.stderr)
+                sys.exit(-1)
+            hex_items = os.path.basename(args.hex).split('_') if args.hex else ()
+            ports = vcp_ports()
+            target = hex_items[3] if len(hex_items) > 3 else args.target or (ports and detect_target(ports[0].device))
+            release = hex_items[1] if len(hex_items) > 1 else args.release or (target and get_release(target))
+            if not target or not release:
+                print('ERROR: Target and release must be specified for parallel mode', file=sys.stderr)
+                sys.exit(-1)
+            build_info = get_build_info(target, release)
+            hex_file = args.hex or fetch_firmware(target, release, build_info)
+        sys.exit(1 if flash_all(hex_file, build_info, args.cfg, args.jobs, args.diff, args.cfg_diff) else 0)
+
+    if args.hex or args.fetch:
+        if args.hex and not os.path.isfile(args.hex):
             print(f'File not fount: {args.hex}', file=sys.stderr)
             sys.exit(-1)
-        hex_items = os.path.basename(args.hex).split('_')
+        hex_items = os.path.basename(args.hex).split('_') if args.hex else ()
         target = hex_items[3] if len(hex_items) > 3 else args.target or detect_target(port)
         if not target:
             print('ERROR: Target is not specified', file=sys.stderr)
@@ -271,15 +689,23 @@ def main() -> None:
         if not build_info:
             print(f'ERROR: Impossible to get information about target: {target} {release}', file=sys.stderr)
             sys.exit(-1)
+        hex_file = args.hex or fetch_firmware(target, release, build_info)
         to_dfu_mode(port)
-        flash(args.hex, build_info)
+        flash(hex_file, build_info, diff=args.diff)
         apply_custom_defaults(port)
 
     if args.cfg:
         if not os.path.isfile(args.cfg):
             print(f'File not fount: {args.hex}', file=sys.stderr)
             sys.exit(-1)
-        restore_backup(port, args.cfg)
+        restore_config(port, args.cfg, args.cfg_diff)
+
+def main() -> None:
+    try:
+        run()
+    except FlashError as e:
+        print(f'ERROR: {e}', file=sys.stderr)
+        sys.exit(-1)
 
 if __name__ == "__main__":
     main()
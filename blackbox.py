@@ -0,0 +1,158 @@
+import os
+import struct
+import time
+from typing import Callable, NamedTuple, Optional
+
+import serial
+
+import huffman
+import metrics
+from dfu_flash import Progress
+from msp import MspCtr
+from msp_codes import MspCodes
+from msp_data import MspRecType
+
+DATAFLASH_SUMMARY = struct.Struct('<BIII') # flags, sectors, total size, used size
+DATAFLASH_READ = struct.Struct('<IHB') # address, size, allow compression
+DATAFLASH_REPLY = struct.Struct('<IHB') # address, size, compression method
+HUFFMAN_INFO = struct.Struct('<H') # uncompressed size, ahead of the compressed data
+DATAFLASH_READY = 0x01
+DATAFLASH_SUPPORTED = 0x02
+NO_COMPRESSION = 0
+
+# Reads larger than this go past the MSP buffer of the firmware and come back short
+READ_SIZE = 4096
+BATCH = 64 # reads queued per request_many call, WINDOW of them in flight
+WINDOW = 8
+STRIDE_MARGIN = 15 # sixteenths of the data of a compressed reply, the next requests start before its end
+RETRIES = 5
+ERASE_TIMEOUT = 120
+
+
+class DataflashSummary(NamedTuple):
+    ready: bool
+    supported: bool
+    sectors: int
+    total_size: int
+    used_size: int
+
+
+def read_summary(msp: MspCtr) -> DataflashSummary:
+    flags, sectors, total_size, used_size = DATAFLASH_SUMMARY.unpack_from(msp.request(MspCodes.MSP_DATAFLASH_SUMMARY).payload)
+    return DataflashSummary(bool(flags & DATAFLASH_READY), bool(flags & DATAFLASH_SUPPORTED), sectors, total_size, used_size)
+
+def read_chunks(msp: MspCtr, address: int, end: int, read_size: int = READ_SIZE,
+                batch: int = BATCH, window: int = WINDOW, compression: bool = True,
+                stride: Optional[int] = None) -> list[memoryview]:
+    """Contiguous data from ``address`` up to ``end``, read with up to ``batch`` pipelined requests.
+
+    The firmware may answer with less than asked for, the data after a short reply
+    is dropped and read again by the next call. With ``compression`` the firmware
+    may Huffman code its replies, firmware without it ignores the flag. A compressed
+    reply fills ``read_size`` with coded data, so it covers more than was asked for;
+    ``stride`` spaces the requests by the data a reply is expected to cover.
+    """
+    requests = []
+    for offset in range(address, end, stride or read_size):
+        if len(requests) == batch:
+            break
+        # A compressed read asks for the full size, the firmware sends nothing when 256 bytes do not fit
+        size = read_size if compression else min(read_size, end - offset)
+        requests.append((MspCodes.MSP_DATAFLASH_READ, *DATAFLASH_READ.pack(offset, size, int(compression))))
+
+    chunks = []
+    position = address
+    for rec in msp.request_many(requests, window=window):
+        if rec.type != MspRecType.RESPONSE:
+            raise RuntimeError('Dataflash read is not supported')
+        reply_address, size, method = DATAFLASH_REPLY.unpack_from(rec.payload)
+        data = rec.payload[DATAFLASH_REPLY.size:DATAFLASH_REPLY.size + size]
+        if method == huffman.HUFFMAN:
+            try:
+                data = memoryview(huffman.decode(data[HUFFMAN_INFO.size:], HUFFMAN_INFO.unpack_from(data)[0]))
+            except (ValueError, struct.error) as e:
+                raise RuntimeError(f'Broken compressed dataflash reply: {e}') from e
+        elif method != NO_COMPRESSION:
+            raise RuntimeError(f'Unsupported dataflash compression method {method}')
+        # The replies after a longer compressed one overlap it, their data is used from the position on
+        if not reply_address <= position < reply_address + len(data):
+            if reply_address == position:
+                break # empty, the end of the flash
+            continue
+        data = data[position - reply_address:end - reply_address]
+        chunks.append(data)
+        position += len(data)
+        if position >= end:
+            break
+    return chunks
+
+def download(msp: MspCtr, f, end: int, progress: Optional[Progress] = None, started: Optional[float] = None,
+             first: int = 0) -> int:
+    """Append the flash content from the file position up to ``end`` and return the new position."""
+    position = f.tell()
+    started = started or time.monotonic()
+    stride = READ_SIZE
+    batch = 1 # a single read first, it tells how far a compressed reply goes
+    while position < end:
+        chunks = read_chunks(msp, position, end, batch=batch, stride=stride)
+        if not chunks:
+            break
+        # The first chunk is a whole reply, space the next requests by what compressed replies cover
+        stride = max(READ_SIZE, len(chunks[0]) * STRIDE_MARGIN // 16)
+        batch = BATCH
+        for chunk in chunks:
+            f.write(chunk)
+            position += len(chunk)
+        if progress:
+            progress(position, end, (position - first) / max(time.monotonic() - started, 1e-6))
+    f.flush()
+    return position
+
+def verify_tail(msp: MspCtr, path: str, size: int, read_size: int = READ_SIZE) -> bool:
+    """Compare the end of a partial download with the flash, so a resume never mixes two logs."""
+    start = max(size - read_size, 0)
+    with open(path, 'rb') as f:
+        f.seek(start)
+        expected = f.read()
+    return b''.join(read_chunks(msp, start, size, read_size)) == expected
+
+def download_file(connect: Callable[[], MspCtr], path: str, progress: Optional[Progress] = None,
+                  retries: int = RETRIES) -> int:
+    """Download the used part of the dataflash to ``path``, resuming a partial file and dropped connections."""
+    started = time.monotonic()
+    first = os.path.getsize(path) if os.path.isfile(path) else 0
+    with open(path, 'ab') as f:
+        for attempt in range(retries + 1):
+            msp = None
+            try:
+                msp = connect()
+                summary = read_summary(msp)
+                if not summary.supported:
+                    raise RuntimeError('No dataflash on this board')
+                position = f.tell()
+                if position > summary.used_size or position and not verify_tail(msp, path, position):
+                    raise RuntimeError(f'{path} does not match the flash content')
+                return download(msp, f, summary.used_size, progress, started, first)
+            except (serial.SerialException, TimeoutError, OSError):
+                f.flush()
+                if attempt == retries:
+                    raise
+                metrics.count('retries', phase='blackbox')
+            finally:
+                if msp:
+                    try:
+                        msp.close()
+                    except (serial.SerialException, OSError):
+                        pass
+
+def print_progress(done: int, total: int, rate: float) -> None:
+    print(f'\rBlackbox: {done * 100 // max(total, 1):3d}% {done // 1024} KB {rate / 1024:.1f} KB/s', end='\n' if done == total else '')
+
+def erase(msp: MspCtr, timeout: float = ERASE_TIMEOUT) -> None:
+    msp.request(MspCodes.MSP_DATAFLASH_ERASE)
+    deadline = time.monotonic() + timeout
+    # The erase runs in the background, the flash reports ready once it is done
+    while not read_summary(msp).ready:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f'Dataflash erase not finished in {timeout}s')
+        time.sleep(0.5)
@@ -0,0 +1,96 @@
+import mmap
+import os
+import struct
+import time
+from typing import Iterator, Optional
+
+# Capture file: header, then one record per chunk read from either side of the link
+CAPTURE_MAGIC = b'BFCAP\0'
+CAPTURE_VERSION = 1
+CAPTURE_HEADER = struct.Struct('<6sHd') # magic, version, wall clock start time
+CAPTURE_RECORD = struct.Struct('<QBI') # ns since start, direction, size
+CAPTURE_EXT = '.bfcap'
+
+# Directions
+HOST_TO_FC = 0
+FC_TO_HOST = 1
+
+BUFFER_SIZE = 64 * 1024
+FSYNC_INTERVAL = 1.0
+
+
+class CaptureWriter:
+    """Timestamped capture log, buffered in memory and synced to disk every ``fsync_interval`` seconds."""
+
+    def __init__(self, path: str, buffer_size: int = BUFFER_SIZE, fsync_interval: float = FSYNC_INTERVAL) -> None:
+        self.path = path
+        self.buffer_size = buffer_size
+        self.fsync_interval = fsync_interval
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        self._buf = bytearray(CAPTURE_HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION, time.time()))
+        self._started = time.monotonic_ns()
+        self._synced = time.monotonic()
+        self.records = 0
+
+    def write(self, direction: int, data: bytes, timestamp_ns: Optional[int] = None) -> None:
+        if timestamp_ns is None:
+            timestamp_ns = time.monotonic_ns() - self._started
+        self._buf += CAPTURE_RECORD.pack(timestamp_ns, direction, len(data))
+        self._buf += data
+        self.records += 1
+        if len(self._buf) >= self.buffer_size:
+            self.flush()
+        self.tick()
+
+    def flush(self) -> None:
+        written = os.write(self._fd, self._buf)
+        while written < len(self._buf):
+            written += os.write(self._fd, self._buf[written:])
+        self._buf.clear()
+
+    def tick(self) -> None:
+        """Flush and fsync once the interval has passed, called by the writer loop when idle."""
+        if time.monotonic() - self._synced >= self.fsync_interval:
+            self.flush()
+            os.fsync(self._fd)
+            self._synced = time.monotonic()
+
+    def close(self) -> None:
+        if self._fd < 0:
+            return
+        self.flush()
+        os.fsync(self._fd)
+        os.close(self._fd)
+        self._fd = -1
+
+    def __enter__(self) -> 'CaptureWriter':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def open_capture(path: str) -> tuple[float, memoryview]:
+    """Map a capture, return its wall clock start time and the view of all records."""
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b''
+    view = memoryview(mapped)
+    if len(view) < CAPTURE_HEADER.size:
+        raise ValueError(f'Not a capture file: {path}')
+    magic, version, started = CAPTURE_HEADER.unpack_from(view)
+    if magic != CAPTURE_MAGIC or version != CAPTURE_VERSION:
+        raise ValueError(f'Not a capture file: {path}')
+    return started, view[CAPTURE_HEADER.size:]
+
+def read_capture(path: str) -> Iterator[tuple[int, int, memoryview]]:
+    """``(ns since start, direction, data)`` for every record, a record cut off at the end is skipped."""
+    _, view = open_capture(path)
+    offset = 0
+    end = len(view)
+    while offset + CAPTURE_RECORD.size <= end:
+        timestamp, direction, size = CAPTURE_RECORD.unpack_from(view, offset)
+        offset += CAPTURE_RECORD.size
+        if offset + size > end:
+            break
+        yield timestamp, direction, view[offset:offset + size]
+        offset += size
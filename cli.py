@@ -0,0 +1,137 @@
+import re
+import time
+from collections import deque
+from typing import Iterable, NamedTuple, Optional
+
+import serial
+
+import metrics
+
+PROMPT = b'\r\n# '
+# Comment sent after the last line, the response before it ends where its echo starts
+MARKER = b'# bf_flash'
+MARKER_ECHO = MARKER + b'\r\n'
+ERROR_RE = re.compile(r'^(###ERROR.*|ERROR.*)$', re.MULTILINE)
+
+
+class CliResult(NamedTuple):
+    line: str
+    output: str
+    error: Optional[str]
+
+
+class CliSession:
+    """Betaflight CLI driven by its ``# `` prompt instead of fixed sleeps.
+
+    Lines are pipelined while the unanswered bytes fit into the firmware receive
+    buffer. Every response is split off at the prompt that is followed by the echo
+    of the next line, so errors are reported against the line that caused them.
+    """
+    RX_BUFFER_SIZE = 256
+
+    def __init__(self, port: serial.Serial, rx_buffer: int = RX_BUFFER_SIZE, timeout: float = 5) -> None:
+        self.port = port
+        self.rx_buffer = rx_buffer
+        self.timeout = timeout
+        self._buf = bytearray()
+
+    def close(self) -> None:
+        self.port.close()
+
+    def _read(self, timeout: float) -> bool:
+        self.port.timeout = timeout
+        data = self.port.read(self.port.in_waiting or 1)
+        self._buf += data
+        return bool(data)
+
+    def _wait_prompt(self, next_echo: bytes) -> bytes:
+        """Cut one response off the buffer, ``next_echo`` is the echo expected after the prompt,
+        empty to take the first prompt."""
+        deadline = time.monotonic() + self.timeout
+        pos = 0
+        while True:
+            idx = self._buf.find(PROMPT, pos)
+            if idx >= 0:
+                rest = self._buf[idx + len(PROMPT):]
+                # '# ' also starts comment lines in dump output, a prompt is followed by the next echo
+                if len(rest) < len(next_echo) and next_echo.startswith(rest):
+                    pass
+                elif rest.startswith(next_echo):
+                    response = bytes(self._buf[:idx])
+                    del self._buf[:idx + len(PROMPT)]
+                    return response
+                else:
+                    pos = idx + 1
+                    continue
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f'CLI prompt not received in {self.timeout}s')
+            self._read(remaining)
+
+    def enter(self) -> None:
+        # '#' switches from MSP to CLI, the newline makes it a comment when already in CLI
+        self.port.write(b'#\n' + MARKER + b'\n')
+        self._wait_prompt(MARKER_ECHO)
+        self._wait_prompt(b'')
+
+    def run(self, lines: Iterable[str]) -> list[CliResult]:
+        results = []
+        pending = deque() # (line, echo)
+        in_flight = 0
+
+        def receive():
+            nonlocal in_flight
+            line, echo = pending.popleft()
+            in_flight -= len(echo)
+            if line is None:
+                self._wait_prompt(b'') # the marker, nothing follows its prompt
+                return
+            response = self._wait_prompt(pending[0][1])
+            if response.startswith(echo):
+                response = response[len(echo):]
+            output = response.decode('ascii', errors='replace').strip('\r\n')
+            error = ERROR_RE.search(output)
+            results.append(CliResult(line, output, error.group(0).strip() if error else None))
+
+        def send(line: Optional[str], data: bytes):
+            nonlocal in_flight
+            echo = data + b'\r\n'
+            while pending and in_flight + len(echo) > self.rx_buffer:
+                receive()
+            self.port.write(data + b'\n')
+            metrics.count('cli_bytes_written', len(echo))
+            pending.append((line, echo))
+            in_flight += len(echo)
+
+        for line in lines:
+            line = line.strip()
+            if line:
+                send(line, line.encode('ascii'))
+        if pending:
+            # Output can pause after a '# ' comment line, only the marker echo safely ends the last response
+            send(None, MARKER)
+        while pending:
+            receive()
+        return results
+
+    def command(self, line: str) -> CliResult:
+        return self.run((line,))[0]
+
+    def save(self) -> Optional[str]:
+        """Send ``save`` and wait for the reboot, return the error reported instead if any."""
+        self.port.write(b'save\n')
+        deadline = time.monotonic() + self.timeout
+        while b'Rebooting' not in self._buf:
+            error = ERROR_RE.search(self._buf.decode('ascii', errors='replace'))
+            if error and PROMPT in self._buf[error.end():]:
+                return error.group(0).strip()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f'CLI save not confirmed in {self.timeout}s')
+            try:
+                self._read(remaining)
+            except serial.SerialException:
+                break # the port disappears when the board reboots
+        self._buf.clear()
+        return None
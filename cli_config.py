@@ -0,0 +1,132 @@
+from typing import Iterable, Optional
+
+MASTER = ('master',)
+
+# Number of arguments after the command that identify an entry, e.g. `aux 3 ...` or `resource MOTOR 1 ...`
+IDENT_ARGS = {
+    'board_name': 0,
+    'manufacturer_id': 0,
+    'signature': 0,
+    'mixer': 0,
+    'map': 0,
+    'name': 0,
+    'resource': 2,
+    'timer': 1,
+    'dma': 2,
+    'serial': 1,
+    'aux': 1,
+    'adjrange': 1,
+    'rxrange': 1,
+    'rxfail': 1,
+    'led': 1,
+    'color': 1,
+    'mode_color': 2,
+    'vtx': 1,
+    'servo': 1,
+    'smix': 1,
+    'mmix': 1,
+    'osd_layout': 1,
+}
+# Commands that take a list of names, `-NAME` clears one
+FLAG_COMMANDS = ('feature', 'beeper', 'beacon')
+# Commands with no state of their own or, like mcu_id, state that can not be set
+IGNORED_COMMANDS = ('batch', 'defaults', 'save', 'diff', 'dump', 'exit', 'version', 'status', 'mcu_id')
+# Free text settings such as craft_name, pilot_name and box_user_1_name keep their case,
+# other values are numbers or table names the firmware matches case insensitively
+TEXT_SETTING = 'name'
+TEXT_SETTING_SUFFIX = '_name'
+
+
+def entry_key(scope: tuple, line: str) -> Optional[tuple]:
+    words = line.split()
+    command = words[0].lower()
+    if command in IGNORED_COMMANDS:
+        return None
+    if command == 'set':
+        name = line[3:].partition('=')[0].strip().lower()
+        return scope, 'set', name
+    if command in FLAG_COMMANDS and len(words) > 1:
+        return MASTER, command, words[1].lstrip('-').upper()
+    if command == 'vtxtable' and len(words) > 1:
+        return MASTER, command, ' '.join(words[1:3] if words[1] == 'band' else words[1:2])
+    if command in IDENT_ARGS:
+        return MASTER, command, ' '.join(words[1:1 + IDENT_ARGS[command]])
+    return MASTER, command, ' '.join(words[1:])
+
+def normalize(line: str) -> str:
+    line = ' '.join(line.split())
+    if line.startswith('set '):
+        name, _, value = line[4:].partition('=')
+        name, value = name.strip().lower(), value.strip()
+        if name != TEXT_SETTING and not name.endswith(TEXT_SETTING_SUFFIX):
+            value = value.lower()
+        return f'set {name} = {value}'
+    return line
+
+
+class BetaflightConfig:
+    """Settings parsed from ``dump``/``diff`` output or a backup file.
+
+    Every entry is keyed by ``(scope, command, ident)`` where scope is master or a
+    ``('profile', n)``/``('rateprofile', n)`` selection, so two configs can be compared
+    entry by entry and only the differing lines sent.
+    """
+
+    def __init__(self) -> None:
+        self.entries = {}
+        self.selected = {}
+
+    @classmethod
+    def parse(cls, lines: Iterable[str]) -> 'BetaflightConfig':
+        config = cls()
+        scope = MASTER
+        for line in lines:
+            line = line.strip()
+            if not line or line[0] == '#':
+                continue
+            words = line.split()
+            if words[0] in ('profile', 'rateprofile') and len(words) == 2 and words[1].isdigit():
+                scope = (words[0], int(words[1]))
+                config.selected[words[0]] = int(words[1])
+                continue
+            key = entry_key(scope, line)
+            if key:
+                config.entries[key] = line
+        return config
+
+    @classmethod
+    def parse_text(cls, text: str) -> 'BetaflightConfig':
+        return cls.parse(text.splitlines())
+
+    def diff(self, current: 'BetaflightConfig') -> tuple[list[tuple], list[tuple]]:
+        """Entries that differ from ``current`` as ``(key, line)`` and the keys only ``current`` has.
+
+        For a config made with ``diff`` a missing key means the default value, which
+        the caller has to restore separately.
+        """
+        changed = [(key, line) for key, line in self.entries.items()
+                   if key not in current.entries or normalize(current.entries[key]) != normalize(line)]
+        extra = [key for key in current.entries if key not in self.entries]
+        return changed, extra
+
+    def restore_lines(self, items: Iterable[tuple], current_selected: Optional[dict] = None) -> list[str]:
+        """CLI lines for ``(key, line)`` items with the profile switches they need.
+
+        The profile selection of this config is restored at the end when it was
+        switched or differs from ``current_selected``.
+        """
+        result = []
+        scope = MASTER
+        switched = False
+        for key, line in sorted(items, key=lambda item: item[0][0] != MASTER):
+            if key[0] != scope and key[0] != MASTER:
+                scope = key[0]
+                result.append(f'{scope[0]} {scope[1]}')
+                switched = True
+            result.append(line)
+        current_selected = current_selected or {}
+        for name in ('profile', 'rateprofile'):
+            value = self.selected.get(name, current_selected.get(name))
+            if value is not None and (switched or current_selected.get(name, value) != value):
+                result.append(f'{name} {value}')
+        return result
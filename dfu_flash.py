@@ -0,0 +1,238 @@
+import hashlib
+import struct
+import time
+from typing import TYPE_CHECKING, Callable, Optional
+
+import metrics
+
+if TYPE_CHECKING:
+    import usb
+
+# DFU class requests
+DFU_DNLOAD = 1
+DFU_UPLOAD = 2
+DFU_GETSTATUS = 3
+DFU_CLRSTATUS = 4
+DFU_ABORT = 6
+DFU_REQUEST_SEND = 0x21
+DFU_REQUEST_RECV = 0xA1
+
+# DFU states
+DFU_STATE_IDLE = 0x02
+DFU_STATE_DNBUSY = 0x04
+DFU_STATE_DNLOAD_IDLE = 0x05
+DFU_STATE_MANIFEST = 0x07
+DFU_STATE_ERROR = 0x0A
+
+# bcdDFUVersion of ST's DfuSe extension, other devices get plain DFU 1.1 downloads
+DFUSE_VERSION = 0x011A
+
+# DfuSe commands, sent as block 0 downloads
+DFUSE_SET_ADDRESS = 0x21
+DFUSE_ERASE = 0x41
+# DfuSe data blocks start at 2, block n is written to address + (n - 2) * transfer size
+DFUSE_FIRST_BLOCK = 2
+
+TIMEOUT_MS = 5000
+
+Progress = Callable[[int, int, float], None] # done bytes, total bytes, bytes per second
+
+
+def get_status(device, interface: int) -> tuple[int, int]:
+    status = device.ctrl_transfer(DFU_REQUEST_RECV, DFU_GETSTATUS, 0, interface, 6, TIMEOUT_MS)
+    return status[4], status[1] | status[2] << 8 | status[3] << 16
+
+def clear_status(device, interface: int) -> None:
+    device.ctrl_transfer(DFU_REQUEST_SEND, DFU_CLRSTATUS, 0, interface, None, TIMEOUT_MS)
+
+def dnload(device, interface: int, block: int, data) -> None:
+    device.ctrl_transfer(DFU_REQUEST_SEND, DFU_DNLOAD, block, interface, data, TIMEOUT_MS)
+    while True:
+        state, poll_timeout = get_status(device, interface)
+        if state == DFU_STATE_ERROR:
+            raise RuntimeError('DFU device error')
+        if state in (DFU_STATE_IDLE, DFU_STATE_DNLOAD_IDLE, DFU_STATE_MANIFEST):
+            return
+        if state == DFU_STATE_DNBUSY and poll_timeout:
+            time.sleep(poll_timeout / 1000)
+            metrics.count('wait_seconds', poll_timeout / 1000, reason='dfu_busy')
+
+def abort(device, interface: int) -> None:
+    device.ctrl_transfer(DFU_REQUEST_SEND, DFU_ABORT, 0, interface, None, TIMEOUT_MS)
+
+def dfuse_command(device, interface: int, command: int, address: int) -> None:
+    dnload(device, interface, 0, struct.pack('<BI', command, address))
+
+def upload(device, interface: int, address: int, size: int, transfer_size: int) -> bytes:
+    dfuse_command(device, interface, DFUSE_SET_ADDRESS, address)
+    abort(device, interface)
+    result = bytearray()
+    for block, offset in enumerate(range(0, size, transfer_size), DFUSE_FIRST_BLOCK):
+        length = min(transfer_size, size - offset)
+        result += device.ctrl_transfer(DFU_REQUEST_RECV, DFU_UPLOAD, block, interface, length, TIMEOUT_MS)
+    abort(device, interface)
+    return bytes(result)
+
+def page_spans(layout: list, address: int, size: int) -> list[tuple[int, int, int]]:
+    """``(page address, start, end)`` offsets into the data for every page overlapping it."""
+    spans = []
+    for segment in layout:
+        for page in range(segment.num_pages):
+            page_addr = segment.addr + page * segment.page_size
+            if page_addr < address + size and address < page_addr + segment.page_size:
+                start = max(page_addr - address, 0)
+                spans.append((page_addr, start, min(page_addr + segment.page_size - address, size)))
+    return spans
+
+def erase_pages(layout: list, address: int, size: int) -> list[int]:
+    """Start addresses of the pages overlapping ``[address, address + size)``."""
+    return [page for page, _, _ in page_spans(layout, address, size)]
+
+def is_blank(data: memoryview) -> bool:
+    return not data.tobytes().translate(None, b'\xff')
+
+def page_hashes(layout: list, data, address: int) -> dict[int, str]:
+    data = memoryview(data)
+    return {page: hashlib.blake2b(data[start:end], digest_size=16).hexdigest()
+            for page, start, end in page_spans(layout, address, len(data))}
+
+def diff_readback(device, interface: int, data, address: int, transfer_size: int, layout: list) -> list[int]:
+    """Pages whose current flash content differs from ``data``, read back with DFU upload."""
+    data = memoryview(data)
+    return [page for page, start, end in page_spans(layout, address, len(data))
+            if upload(device, interface, address + start, end - start, transfer_size) != data[start:end]]
+
+def diff_manifest(layout: list, data, address: int, manifest: dict) -> list[int]:
+    """Pages that differ from the hashes saved by the last flash.
+
+    Blank pages are always kept: the firmware stores its config in flash at runtime,
+    so an erased page in the manifest says nothing about what is there now.
+    """
+    data = memoryview(data)
+    hashes = page_hashes(layout, data, address)
+    return [page for page, start, end in page_spans(layout, address, len(data))
+            if manifest.get(page) != hashes[page] or is_blank(data[start:end])]
+
+def download(device, interface: int, data, address: int, transfer_size: int, layout: list,
+             progress: Optional[Progress] = None, pages: Optional[list] = None, verify: bool = False) -> None:
+    """Erase and write ``data`` at ``address`` straight from memory in ``transfer_size`` blocks.
+
+    ``pages`` limits the erase and write to those page addresses. Blank pages are only
+    erased. With ``verify`` the written ranges are read back and compared.
+    """
+    data = memoryview(data)
+    spans = page_spans(layout, address, len(data))
+    if pages is not None:
+        spans = [span for span in spans if span[0] in pages]
+    with metrics.span('dfu_erase'):
+        for page_addr, _, _ in spans:
+            dfuse_command(device, interface, DFUSE_ERASE, page_addr)
+    metrics.count('dfu_pages_erased', len(spans))
+
+    runs = []
+    for _, start, end in spans:
+        if is_blank(data[start:end]):
+            continue
+        if runs and runs[-1][1] == start:
+            runs[-1][1] = end
+        else:
+            runs.append([start, end])
+
+    total = sum(end - start for start, end in runs)
+    done = 0
+    started = time.monotonic()
+    with metrics.span('dfu_write'):
+        for start, end in runs:
+            dfuse_command(device, interface, DFUSE_SET_ADDRESS, address + start)
+            for block, offset in enumerate(range(start, end, transfer_size), DFUSE_FIRST_BLOCK):
+                chunk = data[offset:min(offset + transfer_size, end)]
+                dnload(device, interface, block, chunk)
+                done += len(chunk)
+                if progress:
+                    progress(done, total, done / max(time.monotonic() - started, 1e-6))
+    metrics.count('dfu_bytes_written', done)
+
+    if verify:
+        with metrics.span('dfu_verify'):
+            for start, end in runs:
+                if upload(device, interface, address + start, end - start, transfer_size) != data[start:end]:
+                    raise RuntimeError(f'Verify failed at 0x{address + start:08X}')
+
+    # Jump to the application and leave DFU mode with an empty download
+    import usb.core
+    dfuse_command(device, interface, DFUSE_SET_ADDRESS, address)
+    try:
+        dnload(device, interface, 0, None)
+    except usb.core.USBError:
+        pass
+
+def download_plain(device, interface: int, data, transfer_size: int, progress: Optional[Progress] = None) -> None:
+    """Plain DFU download: numbered blocks from the start, the bootloader decides where they go."""
+    import usb.core
+    data = memoryview(data)
+    started = time.monotonic()
+    with metrics.span('dfu_write'):
+        for block, offset in enumerate(range(0, len(data), transfer_size)):
+            chunk = data[offset:offset + transfer_size]
+            dnload(device, interface, block & 0xFFFF, chunk)
+            done = offset + len(chunk)
+            if progress:
+                progress(done, len(data), done / max(time.monotonic() - started, 1e-6))
+    metrics.count('dfu_bytes_written', len(data))
+    # An empty download ends it and starts the manifestation
+    try:
+        dnload(device, interface, 0, None)
+    except usb.core.USBError:
+        pass
+
+def flash_device(device: 'usb.core.Device', data, address: int, interface: int = 0,
+                 progress: Optional[Progress] = None, diff: Optional[str] = None,
+                 manifest: Optional[dict] = None) -> dict[int, str]:
+    """Flash ``data`` and return the page hashes to save as the manifest for the next diff.
+
+    ``diff`` is ``None`` for a full flash, ``'readback'`` to compare against the flash
+    content or ``'manifest'`` to compare against ``manifest``, falling back to readback.
+    Devices without DfuSe get a plain DFU download of everything and no manifest.
+    """
+    # pyusb and pyfu_usb are only loaded for flashing, they make up most of the start up time
+    import usb.core
+    import usb.util
+    from pyfu_usb import descriptor
+    try:
+        usb.util.claim_interface(device, interface)
+        dfu_desc = descriptor.get_dfu_descriptor(device)
+        if dfu_desc is None:
+            raise ValueError('No DFU descriptor, is this a valid DFU device?')
+        transfer_size = dfu_desc.wTransferSize
+        try:
+            state, _ = get_status(device, interface)
+        except usb.core.USBError as e:
+            if 'pipe error' not in str(e).lower():
+                raise
+            state = DFU_STATE_ERROR
+        if state == DFU_STATE_ERROR:
+            # Clear a status left over from a previous session
+            clear_status(device, interface)
+
+        if dfu_desc.bcdDFUVersion != DFUSE_VERSION:
+            # No page layout or addressing, so no diff either
+            if diff:
+                print('Diff: not supported by plain DFU devices, flashing everything')
+            download_plain(device, interface, data, transfer_size, progress)
+            return {}
+
+        layout = descriptor.get_memory_layout(device, interface)
+        pages = None
+        if diff == 'manifest' and manifest:
+            pages = diff_manifest(layout, data, address, manifest)
+        elif diff:
+            pages = diff_readback(device, interface, data, address, transfer_size, layout)
+        if pages is not None:
+            print(f'Diff: {len(pages)} of {len(page_spans(layout, address, len(data)))} pages changed')
+        download(device, interface, data, address, transfer_size, layout, progress, pages, verify=diff is not None)
+        return page_hashes(layout, data, address)
+    finally:
+        usb.util.dispose_resources(device)
+
+def print_progress(done: int, total: int, rate: float) -> None:
+    print(f'\rFlash: {done * 100 // total:3d}% {done // 1024} KB {rate / 1024:.1f} KB/s', end='\n' if done == total else '')
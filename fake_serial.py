@@ -0,0 +1,37 @@
+"""In memory serial port and MSP v1 responses for the tests and benchmarks."""
+import random
+
+from msp import xor_checksum
+from msp_codes import MspCodes
+
+def response_v1(code: int, payload: bytes) -> bytes:
+    body = bytes((len(payload), code)) + payload
+    return b'$M>' + body + bytes((xor_checksum(body),))
+
+def random_frames(count: int) -> list[bytes]:
+    rnd = random.Random(1)
+    return [response_v1(MspCodes.MSP_BOARD_INFO, rnd.randbytes(rnd.randrange(0, 255))) for _ in range(count)]
+
+
+class FakeSerial:
+    def __init__(self, data: bytes = b'', chunk: int = 64) -> None:
+        self.data = bytearray(data)
+        self.chunk = chunk
+        self.timeout = None
+        self.written = bytearray()
+
+    @property
+    def in_waiting(self) -> int:
+        return min(len(self.data), self.chunk)
+
+    def read(self, size: int = 1) -> bytes:
+        result = bytes(self.data[:size])
+        del self.data[:size]
+        return result
+
+    def write(self, data: bytes) -> int:
+        self.written += data
+        return len(data)
+
+    def close(self) -> None:
+        pass
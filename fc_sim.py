@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+
+import argparse
+import math
+import os
+import random
+import select
+import struct
+import threading
+import time
+import tty
+from typing import Optional
+
+from pyfu_usb.descriptor import DfuSeMemoryLayout
+
+import dfu_flash
+import huffman
+from msp import MspCodec, MspFramer, crc8_dvb_s2, xor_checksum
+from msp_codes import MspCodes
+from msp_schema import encode_payload
+from msp_snapshot import CONFIG_BLOCKS
+
+API_VERSION = (1, 46)
+FC_VERSION = (4, 5, 1)
+BOARD = {
+    'board_identifier': 'S405',
+    'board_version': 0,
+    'board_type': 2,
+    'target_capabilities': 0x35,
+    'target_name': 'STM32F405',
+    'board_name': 'SIMF405',
+    'manufacturer_id': 'SIM',
+    'signature': bytes(32),
+    'mcu_type_id': 1,
+    'configuration_state': 2,
+    'sample_rate_hz': 8000,
+    'configuration_problems': 0,
+}
+SETTINGS = {
+    'gyro_lpf1_static_hz': '250',
+    'dyn_notch_count': '3',
+    'serialrx_provider': 'SBUS',
+    'motor_pwm_protocol': 'DSHOT300',
+    'small_angle': '25',
+    'vbat_warning_cell_voltage': '350',
+    'name': '-',
+    **{f'setting_{i}': '0' for i in range(1000)},
+}
+FEATURES = ('RX_SERIAL', 'GPS', 'TELEMETRY', 'LED_STRIP', 'OSD', 'AIRMODE')
+MODE_RANGE_COUNT = 20
+ADJUSTMENT_RANGE_COUNT = 30
+MOTOR_COUNT = 4
+DATAFLASH_READ_MAX = 4096
+HUFFMAN_READ_CHUNK = 256 # flash read per Huffman coding step
+PACE_INTERVAL = 0.005 # throttled output is written in slices of this much link time
+# STM32F405: 4 x 16 KB, 1 x 64 KB and 7 x 128 KB pages
+F405_LAYOUT = [
+    DfuSeMemoryLayout(addr=0x08000000, last_addr=0x0800FFFF, size=0x10000, num_pages=4, page_size=0x4000),
+    DfuSeMemoryLayout(addr=0x08010000, last_addr=0x0801FFFF, size=0x10000, num_pages=1, page_size=0x10000),
+    DfuSeMemoryLayout(addr=0x08020000, last_addr=0x080FFFFF, size=0xE0000, num_pages=7, page_size=0x20000),
+]
+
+
+def response(code: int, payload: bytes, version: int = 1, error: bool = False) -> bytes:
+    direction = b'!' if error else b'>'
+    if version == 2:
+        body = struct.pack('<BHH', 0, code, len(payload)) + payload
+        return b'$X' + direction + body + bytes((crc8_dvb_s2(body),))
+    if len(payload) < MspCodec.JUMBO_FRAME_SIZE:
+        body = bytes((len(payload), code)) + payload
+    else:
+        body = struct.pack('<BBH', MspCodec.JUMBO_FRAME_SIZE, code, len(payload)) + payload
+    return b'$M' + direction + body + bytes((xor_checksum(body),))
+
+def dataflash_reply(flash: bytes, address: int, size: int, compress: bool = False) -> bytes:
+    """MSP_DATAFLASH_READ reply, Huffman coded 256 bytes at a time until ``size`` bytes of coded data are full."""
+    if not compress:
+        chunk = flash[address:address + size]
+        return struct.pack('<IHB', address, len(chunk), 0) + chunk
+    bits, count = 0, 0
+    used = 0
+    while address + used < len(flash):
+        chunk = flash[address + used:address + used + HUFFMAN_READ_CHUNK]
+        chunk_bits, chunk_count = huffman.code_bits(chunk)
+        if (count + chunk_count + 7) // 8 > size:
+            break
+        bits, count = bits << chunk_count | chunk_bits, count + chunk_count
+        used += len(chunk)
+    coded = huffman.to_bytes(bits, count)
+    return struct.pack('<IHBH', address, 2 + len(coded), huffman.HUFFMAN, used) + coded
+
+
+class SimulatedDfuDevice:
+    """DfuSe device with an STM32 flash behind ``ctrl_transfer``, for ``dfu_flash.download``/``upload``."""
+
+    def __init__(self, layout: Optional[list] = None, transfer_size: int = 2048, latency: float = 0) -> None:
+        self.layout = layout or F405_LAYOUT
+        self.transfer_size = transfer_size
+        self.latency = latency
+        self.base = self.layout[0].addr
+        self.flash = bytearray(b'\xff') * (self.layout[-1].last_addr + 1 - self.base)
+        self.address = self.base
+        self.erased_pages = []
+        self.written = 0
+        self.left = False
+
+    def ctrl_transfer(self, request_type, request, value, index, data=None, timeout=None):
+        if self.latency:
+            time.sleep(self.latency)
+        if request == dfu_flash.DFU_GETSTATUS:
+            return bytes((0, 0, 0, 0, dfu_flash.DFU_STATE_DNLOAD_IDLE, 0))
+        if request == dfu_flash.DFU_UPLOAD:
+            offset = self.address - self.base + (value - dfu_flash.DFUSE_FIRST_BLOCK) * self.transfer_size
+            return bytes(self.flash[offset:offset + data])
+        if request == dfu_flash.DFU_DNLOAD:
+            data = bytes(data) if data is not None else b''
+            if value == 0 and data:
+                command, address = struct.unpack('<BI', data)
+                if command == dfu_flash.DFUSE_SET_ADDRESS:
+                    self.address = address
+                elif command == dfu_flash.DFUSE_ERASE:
+                    for page, start, end in dfu_flash.page_spans(self.layout, address, 1):
+                        size = next(s.page_size for s in self.layout if s.addr <= page <= s.last_addr)
+                        self.flash[page - self.base:page - self.base + size] = b'\xff' * size
+                        self.erased_pages.append(page)
+            elif value >= dfu_flash.DFUSE_FIRST_BLOCK:
+                offset = self.address - self.base + (value - dfu_flash.DFUSE_FIRST_BLOCK) * self.transfer_size
+                self.flash[offset:offset + len(data)] = data
+                self.written += len(data)
+            else:
+                self.left = True
+        return None
+
+
+class SimulatedFc(threading.Thread):
+    """Betaflight like flight controller on the master side of a pty.
+
+    Serves MSP identification, telemetry, config blocks and dataflash, and switches to a
+    CLI with echo, prompt, ``get``/``set``/``feature``/``diff``/``save`` on ``#``. ``bl``
+    turns it into a ``SimulatedDfuDevice``. Every reply waits ``latency`` seconds and the
+    output is paced to ``baudrate`` like a UART link.
+    """
+
+    def __init__(self, fd: int, latency: float = 0, baudrate: Optional[int] = None,
+                 dataflash_size: int = 256 * 1024, seed: int = 1) -> None:
+        super().__init__(daemon=True)
+        self.fd = fd
+        self.slave: Optional[int] = None # kept open by ``open_sim`` so the master side stays readable
+        self.latency = latency
+        self.byte_time = 10 / baudrate if baudrate else 0 # start + 8 data + stop bits
+        self.codec = MspCodec()
+        self.framer = MspFramer()
+        self.settings = dict(SETTINGS)
+        self.features = {'RX_SERIAL', 'OSD'}
+        self.saved = 0
+        self.reboots = 0
+        self.dfu = None
+        self.requests = 0
+        rnd = random.Random(seed)
+        self.dataflash = bytearray(rnd.randbytes(dataflash_size))
+        self.blocks = {block.get: rnd.randbytes(8) for block in CONFIG_BLOCKS if not block.record_size}
+        # Blocks with bytes only the GET handler writes: blackbox supported, detected gyros, motor count, ESC sensor
+        self.blocks[MspCodes.MSP_BLACKBOX_CONFIG] = struct.pack('<BBBBHBI', 1, 1, 1, 2, 2, 3, 0)
+        self.blocks[MspCodes.MSP_SENSOR_ALIGNMENT] = bytes((1, 1, 0, 1, 0, 1, 0))
+        self.blocks[MspCodes.MSP_MOTOR_CONFIG] = struct.pack('<HHHBBBB', 1070, 2000, 1000, MOTOR_COUNT, 14, 1, 0)
+        self.blocks[MspCodes.MSP_MODE_RANGES] = bytes(4 * MODE_RANGE_COUNT)
+        self.blocks[MspCodes.MSP_ADJUSTMENT_RANGES] = bytes(6 * ADJUSTMENT_RANGE_COUNT)
+        self.mode_extra = bytearray(bytes((MODE_RANGE_COUNT,)) + bytes(3 * MODE_RANGE_COUNT))
+        self._in_cli = False
+        self._line = ''
+        self._busy_until = 0.0
+        self._boot = time.monotonic()
+        self._stopped = threading.Event()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.join()
+
+    def close(self) -> None:
+        self.stop()
+        os.close(self.fd)
+        if self.slave is not None:
+            os.close(self.slave)
+
+    def send(self, data: bytes) -> None:
+        """Write paced to the simulated baud rate, each slice shows up once it would have been sent."""
+        view = memoryview(data)
+        step = max(int(PACE_INTERVAL / self.byte_time), 1) if self.byte_time else len(view)
+        for offset in range(0, len(view), step):
+            chunk = view[offset:offset + step]
+            if self.byte_time:
+                self._busy_until = max(self._busy_until, time.monotonic()) + len(chunk) * self.byte_time
+                delay = self._busy_until - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            while chunk:
+                chunk = chunk[os.write(self.fd, chunk):]
+
+    def run(self) -> None:
+        while not self._stopped.is_set():
+            if not select.select([self.fd], [], [], 0.01)[0]:
+                continue
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError:
+                break
+            if self.byte_time:
+                # The UART takes this long to receive what was just read
+                time.sleep(len(data) * self.byte_time)
+            if self._in_cli:
+                self.cli_input(data.decode('ascii', errors='replace'))
+            elif not len(self.framer) and data[:1] == b'#':
+                self.enter_cli(data[1:])
+            else:
+                self.msp_input(data)
+
+    # MARK: MSP
+    def msp_input(self, data: bytes) -> None:
+        self.framer.feed(data)
+        replies = bytearray()
+        while (frame := self.framer.next_frame()) is not None:
+            self.requests += 1
+            if frame[1] == 88: # $X
+                version, code, payload = 2, frame[4] | frame[5] << 8, frame[8:-1]
+            else:
+                version, code = 1, frame[4]
+                payload = frame[7:-1] if frame[3] == MspCodec.JUMBO_FRAME_SIZE else frame[5:-1]
+            result = self.msp_reply(code, payload)
+            replies += response(code, result or b'', version, error=result is None)
+        if replies:
+            if self.latency:
+                time.sleep(self.latency)
+            self.send(bytes(replies))
+
+    def msp_reply(self, code: int, payload: bytes) -> Optional[bytes]:
+        elapsed = time.monotonic() - self._boot
+        match code:
+            case MspCodes.MSP_API_VERSION:
+                return bytes((0, *API_VERSION))
+            case MspCodes.MSP_FC_VARIANT:
+                return b'BTFL'
+            case MspCodes.MSP_FC_VERSION:
+                return bytes(FC_VERSION)
+            case MspCodes.MSP_BUILD_INFO:
+                return b'Jun 15 202412:01:02'
+            case MspCodes.MSP_BOARD_INFO:
+                return encode_payload(code, BOARD, '.'.join(map(str, API_VERSION)) + '.0')
+            case MspCodes.MSP_STATUS_EX:
+                return struct.pack('<HHHIBHBBBBIBH', 125, 0, 0x23, 0, 0, 150, 4, 0, 0, 0, 0, 0, 40)
+            case MspCodes.MSP_RAW_IMU:
+                wave = int(512 * math.sin(elapsed * 2 * math.pi))
+                return struct.pack('<9h', wave, -wave, 2048, wave // 4, 0, -wave // 4, 0, 0, 0)
+            case MspCodes.MSP_ATTITUDE:
+                return struct.pack('<hhh', int(100 * math.sin(elapsed)), int(50 * math.cos(elapsed)), int(elapsed * 10) % 360)
+            case MspCodes.MSP_ANALOG:
+                return struct.pack('<BHHhH', 168, int(elapsed * 10), 1023, 1250, 1680)
+            case MspCodes.MSP_MOTOR_TELEMETRY:
+                return bytes((MOTOR_COUNT,)) + struct.pack('<IHBHHH', 18000, 0, 45, 1650, 300, int(elapsed)) * MOTOR_COUNT
+            case MspCodes.MSP_DATAFLASH_SUMMARY:
+                return struct.pack('<BIII', 3, 64, len(self.dataflash) * 2, len(self.dataflash))
+            case MspCodes.MSP_DATAFLASH_READ:
+                address, size, compress = struct.unpack_from('<IHB', payload)
+                return dataflash_reply(self.dataflash, address, min(size, DATAFLASH_READ_MAX), bool(compress))
+            case MspCodes.MSP_DATAFLASH_ERASE:
+                self.dataflash = bytearray()
+                return b''
+            case MspCodes.MSP_MODE_RANGES_EXTRA:
+                return bytes(self.mode_extra)
+            case MspCodes.MSP_EEPROM_WRITE:
+                self.saved += 1
+                return b''
+            case MspCodes.MSP_RESET_CONF:
+                self.settings = dict(SETTINGS)
+                return b''
+        for block in CONFIG_BLOCKS:
+            if code == block.get:
+                return self.blocks[code]
+            if code == block.set:
+                if block.record_size:
+                    index = payload[0]
+                    record = bytes(payload[1:1 + block.record_size])
+                    data = bytearray(self.blocks[block.get])
+                    data[index * block.record_size:(index + 1) * block.record_size] = record
+                    self.blocks[block.get] = bytes(data)
+                    if block.get == MspCodes.MSP_MODE_RANGES and len(payload) > 1 + block.record_size:
+                        self.mode_extra[2 + index * 3:4 + index * 3] = payload[1 + block.record_size:3 + block.record_size]
+                elif block.get_only:
+                    # The status bytes stay, the SET payload fills in the rest
+                    data = bytearray(self.blocks[block.get])
+                    for idx, value in zip((idx for idx in range(len(data)) if idx not in block.get_only), payload):
+                        data[idx] = value
+                    self.blocks[block.get] = bytes(data)
+                else:
+                    self.blocks[block.get] = bytes(payload)
+                return b''
+        return None
+
+    # MARK: CLI
+    def enter_cli(self, rest: bytes) -> None:
+        self._in_cli = True
+        self._line = ''
+        self.send(b"\r\nEntering CLI Mode, type 'exit' to return, or 'help'\r\n\r\n# ")
+        self.cli_input(rest.decode('ascii', errors='replace'))
+
+    def cli_input(self, text: str) -> None:
+        out = []
+        for c in text:
+            if c in '\r\n':
+                if not self._line:
+                    continue
+                out.append(self._line + '\r\n')
+                line, self._line = self._line.strip(), ''
+                if line == 'save' or line == 'exit' or line == 'bl':
+                    out.append(self.leave_cli(line))
+                    break
+                output = self.execute(line)
+                out.append(f'{output}\r\n# ' if output else '# ')
+            elif 32 <= ord(c) <= 126:
+                self._line += c
+        if out:
+            if self.latency:
+                time.sleep(self.latency)
+            self.send(''.join(out).encode('ascii'))
+
+    def leave_cli(self, line: str) -> str:
+        self._in_cli = False
+        self.framer.clear()
+        self.reboots += 1
+        if line == 'save':
+            self.saved += 1
+            return '# saving\r\nRebooting'
+        if line == 'bl':
+            self.dfu = SimulatedDfuDevice(latency=self.latency / 10)
+            return 'Rebooting to bootloader'
+        return 'Rebooting'
+
+    def execute(self, line: str) -> str:
+        words = line.split()
+        command = words[0]
+        if command.startswith('#'):
+            return ''
+        if command == 'set' and '=' in line:
+            name, _, value = line[4:].partition('=')
+            name, value = name.strip().lower(), value.strip()
+            if name not in self.settings:
+                return f'###ERROR IN set: INVALID NAME: {name}###'
+            self.settings[name] = value
+            return f'{name} set to {value}'
+        if command == 'get' and len(words) == 2:
+            name = words[1].lower()
+            if name not in self.settings:
+                return f'###ERROR IN get: INVALID NAME: {name}###'
+            return f'{name} = {self.settings[name]}\r\nDefault value: {SETTINGS[name]}'
+        if command == 'feature' and len(words) == 2:
+            name = words[1].lstrip('-').upper()
+            if name not in FEATURES:
+                return '###ERROR IN feature: INVALID NAME###'
+            if words[1].startswith('-'):
+                self.features.discard(name)
+                return f'Disabled {name}'
+            self.features.add(name)
+            return f'Enabled {name}'
+        if command in ('diff', 'dump'):
+            changed = [f'set {name} = {value}' for name, value in self.settings.items()
+                       if command == 'dump' or value != SETTINGS[name]]
+            features = [f'feature {"" if name in self.features else "-"}{name}' for name in FEATURES]
+            return '\r\n'.join([f'# {line}', '', '# version',
+                                f'# Betaflight / STM32F405 (S405) {".".join(map(str, FC_VERSION))}', '',
+                                f'board_name {BOARD["board_name"]}', '', '# feature', *features, '', '# master', *changed])
+        if command == 'version':
+            return f'# Betaflight / STM32F405 (S405) {".".join(map(str, FC_VERSION))}'
+        if command in ('batch', 'board_name', 'manufacturer_id', 'mcu_id', 'signature', 'profile', 'rateprofile'):
+            return ''
+        return f'###ERROR IN {command}: UNKNOWN COMMAND###'
+
+
+def open_sim(**kwargs) -> tuple[SimulatedFc, str]:
+    """Start a simulator on a new pty, return it with the device path to open."""
+    master, slave = os.openpty()
+    tty.setraw(master)
+    tty.setraw(slave)
+    sim = SimulatedFc(master, **kwargs)
+    sim.slave = slave
+    sim.start()
+    return sim, os.ttyname(slave)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Simulated Betaflight flight controller on a pty')
+    parser.add_argument('--latency', type=float, default=0, help='Delay before every reply in seconds')
+    parser.add_argument('-b', dest='baudrate', type=int, required=False, help='Throttle to this UART baud rate')
+    parser.add_argument('--dataflash', type=int, default=256 * 1024, help='Blackbox dataflash size in bytes')
+    args = parser.parse_args()
+
+    sim, port = open_sim(latency=args.latency, baudrate=args.baudrate, dataflash_size=args.dataflash)
+    print(f'Simulated FC on {port}, Ctrl-C to stop')
+    try:
+        while sim.is_alive():
+            sim.join(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sim.close()
+        print(f'{sim.requests} MSP requests, {sim.saved} saves')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+import mmap
+import os
+import struct
+import tempfile
+from bisect import bisect_left, bisect_right
+from typing import Iterator, Optional
+
+# Intel HEX record types
+HEX_DATA = 0
+HEX_EOF = 1
+HEX_EXT_SEGMENT_ADDR = 2
+HEX_START_SEGMENT_ADDR = 3
+HEX_EXT_LINEAR_ADDR = 4
+HEX_START_LINEAR_ADDR = 5
+
+# Pre-parsed image: header, segment table (address, offset, size) and the raw segment bytes
+IMAGE_MAGIC = b'BFIMG\0'
+IMAGE_VERSION = 1
+IMAGE_HEADER = struct.Struct('<6sHII') # magic, version, segment count, start address
+IMAGE_SEGMENT = struct.Struct('<III')
+NO_START_ADDR = 0xFFFFFFFF
+
+
+class FirmwareImage:
+    """Sparse firmware image stored as address ordered, non overlapping ``bytearray`` segments.
+
+    Images loaded from a pre-parsed file keep their segments as views of the mapping
+    until a write has to grow one of them.
+    """
+
+    def __init__(self, segments: Optional[list] = None) -> None:
+        self.segments = []
+        self.start_addr = None
+        for start, data in segments or ():
+            self.write(start, data)
+
+    @classmethod
+    def from_hex(cls, hex_file: str) -> 'FirmwareImage':
+        with open(hex_file, encoding='ascii') as f:
+            return cls.from_hex_text(f.read())
+
+    @classmethod
+    def from_hex_text(cls, text: str) -> 'FirmwareImage':
+        image = cls()
+        segments = image.segments
+        base = 0
+        for line_no, line in enumerate(text.splitlines(), 1):
+            line = line.strip()
+            if not line:
+                continue
+            if line[0] != ':':
+                raise ValueError(f'Intel HEX line {line_no}: missing start code')
+            record = bytes.fromhex(line[1:])
+            if len(record) < 5 or len(record) != record[0] + 5:
+                raise ValueError(f'Intel HEX line {line_no}: bad record length')
+            if sum(record) & 0xFF:
+                raise ValueError(f'Intel HEX line {line_no}: bad checksum')
+
+            rtype = record[3]
+            if rtype == HEX_DATA:
+                address = base + (record[1] << 8 | record[2])
+                data = record[4:-1]
+                last = segments[-1] if segments else None
+                if last and last[0] + len(last[1]) == address:
+                    last[1].extend(data)
+                elif not last or last[0] + len(last[1]) < address:
+                    segments.append([address, bytearray(data)])
+                else:
+                    image.write(address, data)
+            elif rtype == HEX_EOF:
+                break
+            elif rtype == HEX_EXT_SEGMENT_ADDR:
+                base = int.from_bytes(record[4:6], 'big') << 4
+            elif rtype == HEX_EXT_LINEAR_ADDR:
+                base = int.from_bytes(record[4:6], 'big') << 16
+            elif rtype in (HEX_START_SEGMENT_ADDR, HEX_START_LINEAR_ADDR):
+                image.start_addr = int.from_bytes(record[4:-1], 'big')
+            else:
+                raise ValueError(f'Intel HEX line {line_no}: unknown record type {rtype}')
+        return image
+
+    @classmethod
+    def load(cls, path: str) -> 'FirmwareImage':
+        """Map a pre-parsed image file, segments are copy on write views of the mapping."""
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        view = memoryview(mapped)
+        magic, version, count, start_addr = IMAGE_HEADER.unpack_from(view)
+        if magic != IMAGE_MAGIC or version != IMAGE_VERSION:
+            raise ValueError(f'Not a firmware image: {path}')
+        image = cls()
+        image.start_addr = None if start_addr == NO_START_ADDR else start_addr
+        for address, offset, size in IMAGE_SEGMENT.iter_unpack(view[IMAGE_HEADER.size:IMAGE_HEADER.size + count * IMAGE_SEGMENT.size]):
+            image.segments.append([address, view[offset:offset + size]])
+        return image
+
+    def dumps(self) -> bytes:
+        offset = IMAGE_HEADER.size + len(self.segments) * IMAGE_SEGMENT.size
+        start_addr = NO_START_ADDR if self.start_addr is None else self.start_addr
+        result = bytearray(IMAGE_HEADER.pack(IMAGE_MAGIC, IMAGE_VERSION, len(self.segments), start_addr))
+        for address, data in self.segments:
+            result += IMAGE_SEGMENT.pack(address, offset, len(data))
+            offset += len(data)
+        for _, data in self.segments:
+            result += data
+        return bytes(result)
+
+    def save(self, path: str) -> None:
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.tmp_')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(self.dumps())
+        os.replace(tmp, path)
+
+    def __len__(self) -> int:
+        return sum(len(data) for _, data in self.segments)
+
+    def minaddr(self) -> int:
+        return self.segments[0][0] if self.segments else 0
+
+    def maxaddr(self) -> int:
+        if not self.segments:
+            return 0
+        start, data = self.segments[-1]
+        return start + len(data) - 1
+
+    def gaps(self) -> Iterator[tuple[int, int]]:
+        for (start, data), (next_start, _) in zip(self.segments, self.segments[1:]):
+            yield start + len(data), next_start - start - len(data)
+
+    def find_gap(self, after: int) -> tuple[int, int]:
+        """Return ``(start, size)`` of the last gap that begins past ``after`` or ``(0, 0)``."""
+        result = (0, 0)
+        for start, size in self.gaps():
+            if start - 1 >= after:
+                result = (start, size)
+        return result
+
+    def write(self, address: int, data: bytes) -> None:
+        end = address + len(data)
+        segments = self.segments
+        # Segments overlapping or touching [address, end) are merged into one
+        first = bisect_left(segments, address, key=lambda s: s[0] + len(s[1]))
+        last = bisect_right(segments, end, key=lambda s: s[0])
+        affected = segments[first:last]
+
+        if len(affected) == 1 and affected[0][0] <= address and end <= affected[0][0] + len(affected[0][1]):
+            # In place, also fine for the memoryview segments of a loaded image
+            start, buf = affected[0]
+            buf[address - start:end - start] = data
+            return
+
+        new_start = min([address] + [s[0] for s in affected])
+        new_end = max([end] + [s[0] + len(s[1]) for s in affected])
+        if affected and affected[0][0] == new_start:
+            buf = affected.pop(0)[1]
+            if not isinstance(buf, bytearray):
+                buf = bytearray(buf)
+            buf.extend(bytes(new_end - new_start - len(buf)))
+        else:
+            buf = bytearray(new_end - new_start)
+        for start, seg in affected:
+            buf[start - new_start:start - new_start + len(seg)] = seg
+        buf[address - new_start:end - new_start] = data
+        segments[first:last] = [[new_start, buf]]
+
+    def tobinary(self, pad: int = 0xFF) -> memoryview:
+        if len(self.segments) == 1:
+            return memoryview(self.segments[0][1])
+        base = self.minaddr()
+        result = bytearray((pad,)) * (self.maxaddr() - base + 1)
+        for start, data in self.segments:
+            result[start - base:start - base + len(data)] = data
+        return memoryview(result)
@@ -0,0 +1,124 @@
+import os
+import select
+import socket
+import time
+from typing import Callable, Optional, TypeVar
+
+from serial.tools.list_ports import comports
+
+import metrics
+
+T = TypeVar('T')
+
+NETLINK_KOBJECT_UEVENT = 15
+KERNEL_GROUP = 1
+SUBSYSTEMS = ('usb', 'tty')
+WAIT_TIMEOUT = 10
+POLL_INTERVAL = 0.25 # without uevents
+RECHECK_INTERVAL = 1.0 # with uevents, in case the namespace does not forward them
+# The kernel event comes before udev creates the device node and before the USB strings are readable
+SETTLE_TIME = 1.0
+SETTLE_INTERVAL = 0.02
+
+
+def parse_uevent(data: bytes) -> dict:
+    """``KEY=value`` fields of a kernel uevent, ``ACTION@DEVPATH`` header first."""
+    event = {}
+    for field in data.split(b'\0')[1:]:
+        key, sep, value = field.partition(b'=')
+        if sep:
+            event[key.decode('ascii', errors='replace')] = value.decode('utf-8', errors='replace')
+    return event
+
+
+class UeventMonitor:
+    """USB and tty add/remove events from the kernel netlink socket (Linux)."""
+
+    def __init__(self, sock: socket.socket, subsystems: tuple = SUBSYSTEMS) -> None:
+        self.sock = sock
+        self.sock.setblocking(False)
+        self.subsystems = subsystems
+
+    @classmethod
+    def open(cls) -> Optional['UeventMonitor']:
+        """The monitor, or ``None`` where uevents are not available and callers have to poll."""
+        family = getattr(socket, 'AF_NETLINK', None)
+        if family is None:
+            return None
+        try:
+            sock = socket.socket(family, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+        except OSError:
+            return None
+        try:
+            sock.bind((0, KERNEL_GROUP))
+        except OSError:
+            sock.close()
+            return None
+        return cls(sock)
+
+    def fileno(self) -> int:
+        return self.sock.fileno()
+
+    def close(self) -> None:
+        self.sock.close()
+
+    def wait(self, timeout: float) -> list[dict]:
+        """Block up to ``timeout`` for events, return the pending ones of the watched subsystems."""
+        if not select.select([self.sock], [], [], max(timeout, 0))[0]:
+            return []
+        events = []
+        while True:
+            try:
+                data = self.sock.recv(16384)
+            except (BlockingIOError, InterruptedError):
+                break
+            event = parse_uevent(data)
+            if event.get('SUBSYSTEM') in self.subsystems:
+                events.append(event)
+        return events
+
+    def __enter__(self) -> 'UeventMonitor':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def wait_for(check: Callable[[], T], timeout: float = WAIT_TIMEOUT, monitor: Optional[UeventMonitor] = None) -> Optional[T]:
+    """Return the first truthy ``check()``, re-checked when a USB or serial device comes or goes.
+
+    Without ``monitor`` one is opened for the call. After an event ``check`` is repeated
+    every ``SETTLE_INTERVAL`` for ``SETTLE_TIME``, until the device is usable. Where the
+    kernel events are not available ``check`` is polled every ``POLL_INTERVAL`` instead.
+    """
+    own = monitor is None
+    if own:
+        # Subscribe before the first check, so an arrival in between is not missed
+        monitor = UeventMonitor.open()
+    started = time.monotonic()
+    deadline = started + timeout
+    settle_until = 0.0
+    try:
+        while True:
+            result = check()
+            if result:
+                return result
+            now = time.monotonic()
+            if now >= deadline:
+                return None
+            if monitor is None:
+                time.sleep(min(POLL_INTERVAL, deadline - now))
+                continue
+            interval = SETTLE_INTERVAL if now < settle_until else RECHECK_INTERVAL
+            if monitor.wait(min(interval, deadline - now)):
+                settle_until = time.monotonic() + SETTLE_TIME
+    finally:
+        metrics.count('wait_seconds', time.monotonic() - started, reason='hotplug')
+        if own and monitor is not None:
+            monitor.close()
+
+def port_exists(port: str) -> bool:
+    """Cheaper than a ``comports()`` enumeration where ports are device nodes."""
+    if os.name == 'posix':
+        return os.path.exists(port)
+    return any(p.device == port for p in comports())
@@ -0,0 +1,94 @@
+# Fixed Huffman code of compressed MSP_DATAFLASH_READ replies, from Betaflight src/main/common/huffman_table.c
+HUFFMAN = 1 # compression method of the reply
+
+# (code length, code left aligned in 16 bits) for every byte value, then EOF
+HUFFMAN_TABLE = (
+    (2, 0xC000), (3, 0xA000), (4, 0x9000), (5, 0x8800), (5, 0x8000), (6, 0x7400), (6, 0x7000), (6, 0x6C00), # 0x00
+    (6, 0x6800), (7, 0x6200), (7, 0x6000), (7, 0x5E00), (7, 0x5C00), (7, 0x5A00), (7, 0x5800), (7, 0x5600), # 0x08
+    (6, 0x6400), (7, 0x5400), (7, 0x5200), (8, 0x5100), (8, 0x5000), (8, 0x4F00), (8, 0x4E00), (8, 0x4D00), # 0x10
+    (8, 0x4C00), (8, 0x4B00), (8, 0x4A00), (8, 0x4900), (8, 0x4800), (8, 0x4700), (8, 0x4600), (8, 0x4500), # 0x18
+    (8, 0x4400), (8, 0x4300), (8, 0x4200), (8, 0x4100), (8, 0x4000), (9, 0x3C80), (9, 0x3C00), (9, 0x3B80), # 0x20
+    (9, 0x3B00), (9, 0x3A80), (9, 0x3A00), (9, 0x3980), (9, 0x3900), (9, 0x3880), (9, 0x3800), (9, 0x3780), # 0x28
+    (8, 0x3F00), (9, 0x3700), (9, 0x3680), (9, 0x3600), (9, 0x3580), (9, 0x3500), (9, 0x3480), (9, 0x3400), # 0x30
+    (9, 0x3380), (9, 0x3300), (9, 0x3280), (9, 0x3200), (9, 0x3180), (9, 0x3100), (9, 0x3080), (9, 0x3000), # 0x38
+    (8, 0x3E00), (9, 0x2F80), (9, 0x2F00), (9, 0x2E80), (9, 0x2E00), (9, 0x2D80), (9, 0x2D00), (9, 0x2C80), # 0x40
+    (9, 0x2C00), (9, 0x2B80), (10, 0x27C0), (10, 0x2780), (9, 0x2B00), (10, 0x2740), (10, 0x2700), (9, 0x2A80), # 0x48
+    (5, 0x7800), (9, 0x2A00), (10, 0x26C0), (10, 0x2680), (10, 0x2640), (10, 0x2600), (10, 0x25C0), (10, 0x2580), # 0x50
+    (10, 0x2540), (10, 0x2500), (10, 0x24C0), (10, 0x2480), (10, 0x2440), (10, 0x2400), (10, 0x23C0), (10, 0x2380), # 0x58
+    (10, 0x2340), (10, 0x2300), (10, 0x22C0), (10, 0x2280), (10, 0x2240), (10, 0x2200), (10, 0x21C0), (10, 0x2180), # 0x60
+    (10, 0x2140), (10, 0x2100), (10, 0x20C0), (10, 0x2080), (10, 0x2040), (10, 0x2000), (10, 0x1FC0), (10, 0x1F80), # 0x68
+    (10, 0x1F40), (10, 0x1F00), (10, 0x1EC0), (10, 0x1E80), (10, 0x1E40), (10, 0x1E00), (10, 0x1DC0), (10, 0x1D80), # 0x70
+    (10, 0x1D40), (10, 0x1D00), (10, 0x1CC0), (10, 0x1C80), (10, 0x1C40), (10, 0x1C00), (10, 0x1BC0), (10, 0x1B80), # 0x78
+    (9, 0x2980), (10, 0x1B40), (10, 0x1B00), (10, 0x1AC0), (10, 0x1A80), (10, 0x1A40), (10, 0x1A00), (10, 0x19C0), # 0x80
+    (10, 0x1980), (10, 0x1940), (10, 0x1900), (10, 0x18C0), (10, 0x1880), (10, 0x1840), (10, 0x1800), (10, 0x17C0), # 0x88
+    (10, 0x1780), (10, 0x1740), (10, 0x1700), (10, 0x16C0), (10, 0x1680), (10, 0x1640), (10, 0x1600), (10, 0x15C0), # 0x90
+    (10, 0x1580), (10, 0x1540), (10, 0x1500), (10, 0x14C0), (10, 0x1480), (10, 0x1440), (10, 0x1400), (10, 0x13C0), # 0x98
+    (10, 0x1380), (10, 0x1340), (10, 0x1300), (10, 0x12C0), (10, 0x1280), (10, 0x1240), (10, 0x1200), (10, 0x11C0), # 0xA0
+    (10, 0x1180), (10, 0x1140), (10, 0x1100), (10, 0x10C0), (10, 0x1080), (10, 0x1040), (10, 0x1000), (10, 0x0FC0), # 0xA8
+    (10, 0x0F80), (10, 0x0F40), (10, 0x0F00), (10, 0x0EC0), (10, 0x0E80), (10, 0x0E40), (10, 0x0E00), (10, 0x0DC0), # 0xB0
+    (10, 0x0D80), (10, 0x0D40), (10, 0x0D00), (10, 0x0CC0), (10, 0x0C80), (10, 0x0C40), (10, 0x0C00), (10, 0x0BC0), # 0xB8
+    (10, 0x0B80), (10, 0x0B40), (10, 0x0B00), (10, 0x0AC0), (10, 0x0A80), (10, 0x0A40), (10, 0x0A00), (10, 0x09C0), # 0xC0
+    (10, 0x0980), (10, 0x0940), (10, 0x0900), (10, 0x08C0), (10, 0x0880), (10, 0x0840), (10, 0x0800), (10, 0x07C0), # 0xC8
+    (10, 0x0780), (10, 0x0740), (10, 0x0700), (10, 0x06C0), (10, 0x0680), (11, 0x0320), (10, 0x0640), (10, 0x0600), # 0xD0
+    (10, 0x05C0), (10, 0x0580), (10, 0x0540), (10, 0x0500), (10, 0x04C0), (11, 0x0300), (10, 0x0480), (10, 0x0440), # 0xD8
+    (9, 0x2900), (10, 0x0400), (10, 0x03C0), (11, 0x02E0), (10, 0x0380), (11, 0x02C0), (11, 0x02A0), (11, 0x0280), # 0xE0
+    (11, 0x0260), (11, 0x0240), (11, 0x0220), (11, 0x0200), (11, 0x01E0), (11, 0x01C0), (11, 0x01A0), (10, 0x0340), # 0xE8
+    (8, 0x3D00), (9, 0x2880), (11, 0x0180), (11, 0x0160), (11, 0x0140), (11, 0x0120), (11, 0x0100), (11, 0x00E0), # 0xF0
+    (11, 0x00C0), (12, 0x0010), (11, 0x00A0), (11, 0x0080), (11, 0x0060), (11, 0x0040), (11, 0x0020), (9, 0x2800), # 0xF8
+    (12, 0x0000), # EOF
+)
+MAX_CODE_LEN = 12
+EOF_SYMBOL = 256
+
+
+def _decode_table() -> list:
+    """(symbol, length) for every MAX_CODE_LEN bit value, indexed by the bits that follow."""
+    table = [None] * (1 << MAX_CODE_LEN)
+    for symbol, (length, code) in enumerate(HUFFMAN_TABLE):
+        first = code >> (16 - MAX_CODE_LEN)
+        for idx in range(first, first + (1 << (MAX_CODE_LEN - length))):
+            table[idx] = (symbol, length)
+    return table
+
+DECODE_TABLE = _decode_table()
+
+
+def code_bits(data: bytes) -> tuple[int, int]:
+    """The codes of ``data`` as one integer and its length in bits."""
+    bits = 0
+    count = 0
+    for byte in data:
+        length, code = HUFFMAN_TABLE[byte]
+        bits = bits << length | code >> (16 - length)
+        count += length
+    return bits, count
+
+def to_bytes(bits: int, count: int) -> bytes:
+    """Bit stream the firmware sends, most significant bit first, the last byte padded with zeros."""
+    padding = -count % 8
+    return (bits << padding).to_bytes((count + padding) // 8, 'big')
+
+def encode(data: bytes) -> bytes:
+    return to_bytes(*code_bits(data))
+
+def decode(data: bytes, size: int) -> bytes:
+    """The first ``size`` bytes coded in ``data``, the padding bits after them are ignored."""
+    out = bytearray()
+    mask = (1 << MAX_CODE_LEN) - 1
+    bits = 0
+    count = 0 # bits buffered
+    pos = 0
+    left = len(data) * 8
+    while len(out) < size:
+        while count < MAX_CODE_LEN:
+            # Zeros past the end, so the last codes can be looked up like the others
+            bits = (bits << 8 | (data[pos] if pos < len(data) else 0)) & 0xFFFFF
+            count += 8
+            pos += 1
+        symbol, length = DECODE_TABLE[bits >> (count - MAX_CODE_LEN) & mask]
+        left -= length
+        if symbol == EOF_SYMBOL or left < 0:
+            raise ValueError(f'Huffman stream ends after {len(out)} of {size} bytes')
+        out.append(symbol)
+        count -= length
+    return bytes(out)
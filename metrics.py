@@ -0,0 +1,143 @@
+import atexit
+import functools
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Callable, Iterator, NamedTuple
+
+PROMETHEUS_EXT = '.prom'
+PROMETHEUS_PREFIX = 'bf_flash_'
+NAME_RE = re.compile(r'[^a-zA-Z0-9_]')
+
+
+class Span(NamedTuple):
+    name: str # parent names joined with '/', e.g. 'board/flash/dfu_write'
+    labels: tuple # sorted (key, value) pairs, inherited from the parent span
+    started: float # wall clock
+    duration: float
+    ok: bool
+
+
+class Metrics:
+    """Timed spans and counters, safe to use from the worker threads.
+
+    Spans nest per thread: a child is named after its parents and takes over their
+    labels, so a ``board`` label set on the outer span tags every phase below it.
+    """
+
+    def __init__(self) -> None:
+        self.spans: list[Span] = []
+        self.counters = defaultdict(float) # (name, labels) -> value
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self) -> list:
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    @contextmanager
+    def span(self, name: str, **labels) -> Iterator[None]:
+        stack = self._stack()
+        parent_name, parent_labels = stack[-1] if stack else ('', {})
+        full_name = f'{parent_name}/{name}' if parent_name else name
+        labels = {**parent_labels, **{key: str(label) for key, label in labels.items() if label is not None}}
+        stack.append((full_name, labels))
+        started = time.time()
+        start = time.perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            duration = time.perf_counter() - start
+            stack.pop()
+            with self._lock:
+                self.spans.append(Span(full_name, tuple(sorted(labels.items())), started, duration, ok))
+
+    def count(self, name: str, value: float = 1, **labels) -> None:
+        stack = self._stack()
+        labels = {**(stack[-1][1] if stack else {}), **{key: str(label) for key, label in labels.items()}}
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] += value
+
+    def records(self) -> list[dict]:
+        with self._lock:
+            spans = list(self.spans)
+            counters = dict(self.counters)
+        return ([{'type': 'span', 'name': span.name, 'labels': dict(span.labels), 'started': span.started,
+                  'duration': span.duration, 'ok': span.ok} for span in spans]
+                + [{'type': 'counter', 'name': name, 'labels': dict(labels), 'value': value}
+                   for (name, labels), value in counters.items()])
+
+    def prometheus(self) -> str:
+        """Text exposition format: span totals and counts per phase, counters as ``_total``."""
+        with self._lock:
+            spans = list(self.spans)
+            counters = dict(self.counters)
+        seconds = defaultdict(float)
+        calls = defaultdict(int)
+        failures = defaultdict(int)
+        for span in spans:
+            key = (('phase', span.name), *span.labels)
+            seconds[key] += span.duration
+            calls[key] += 1
+            failures[key] += not span.ok
+        lines = []
+        for name, kind, values in (('phase_seconds_total', 'counter', seconds), ('phase_calls_total', 'counter', calls),
+                                   ('phase_failures_total', 'counter', failures)):
+            if values:
+                lines.append(f'# TYPE {PROMETHEUS_PREFIX}{name} {kind}')
+                lines += [f'{PROMETHEUS_PREFIX}{name}{format_labels(labels)} {value:g}' for labels, value in sorted(values.items())]
+        for name in sorted({name for name, _ in counters}):
+            metric = f'{PROMETHEUS_PREFIX}{NAME_RE.sub("_", name)}_total'
+            lines.append(f'# TYPE {metric} counter')
+            lines += [f'{metric}{format_labels(labels)} {value:g}'
+                      for (other, labels), value in sorted(counters.items()) if other == name]
+        return '\n'.join(lines) + '\n' if lines else ''
+
+    def write(self, path: str) -> None:
+        """Prometheus textfile for ``.prom`` paths, replaced atomically for the node exporter, else JSON lines."""
+        if path.endswith(PROMETHEUS_EXT):
+            text = self.prometheus()
+        else:
+            text = ''.join(json.dumps(record) + '\n' for record in self.records())
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.tmp_')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+
+def escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{NAME_RE.sub("_", key)}="{escape(value)}"' for key, value in labels) + '}'
+
+
+# Process wide instance used by the tool
+metrics = Metrics()
+span = metrics.span
+count = metrics.count
+
+def timed(name: str) -> Callable:
+    """Decorator running the function in a span."""
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with metrics.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def write_on_exit(path: str) -> None:
+    atexit.register(metrics.write, path)
@@ -1,7 +1,12 @@
+import time
+from collections import deque
+from typing import Iterable, Optional
+
 import serial
-from semver.version import Version
+import metrics
 from msp_codes import MspCodes
-from msp_data import MspData, MspRec, ResetTypes, TargetCapabilitiesFlags, ConfigurationStates
+from msp_data import MspData, MspRec, MspRecType, msp_code, ResetTypes, TargetCapabilitiesFlags, ConfigurationStates
+from msp_schema import Version, decode_payload
 
 # PORT = '/dev/cu.usbmodem0x80000001'
 PORT = '/dev/cu.usbmodem355F367335381'
@@ -18,9 +23,123 @@ BAUDRATE = 115200
 def bit_check(num: int, bit: int) -> bool:
     return (num >> bit) % 2 != 0
 
+def xor_checksum(data: bytes) -> int:
+    # Fold the buffer as one big integer so the XOR runs in C instead of a per-byte loop
+    bits = len(data) * 8
+    value = int.from_bytes(data, 'little')
+    while bits > 8:
+        half = (bits // 8 + 1) // 2 * 8
+        value = (value & ((1 << half) - 1)) ^ (value >> half)
+        bits = half
+    return value
+
+
+def _crc8_dvb_s2_table() -> tuple:
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0xD5) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table.append(crc)
+    return tuple(table)
+
+CRC8_DVB_S2_TABLE = _crc8_dvb_s2_table()
+
+def crc8_dvb_s2(data: bytes, crc: int = 0) -> int:
+    table = CRC8_DVB_S2_TABLE
+    for byte in data:
+        crc = table[crc ^ byte]
+    return crc
+
+
+class MspFramer:
+    """Buffered MSP frame splitter.
+
+    Incoming chunks are appended to one buffer and consumed through a read offset,
+    frame starts are located with ``bytes.find`` and bad checksums or noise are skipped.
+    """
+    HEADER_V1 = 5 # $M> size code
+    HEADER_JUMBO = 7 # $M> 255 code size16
+    HEADER_V2 = 8 # $X> flag code16 size16
+    COMPACT_SIZE = 4096
+
+    def __init__(self) -> None:
+        self._buf = bytearray()
+        self._pos = 0
+        self.frames = 0
+        self.checksum_errors = 0
+        self.skipped = 0
+
+    def __len__(self) -> int:
+        return len(self._buf) - self._pos
+
+    def clear(self) -> None:
+        self._buf.clear()
+        self._pos = 0
+
+    def feed(self, data: bytes) -> None:
+        if self._pos >= MspFramer.COMPACT_SIZE or self._pos == len(self._buf):
+            del self._buf[:self._pos]
+            self._pos = 0
+        self._buf += data
+
+    def _skip(self, pos: int) -> None:
+        self.skipped += pos - self._pos
+        self._pos = pos
 
-class MspCtr:
+    def next_frame(self) -> Optional[bytes]:
+        buf = self._buf
+        while True:
+            start = buf.find(b'$', self._pos)
+            if start < 0:
+                self._skip(len(buf))
+                return None
+            self._skip(start)
+
+            available = len(buf) - start
+            if available > 1 and buf[start + 1] not in b'MX':
+                self._skip(start + 1)
+                continue
+            if available > 2 and buf[start + 2] not in b'<>!':
+                self._skip(start + 1)
+                continue
+            if available < MspFramer.HEADER_V1:
+                return None
+
+            if buf[start + 1] == 0x58: # X
+                if available < MspFramer.HEADER_V2:
+                    return None
+                end = start + MspFramer.HEADER_V2 + (buf[start + 6] | buf[start + 7] << 8) + 1
+                if len(buf) < end:
+                    return None
+                is_valid = crc8_dvb_s2(buf[start + 3:end - 1]) == buf[end - 1]
+            else:
+                size = buf[start + 3]
+                if size == MspCodec.JUMBO_FRAME_SIZE:
+                    if available < MspFramer.HEADER_JUMBO:
+                        return None
+                    end = start + MspFramer.HEADER_JUMBO + (buf[start + 5] | buf[start + 6] << 8) + 1
+                else:
+                    end = start + MspFramer.HEADER_V1 + size + 1
+                if len(buf) < end:
+                    return None
+                is_valid = xor_checksum(buf[start + 3:end - 1]) == buf[end - 1]
+
+            if not is_valid:
+                self.checksum_errors += 1
+                self._skip(start + 1)
+                continue
+
+            self._pos = end
+            self.frames += 1
+            return bytes(buf[start:end])
+
+
+class MspCodec:
+    """Frame encoding and payload decoding shared by the blocking and asyncio transports."""
     SIGNATURE_LENGTH = 32
+    JUMBO_FRAME_SIZE = 255
+    V1_MAX_CODE = 254
     API_VERSION_1_41 = Version(major=1, minor=41)
     API_VERSION_1_42 = Version(major=1, minor=42)
     API_VERSION_1_43 = Version(major=1, minor=43)
@@ -28,93 +147,146 @@ class MspCtr:
     API_VERSION_1_45 = Version(major=1, minor=45)
     API_VERSION_1_46 = Version(major=1, minor=46)
 
-    def __init__(self, port: serial.Serial) -> None:
-        self.port = port
+    def __init__(self) -> None:
         self.data = MspData()
 
-    def close(self) -> None:
-        self.port.close()
-
     def encode_v1(self, code: int, *data) -> bytes:
-        data_len = 0
-        if data:
-            data_len = len(data)
+        payload = bytes(data)
+        size = len(payload)
         # Header: $M<
-        buffer = bytearray((36, 77, 60, data_len, code))
-        checksum = buffer[3] ^ buffer[4]
-        if data_len:
-            for item in data:
-                buffer.append(item)
-                checksum ^= item
-        buffer.append(checksum)
+        if size < MspCodec.JUMBO_FRAME_SIZE:
+            buffer = bytearray((36, 77, 60, size, code))
+        else:
+            buffer = bytearray((36, 77, 60, MspCodec.JUMBO_FRAME_SIZE, code, size & 0xFF, size >> 8))
+        buffer += payload
+        buffer.append(xor_checksum(buffer[3:]))
         return bytes(buffer)
 
-    def read(self) -> bytes:
-        state = 0
-        result = bytearray()
-        while True:
-            if state < 3:
-                byte = self.port.read()
-                if state > 0:
-                    result.append(byte[0])
-                if byte == b'$':
-                    result.append(byte[0])
-                    state = 1
-                    continue
-                elif byte == b'M':
-                    state = 2
-                    continue
-                elif byte == b'>':
-                    state = 3
-                    continue
-            else:
-                byte = self.port.read()
-                result = result + self.port.read(int(byte[0]) + 2)
-                break
-        return bytes(result)
-
-    def read_rec(self) -> MspRec:
-        return MspRec(self.read())
+    def encode_v2(self, code: int, *data) -> bytes:
+        payload = bytes(data)
+        size = len(payload)
+        # Header: $X< flag code size
+        buffer = bytearray((36, 88, 60, 0, code & 0xFF, code >> 8, size & 0xFF, size >> 8))
+        buffer += payload
+        buffer.append(crc8_dvb_s2(buffer[3:]))
+        return bytes(buffer)
 
-    def send(self, code: int, *data) -> bytes:
-        self.port.write(self.encode_v1(code, *data))
+    def encode(self, code: int, *data) -> bytes:
+        if code > MspCodec.V1_MAX_CODE:
+            return self.encode_v2(code, *data)
+        return self.encode_v1(code, *data)
 
-    def decode(self, rec: MspRec) -> None:
+    def decode(self, rec: MspRec) -> Optional[dict]:
+        """Decode a response with its schema into ``data`` and return the decoded fields."""
+        if rec.type != MspRecType.RESPONSE:
+            return None
+        values = decode_payload(rec.code, rec.payload, self.data.api_version)
+        if values is None:
+            return None
         match rec.code:
             case MspCodes.MSP_API_VERSION:
-                self.data.msp_protocol_version = next(rec)
-                self.data.api_version = f'{next(rec)}.{next(rec)}.0'
-            case MspCodes.MSP_FC_VARIANT:
-                self.data.flight_controller_identifier = rec[:4].decode()
+                values['api_version'] = f'{values["api_major"]}.{values["api_minor"]}.0'
             case MspCodes.MSP_FC_VERSION:
-                self.data.flight_controller_version = f'{next(rec)}.{next(rec)}.{next(rec)}'
+                values['flight_controller_version'] = '.'.join(map(str, values['flight_controller_version']))
             case MspCodes.MSP_BUILD_INFO:
-                buf = bytearray(rec[:19])
-                buf.insert(11, 32)
-                self.data.build_info = buf.decode()
+                values['build_info'] = f'{values["build_date"]} {values["build_time"]}'
             case MspCodes.MSP_BOARD_INFO:
-                self.data.board_identifier = rec.read_string(4)
-                self.data.board_version = rec.read_uint16()
-                self.data.board_type = rec.read_uint8()
-                self.data.target_capabilities = rec.read_uint8()
-                self.data.target_name = rec.read_string()
-                self.data.board_name = rec.read_string()
-                self.data.manufacturer_id = rec.read_string()
-
-                self.data.signature = bytearray()
-                for _ in range(MspCtr.SIGNATURE_LENGTH):
-                    self.data.signature.append(rec.read_uint8())
-
-                self.data.mcu_type_id = rec.read_uint8()
-
-                version = Version.parse(self.data.api_version)
-                if version >= MspCtr.API_VERSION_1_42:
-                    self.data.configuration_state = rec.read_uint8()
-                if version >= MspCtr.API_VERSION_1_43:
-                    self.data.sample_rate_hz = rec.read_uint16()
-                    self.data.configuration_problems = rec.read_uint32()
-                else:
-                    self.data.configuration_problems = 0
+                values.setdefault('configuration_problems', 0)
+        for name, value in values.items():
+            if hasattr(self.data, name):
+                setattr(self.data, name, value)
+        return values
+
+
+class MspCtr(MspCodec):
+    def __init__(self, port: serial.Serial, timeout: Optional[float] = None) -> None:
+        super().__init__()
+        self.port = port
+        self.timeout = timeout
+        self.framer = MspFramer()
+
+    def close(self) -> None:
+        self.port.close()
+
+    def read(self, timeout: Optional[float] = None) -> bytes:
+        timeout = self.timeout if timeout is None else timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        port_timeout = self.port.timeout
+        try:
+            while True:
+                frame = self.framer.next_frame()
+                if frame is not None:
+                    metrics.count('msp_frames_received')
+                    return frame
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(f'MSP frame not received in {timeout}s')
+                    self.port.timeout = remaining
+                self.framer.feed(self.port.read(self.port.in_waiting or 1))
+        finally:
+            # The deadline is per call, later reads get the caller's port timeout back
+            if self.port.timeout != port_timeout:
+                self.port.timeout = port_timeout
+
+    def read_rec(self, timeout: Optional[float] = None) -> MspRec:
+        return MspRec(self.read(timeout))
+
+    def send(self, code: int, *data) -> bytes:
+        frame = self.encode(code, *data)
+        self.port.write(frame)
+        metrics.count('msp_frames_sent')
+        metrics.count('msp_bytes_written', len(frame))
+
+    def request(self, code: int, *data, timeout: Optional[float] = None) -> MspRec:
+        return self.request_many(((code, *data),), timeout=timeout)[0]
+
+    def request_many(self, requests: Iterable, window: int = 8, timeout: Optional[float] = None) -> list[MspRec]:
+        """Send requests pipelined and return the responses in request order.
+
+        Each request is a code or a ``(code, *data)`` tuple. Up to ``window`` requests are
+        written at once, responses are matched back by code, first in first out, and
+        ``timeout`` applies to every request from the moment it was written.
+        """
+        requests = [item if isinstance(item, tuple) else (item,) for item in requests]
+        timeout = self.timeout if timeout is None else timeout
+        results = [None] * len(requests)
+        pending = {} # code -> deque of (index, deadline)
+        in_flight = 0
+        next_idx = 0
+
+        while next_idx < len(requests) or in_flight:
+            if in_flight < window and next_idx < len(requests):
+                now = time.monotonic()
+                batch = bytearray()
+                first = next_idx
+                while in_flight < window and next_idx < len(requests):
+                    code, *data = requests[next_idx]
+                    batch += self.encode(code, *data)
+                    deadline = None if timeout is None else now + timeout
+                    pending.setdefault(int(code), deque()).append((next_idx, deadline))
+                    next_idx += 1
+                    in_flight += 1
+                self.port.write(batch)
+                metrics.count('msp_frames_sent', next_idx - first)
+                metrics.count('msp_bytes_written', len(batch))
+
+            remaining = None
+            if timeout is not None:
+                code, (_, deadline) = min(((c, q[0]) for c, q in pending.items() if q), key=lambda x: x[1][1])
+                remaining = max(deadline - time.monotonic(), 0)
+            try:
+                rec = MspRec(self.read(remaining))
+            except TimeoutError as e:
+                name = getattr(msp_code(code), 'name', code)
+                raise TimeoutError(f'MSP response for {name} not received in {timeout}s') from e
+
+            queue = pending.get(int(rec.code))
+            if queue:
+                results[queue.popleft()[0]] = rec
+                in_flight -= 1
+
+        return results
 
 
 
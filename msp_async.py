@@ -0,0 +1,169 @@
+import asyncio
+from collections import deque
+from typing import Iterable, Optional
+
+import serial
+
+from msp import MspCodec, MspFramer
+from msp_data import MspRec, msp_code
+
+try:
+    import serial_asyncio
+except ImportError:
+    serial_asyncio = None
+
+LATE_REPLY_TIME = 1.0 # how long the reply of a cancelled request without a timeout is waited for
+
+
+class MspProtocol(asyncio.Protocol):
+    """Splits the incoming stream into MSP frames and resolves the futures waiting for them."""
+
+    def __init__(self) -> None:
+        self.transport = None
+        self.framer = MspFramer()
+        self._waiters = {} # code -> deque of futures
+        self._late = {} # code -> deque of times until a reply is taken as owed to a request that gave up
+        self._shadowed = set() # waiters queued behind a reply dropped as late, it may have been theirs
+        self._closed = asyncio.get_running_loop().create_future()
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self.transport = transport
+
+    def data_received(self, data: bytes) -> None:
+        self.framer.feed(data)
+        while (frame := self.framer.next_frame()) is not None:
+            rec = MspRec(frame)
+            code = int(rec.code)
+            queue = self._waiters.get(code)
+            late = self._late.get(code)
+            now = asyncio.get_running_loop().time()
+            while late and late[0] < now:
+                late.popleft() # the reply of that request was lost
+            if late:
+                # Replies come in request order, this one belongs to a request that gave up
+                late.popleft()
+                self._shadowed.update(queue or ())
+                continue
+            while queue:
+                waiter = queue.popleft()
+                self._shadowed.discard(waiter)
+                if not waiter.done():
+                    waiter.set_result(rec)
+                    break
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        for queue in self._waiters.values():
+            for waiter in queue:
+                if not waiter.done():
+                    waiter.set_exception(exc or ConnectionError('MSP connection closed'))
+            queue.clear()
+        self._late.clear()
+        self._shadowed.clear()
+        if not self._closed.done():
+            self._closed.set_result(None)
+
+    def expect(self, code: int) -> asyncio.Future:
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(int(code), deque()).append(waiter)
+        return waiter
+
+    def abandon(self, code: int, waiter: asyncio.Future, grace: Optional[float] = None) -> None:
+        """Give up on ``waiter``, its reply is dropped when it arrives in the next ``grace`` seconds.
+
+        When a late reply was dropped while ``waiter`` was queued, that reply may have been
+        its own, nothing more is owed then and no reply is dropped for it.
+        """
+        queue = self._waiters.get(int(code))
+        if queue and waiter in queue:
+            queue.remove(waiter)
+            if waiter in self._shadowed:
+                self._shadowed.discard(waiter)
+                return
+            expires = asyncio.get_running_loop().time() + (grace or LATE_REPLY_TIME)
+            self._late.setdefault(int(code), deque()).append(expires)
+
+    async def wait_closed(self) -> None:
+        await self._closed
+
+
+class SerialTransport(asyncio.Transport):
+    """Minimal transport over a non-blocking ``serial.Serial`` driven by ``loop.add_reader``.
+
+    Used when pyserial-asyncio is not installed, works on POSIX only.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, protocol: asyncio.Protocol, com: serial.Serial) -> None:
+        super().__init__()
+        self._loop = loop
+        self._protocol = protocol
+        self._serial = com
+        self._closing = False
+        loop.add_reader(com.fileno(), self._read_ready)
+        loop.call_soon(protocol.connection_made, self)
+
+    def _read_ready(self) -> None:
+        try:
+            data = self._serial.read(self._serial.in_waiting or 1)
+        except serial.SerialException as e:
+            self._close(e)
+            return
+        if data:
+            self._protocol.data_received(data)
+
+    def write(self, data: bytes) -> None:
+        self._serial.write(data)
+
+    def is_closing(self) -> bool:
+        return self._closing
+
+    def close(self) -> None:
+        self._close(None)
+
+    def _close(self, exc: Optional[Exception]) -> None:
+        if self._closing:
+            return
+        self._closing = True
+        self._loop.remove_reader(self._serial.fileno())
+        self._serial.close()
+        self._loop.call_soon(self._protocol.connection_lost, exc)
+
+
+class AsyncMspCtr(MspCodec):
+    def __init__(self, transport: asyncio.Transport, protocol: MspProtocol, timeout: Optional[float] = None) -> None:
+        super().__init__()
+        self.transport = transport
+        self.protocol = protocol
+        self.timeout = timeout
+
+    async def request(self, code: int, *data, timeout: Optional[float] = None) -> MspRec:
+        timeout = self.timeout if timeout is None else timeout
+        waiter = self.protocol.expect(code)
+        self.transport.write(self.encode(code, *data))
+        try:
+            return await asyncio.wait_for(waiter, timeout)
+        except asyncio.CancelledError:
+            self.protocol.abandon(code, waiter)
+            raise
+        except asyncio.TimeoutError as e:
+            self.protocol.abandon(code, waiter, timeout)
+            name = getattr(msp_code(code), 'name', code)
+            raise TimeoutError(f'MSP response for {name} not received in {timeout}s') from e
+
+    async def request_many(self, requests: Iterable, timeout: Optional[float] = None) -> list[MspRec]:
+        requests = [item if isinstance(item, tuple) else (item,) for item in requests]
+        return await asyncio.gather(*(self.request(*item, timeout=timeout) for item in requests))
+
+    async def close(self) -> None:
+        self.transport.close()
+        await self.protocol.wait_closed()
+
+
+async def open_msp(port: str, baudrate: int = 115200, timeout: Optional[float] = None) -> AsyncMspCtr:
+    loop = asyncio.get_running_loop()
+    if serial_asyncio:
+        transport, protocol = await serial_asyncio.create_serial_connection(loop, MspProtocol, port, baudrate=baudrate)
+    else:
+        protocol = MspProtocol()
+        transport = SerialTransport(loop, protocol, serial.Serial(port, baudrate=baudrate, timeout=0))
+        await asyncio.sleep(0)
+    return AsyncMspCtr(transport, protocol, timeout)
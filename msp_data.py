@@ -1,55 +1,57 @@
 from enum import Enum, IntEnum
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import Optional
 from msp_codes import MspCodes
 
-@dataclass
+@dataclass(slots=True)
 class MspData:
-    msp_protocol_version = 0
-    api_version = '0.0.0'
-    flight_controller_identifier = ''
-    flight_controller_version = ''
-    version = 0
-    build_info = ''
-    build_key = ''
-    build_options = []
-    multi_type = 0
-    msp_version = 0 # not specified using semantic versioning
-    capability = 0
-    cycle_time = 0
-    i2c_error = 0
-    cpuload = 0
-    cpu_temp = 0
-    active_sensors = 0
-    mode = 0
-    profile = 0
-    uid = [0, 0, 0]
-    accelerometer_trims = [0, 0]
-    name = '' # present for backwards compatibility before msp v1.45
-    craft_name = ''
-    display_name = '' # present for backwards compatibility before msp v1.45
-    pilot_name = ''
-    pid_profile_names = ['', '', '', '']
-    rate_profile_names = ['', '', '', '']
-    num_profiles = 3
-    rate_profile = 0
-    board_type = 0
-    arming_disable_count = 0
-    arming_disable_flags = 0
-    arming_disabled = False
-    runaway_takeoff_prevention_disabled = False
-    board_identifier = ''
-    board_version = 0
-    target_capabilities = 0
-    target_name = ''
-    board_name = ''
-    manufacturer_id = ''
-    signature = None
-    mcu_type_id = 255
-    configuration_state = 0
-    config_state_flag = 0
-    sample_rate_hz = 0
-    configuration_problems = 0
-    hardware_name = ''
+    """State of one connected board, filled in by ``MspCodec.decode``."""
+    msp_protocol_version: int = 0
+    api_version: str = '0.0.0'
+    flight_controller_identifier: str = ''
+    flight_controller_version: str = ''
+    version: int = 0
+    build_info: str = ''
+    build_key: str = ''
+    build_options: list[int] = field(default_factory=list)
+    multi_type: int = 0
+    msp_version: int = 0 # not specified using semantic versioning
+    capability: int = 0
+    cycle_time: int = 0
+    i2c_error: int = 0
+    cpuload: int = 0
+    cpu_temp: int = 0
+    active_sensors: int = 0
+    mode: int = 0
+    profile: int = 0
+    uid: tuple[int, ...] = (0, 0, 0)
+    accelerometer_trims: tuple[int, ...] = (0, 0)
+    name: str = '' # present for backwards compatibility before msp v1.45
+    craft_name: str = ''
+    display_name: str = '' # present for backwards compatibility before msp v1.45
+    pilot_name: str = ''
+    pid_profile_names: list[str] = field(default_factory=lambda: [''] * 4)
+    rate_profile_names: list[str] = field(default_factory=lambda: [''] * 4)
+    num_profiles: int = 3
+    rate_profile: int = 0
+    board_type: int = 0
+    arming_disable_count: int = 0
+    arming_disable_flags: int = 0
+    arming_disabled: bool = False
+    runaway_takeoff_prevention_disabled: bool = False
+    board_identifier: str = ''
+    board_version: int = 0
+    target_capabilities: int = 0
+    target_name: str = ''
+    board_name: str = ''
+    manufacturer_id: str = ''
+    signature: Optional[bytes] = None
+    mcu_type_id: int = 255
+    configuration_state: int = 0
+    config_state_flag: int = 0
+    sample_rate_hz: int = 0
+    configuration_problems: int = 0
+    hardware_name: str = ''
 
 
 class MspRecType(Enum):
@@ -75,15 +77,36 @@ class ResetTypes(IntEnum):
     BASE_DEFAULTS = 0
     CUSTOM_DEFAULTS = 1
 
+def msp_code(code: int):
+    try:
+        return MspCodes(code)
+    except ValueError:
+        return code
+
+REC_TYPES = {ord(rec_type.value): rec_type for rec_type in MspRecType}
+
+
 class MspRec:
+    """One received frame, ``payload`` is a view into the frame without a copy."""
+    __slots__ = ('type', 'version', 'code', 'payload', '_idx')
+
     def __init__(self, buf: bytes) -> None:
         self._idx = 0
-        self.type = MspRecType(chr(buf[2]))
-        self.code = MspCodes(buf[3])
-        self.payload = buf[4: -1]
+        self.type = REC_TYPES[buf[2]]
+        view = memoryview(buf)
+        if buf[1] == 88: # $X - MSPv2
+            self.version = 2
+            self.code = msp_code(buf[4] | buf[5] << 8)
+            self.payload = view[8: -1]
+        else:
+            self.version = 1
+            self.code = msp_code(buf[4])
+            # Jumbo frame: size 255 followed by 16-bit size after the code
+            self.payload = view[7: -1] if buf[3] == 255 else view[5: -1]
 
     def __repr__(self) -> str:
-        return f'MspRec type: {self.type.name}, code: {self.code.name}, payload: {self.payload}'
+        code = getattr(self.code, 'name', self.code)
+        return f'MspRec type: {self.type.name}, v{self.version}, code: {code}, payload: {bytes(self.payload)}'
 
     def __iter__(self):
         self._idx = 0
@@ -115,11 +138,11 @@ class MspRec:
         return result
 
     def read_string(self, count: int = 0) -> str:
-        count = count or next(self, 0);
+        count = count or next(self, 0)
         end = self._idx + count
-        if count and end < len(self.payload):
-            result = self.payload[self._idx: end].decode()
-            self._idx += len(result)
+        if count and end <= len(self.payload):
+            result = bytes(self.payload[self._idx: end]).decode()
+            self._idx = end
             return result
         return ''
 
@@ -129,11 +152,11 @@ class MspRec:
         return None
 
     def uint16(self, idx: int) -> int:
-        if (idx + 1) < len(self.payload):
-            return self.payload[idx] | self.payload[idx + 1] << 8
+        if idx + 2 <= len(self.payload):
+            return int.from_bytes(self.payload[idx: idx + 2], 'little')
         return None
 
     def uint32(self, idx: int) -> int:
-        if (idx + 3) < len(self.payload):
-            return self.uint16(idx) | self.uint16(idx + 2) << 16
+        if idx + 4 <= len(self.payload):
+            return int.from_bytes(self.payload[idx: idx + 4], 'little')
         return None
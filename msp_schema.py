@@ -0,0 +1,240 @@
+import re
+import struct
+from functools import lru_cache
+from typing import NamedTuple, Optional
+
+from msp_codes import MspCodes
+
+
+class Version(NamedTuple):
+    """MSP API version, ordered like a tuple. Only ``major.minor.patch`` is ever reported."""
+    major: int
+    minor: int = 0
+    patch: int = 0
+
+    @classmethod
+    def parse(cls, version: str) -> 'Version':
+        parts = version.split('.')
+        if not 1 <= len(parts) <= 3 or not all(part.isdigit() for part in parts):
+            raise ValueError(f'{version} is not a valid version')
+        return cls(*map(int, parts))
+
+
+# Field formats are little endian struct codes with an optional count, e.g. 'H' or '3h'.
+# Counted numbers become tuples, 'Ns' stays bytes. The extensions are not struct codes:
+#   'NS' fixed size text, 'P' u8 length prefixed text, 'V' u8 length prefixed bytes,
+#   'R' text up to the end of the payload and 'H*' numbers repeated up to the end.
+FORMAT_RE = re.compile(r'^(\d*)([bBhHiIqQsS])$|^([PVR])$|^([bBhHiI])\*$')
+
+
+class Field(NamedTuple):
+    name: str
+    fmt: str
+    since: Optional[Version] = None # first API version that sends the field
+
+
+API_VERSION_1_41 = Version(major=1, minor=41)
+API_VERSION_1_42 = Version(major=1, minor=42)
+API_VERSION_1_43 = Version(major=1, minor=43)
+API_VERSION_1_46 = Version(major=1, minor=46)
+
+SCHEMAS = {
+    MspCodes.MSP_API_VERSION: (Field('msp_protocol_version', 'B'), Field('api_major', 'B'), Field('api_minor', 'B')),
+    MspCodes.MSP_FC_VARIANT: (Field('flight_controller_identifier', '4S'),),
+    MspCodes.MSP_FC_VERSION: (Field('flight_controller_version', '3B'),),
+    MspCodes.MSP_BUILD_INFO: (Field('build_date', '11S'), Field('build_time', '8S')),
+    MspCodes.MSP_BOARD_INFO: (
+        Field('board_identifier', '4S'),
+        Field('board_version', 'H'),
+        Field('board_type', 'B'),
+        Field('target_capabilities', 'B'),
+        Field('target_name', 'P'),
+        Field('board_name', 'P'),
+        Field('manufacturer_id', 'P'),
+        Field('signature', '32s'),
+        Field('mcu_type_id', 'B'),
+        Field('configuration_state', 'B', API_VERSION_1_42),
+        Field('sample_rate_hz', 'H', API_VERSION_1_43),
+        Field('configuration_problems', 'I', API_VERSION_1_43),
+    ),
+    MspCodes.MSP_NAME: (Field('name', 'R'),),
+    MspCodes.MSP_SET_NAME: (Field('name', 'R'),),
+    MspCodes.MSP_UID: (Field('uid', '3I'),),
+    MspCodes.MSP_STATUS_EX: (
+        Field('cycle_time', 'H'),
+        Field('i2c_error', 'H'),
+        Field('active_sensors', 'H'),
+        Field('mode', 'I'),
+        Field('profile', 'B'),
+        Field('cpuload', 'H'),
+        Field('num_profiles', 'B'),
+        Field('rate_profile', 'B'),
+        Field('mode_extra', 'V'),
+        Field('arming_disable_count', 'B'),
+        Field('arming_disable_flags', 'I'),
+        Field('config_state_flag', 'B', API_VERSION_1_42),
+        Field('cpu_temp', 'H', API_VERSION_1_46),
+    ),
+    MspCodes.MSP_RAW_IMU: tuple(Field(f'{sensor}_{axis}', 'h') for sensor in ('acc', 'gyro', 'mag') for axis in 'xyz'),
+    MspCodes.MSP_ATTITUDE: (Field('roll', 'h'), Field('pitch', 'h'), Field('yaw', 'h')), # 0.1 deg, 0.1 deg, deg
+    MspCodes.MSP_ALTITUDE: (Field('altitude', 'i'), Field('vario', 'h')), # cm, cm/s
+    MspCodes.MSP_ANALOG: ( # 0.1 V, mAh, 0-1023, 0.01 A, 0.01 V
+        Field('vbat_legacy', 'B'),
+        Field('mah_drawn', 'H'),
+        Field('rssi', 'H'),
+        Field('amperage', 'h'),
+        Field('voltage', 'H', API_VERSION_1_41),
+    ),
+    MspCodes.MSP_BATTERY_STATE: (
+        Field('cell_count', 'B'),
+        Field('capacity', 'H'),
+        Field('voltage_legacy', 'B'),
+        Field('mah_drawn', 'H'),
+        Field('amperage', 'H'),
+        Field('battery_state', 'B', API_VERSION_1_41),
+        Field('voltage', 'H', API_VERSION_1_41),
+    ),
+    MspCodes.MSP_RC: (Field('channels', 'H*'),),
+    MspCodes.MSP_MOTOR: (Field('motors', 'H*'),),
+    MspCodes.MSP_ACC_TRIM: (Field('accelerometer_trims', '2h'),),
+    MspCodes.MSP_SET_ACC_TRIM: (Field('accelerometer_trims', '2h'),),
+    MspCodes.MSP_FEATURE_CONFIG: (Field('features', 'I'),),
+    MspCodes.MSP_SET_FEATURE_CONFIG: (Field('features', 'I'),),
+    MspCodes.MSP_BOARD_ALIGNMENT_CONFIG: (Field('roll', 'h'), Field('pitch', 'h'), Field('yaw', 'h')),
+    MspCodes.MSP_SET_BOARD_ALIGNMENT_CONFIG: (Field('roll', 'h'), Field('pitch', 'h'), Field('yaw', 'h')),
+    MspCodes.MSP_ARMING_CONFIG: (Field('auto_disarm_delay', 'B'), Field('kill_switch', 'B'), Field('small_angle', 'B')),
+    MspCodes.MSP_SET_ARMING_CONFIG: (Field('auto_disarm_delay', 'B'), Field('kill_switch', 'B'), Field('small_angle', 'B')),
+    MspCodes.MSP_DATAFLASH_SUMMARY: (Field('flags', 'B'), Field('sectors', 'I'), Field('total_size', 'I'), Field('used_size', 'I')),
+    MspCodes.MSP_RESET_CONF: (Field('reset_type', 'B'),),
+    MspCodes.MSP_SELECT_SETTING: (Field('profile', 'B'),),
+}
+
+
+class Step(NamedTuple):
+    kind: str # 'struct' or one of the extension formats
+    struct: Optional[struct.Struct]
+    fields: tuple # (name, count, is_text, is_bytes) for struct steps, the field name otherwise
+
+
+class CompiledSchema:
+    """Decoder and encoder for one code and API version.
+
+    Consecutive fixed size fields are merged into one ``struct.Struct``. A payload that
+    ends early, as older firmware does, decodes the fields up to the first step that
+    does not fit.
+    """
+
+    def __init__(self, fields: tuple) -> None:
+        self.steps = []
+        fmt = ''
+        group = []
+        for field in fields:
+            match = FORMAT_RE.match(field.fmt)
+            if not match:
+                raise ValueError(f'Bad format {field.fmt!r} for {field.name}')
+            count, code, extension, repeated = match.groups()
+            if code:
+                fmt += count + code.lower() if code == 'S' else count + code
+                group.append((field.name, int(count or 1), code == 'S', code in 'sS'))
+                continue
+            if group:
+                self.steps.append(Step('struct', struct.Struct('<' + fmt), tuple(group)))
+                fmt, group = '', []
+            self.steps.append(Step(repeated or extension, struct.Struct('<' + repeated) if repeated else None, field.name))
+        if group:
+            self.steps.append(Step('struct', struct.Struct('<' + fmt), tuple(group)))
+
+    def decode(self, payload) -> dict:
+        result = {}
+        offset = 0
+        size = len(payload)
+        for step in self.steps:
+            if step.kind == 'struct':
+                if offset + step.struct.size > size:
+                    break
+                values = step.struct.unpack_from(payload, offset)
+                offset += step.struct.size
+                idx = 0
+                for name, count, is_text, is_bytes in step.fields:
+                    if is_bytes:
+                        value = values[idx]
+                        result[name] = value.rstrip(b'\0').decode('ascii', errors='replace') if is_text else value
+                        idx += 1
+                    elif count == 1:
+                        result[name] = values[idx]
+                        idx += 1
+                    else:
+                        result[name] = values[idx:idx + count]
+                        idx += count
+            elif step.kind in ('P', 'V'):
+                if offset >= size or offset + 1 + payload[offset] > size:
+                    break
+                value = bytes(payload[offset + 1:offset + 1 + payload[offset]])
+                offset += 1 + len(value)
+                result[step.fields] = value.decode('ascii', errors='replace') if step.kind == 'P' else value
+            elif step.kind == 'R':
+                result[step.fields] = bytes(payload[offset:]).decode('ascii', errors='replace')
+                offset = size
+            else:
+                count = (size - offset) // step.struct.size
+                result[step.fields] = struct.unpack_from(f'<{count}{step.kind[0]}', payload, offset)
+                offset += count * step.struct.size
+        return result
+
+    def row(self, payload) -> tuple:
+        """Values of the leading fixed size fields as one flat tuple, for sample buffers."""
+        return self.steps[0].struct.unpack_from(payload)
+
+    def row_fields(self) -> tuple:
+        step = self.steps[0]
+        if step.kind != 'struct':
+            return ()
+        return tuple(name if count == 1 else f'{name}_{i}' for name, count, _, _ in step.fields for i in range(count))
+
+    def encode(self, values: dict) -> bytes:
+        result = bytearray()
+        for step in self.steps:
+            if step.kind == 'struct':
+                args = []
+                for name, count, is_text, is_bytes in step.fields:
+                    value = values[name]
+                    if is_text:
+                        value = value.encode('ascii')
+                    if count == 1 or is_bytes:
+                        args.append(value)
+                    else:
+                        args.extend(value)
+                result += step.struct.pack(*args)
+            elif step.kind in ('P', 'V'):
+                value = values[step.fields]
+                value = value.encode('ascii') if step.kind == 'P' else bytes(value)
+                result.append(len(value))
+                result += value
+            elif step.kind == 'R':
+                result += values[step.fields].encode('ascii')
+            else:
+                value = values[step.fields]
+                result += struct.pack(f'<{len(value)}{step.kind[0]}', *value)
+        return bytes(result)
+
+
+@lru_cache(maxsize=None)
+def compiled(code: int, api_version: Version) -> Optional[CompiledSchema]:
+    fields = SCHEMAS.get(code)
+    if fields is None:
+        return None
+    return CompiledSchema(tuple(field for field in fields if field.since is None or api_version >= field.since))
+
+@lru_cache(maxsize=64)
+def parse_version(api_version: str) -> Version:
+    return Version.parse(api_version)
+
+def decode_payload(code: int, payload, api_version: str = '0.0.0') -> Optional[dict]:
+    schema = compiled(code, parse_version(api_version))
+    return schema.decode(payload) if schema else None
+
+def encode_payload(code: int, values: dict, api_version: str = '0.0.0') -> bytes:
+    schema = compiled(code, parse_version(api_version))
+    if schema is None:
+        raise KeyError(f'No schema for {getattr(code, "name", code)}')
+    return schema.encode(values)
@@ -0,0 +1,131 @@
+import json
+import os
+import tempfile
+from typing import NamedTuple
+
+from msp import MspCtr
+from msp_codes import MspCodes
+from msp_data import MspRecType
+
+SNAPSHOT_FORMAT = 'bf_flash-msp-snapshot'
+SNAPSHOT_VERSION = 1
+MODE_RANGE_EXTRA_SIZE = 3 # mode id, logic, linked mode
+
+
+class ConfigBlock(NamedTuple):
+    get: MspCodes
+    set: MspCodes
+    record_size: int = 0 # the response is a list of records, written back one by one with their index
+    get_only: tuple = () # offsets of response bytes the SET handler does not read, left out when writing back
+
+
+# Pairs whose SET handler reads the layout the GET handler writes for the same API version, once the
+# status bytes only the GET handler writes are left out:
+#   MSP_BLACKBOX_CONFIG   'blackbox supported' before the device
+#   MSP_SENSOR_ALIGNMENT  detected gyros before gyro_to_use
+#   MSP_MOTOR_CONFIG      motor count before motor_poles, ESC sensor enabled at the end
+CONFIG_BLOCKS = (
+    ConfigBlock(MspCodes.MSP_FEATURE_CONFIG, MspCodes.MSP_SET_FEATURE_CONFIG),
+    ConfigBlock(MspCodes.MSP_BATTERY_CONFIG, MspCodes.MSP_SET_BATTERY_CONFIG),
+    ConfigBlock(MspCodes.MSP_BOARD_ALIGNMENT_CONFIG, MspCodes.MSP_SET_BOARD_ALIGNMENT_CONFIG),
+    ConfigBlock(MspCodes.MSP_MIXER_CONFIG, MspCodes.MSP_SET_MIXER_CONFIG),
+    ConfigBlock(MspCodes.MSP_RX_CONFIG, MspCodes.MSP_SET_RX_CONFIG),
+    ConfigBlock(MspCodes.MSP_RX_MAP, MspCodes.MSP_SET_RX_MAP),
+    ConfigBlock(MspCodes.MSP_RSSI_CONFIG, MspCodes.MSP_SET_RSSI_CONFIG),
+    ConfigBlock(MspCodes.MSP_CF_SERIAL_CONFIG, MspCodes.MSP_SET_CF_SERIAL_CONFIG),
+    ConfigBlock(MspCodes.MSP_ARMING_CONFIG, MspCodes.MSP_SET_ARMING_CONFIG),
+    ConfigBlock(MspCodes.MSP_FAILSAFE_CONFIG, MspCodes.MSP_SET_FAILSAFE_CONFIG),
+    ConfigBlock(MspCodes.MSP_BLACKBOX_CONFIG, MspCodes.MSP_SET_BLACKBOX_CONFIG, get_only=(0,)),
+    ConfigBlock(MspCodes.MSP_ADVANCED_CONFIG, MspCodes.MSP_SET_ADVANCED_CONFIG),
+    ConfigBlock(MspCodes.MSP_FILTER_CONFIG, MspCodes.MSP_SET_FILTER_CONFIG),
+    ConfigBlock(MspCodes.MSP_PID_ADVANCED, MspCodes.MSP_SET_PID_ADVANCED),
+    ConfigBlock(MspCodes.MSP_SENSOR_CONFIG, MspCodes.MSP_SET_SENSOR_CONFIG),
+    ConfigBlock(MspCodes.MSP_SENSOR_ALIGNMENT, MspCodes.MSP_SET_SENSOR_ALIGNMENT, get_only=(3,)),
+    ConfigBlock(MspCodes.MSP_MOTOR_CONFIG, MspCodes.MSP_SET_MOTOR_CONFIG, get_only=(6, 9)),
+    ConfigBlock(MspCodes.MSP_MOTOR_3D_CONFIG, MspCodes.MSP_SET_MOTOR_3D_CONFIG),
+    ConfigBlock(MspCodes.MSP_GPS_CONFIG, MspCodes.MSP_SET_GPS_CONFIG),
+    ConfigBlock(MspCodes.MSP_GPS_RESCUE, MspCodes.MSP_SET_GPS_RESCUE),
+    ConfigBlock(MspCodes.MSP_COMPASS_CONFIG, MspCodes.MSP_SET_COMPASS_CONFIG),
+    ConfigBlock(MspCodes.MSP_BEEPER_CONFIG, MspCodes.MSP_SET_BEEPER_CONFIG),
+    ConfigBlock(MspCodes.MSP_RC_DEADBAND, MspCodes.MSP_SET_RC_DEADBAND),
+    ConfigBlock(MspCodes.MSP_RC_TUNING, MspCodes.MSP_SET_RC_TUNING),
+    ConfigBlock(MspCodes.MSP_PID, MspCodes.MSP_SET_PID),
+    ConfigBlock(MspCodes.MSP_ACC_TRIM, MspCodes.MSP_SET_ACC_TRIM),
+    ConfigBlock(MspCodes.MSP_MODE_RANGES, MspCodes.MSP_SET_MODE_RANGE, 4),
+    ConfigBlock(MspCodes.MSP_ADJUSTMENT_RANGES, MspCodes.MSP_SET_ADJUSTMENT_RANGE, 6),
+)
+# Read for the snapshot only, the logic and link of every mode range are written with MSP_SET_MODE_RANGE
+EXTRA_CODES = (MspCodes.MSP_MODE_RANGES_EXTRA,)
+IDENTIFICATION_CODES = (
+    MspCodes.MSP_API_VERSION,
+    MspCodes.MSP_FC_VARIANT,
+    MspCodes.MSP_FC_VERSION,
+    MspCodes.MSP_BOARD_INFO,
+)
+
+
+def read_snapshot(msp: MspCtr) -> dict:
+    """Read every supported config block, blocks the firmware does not know are left out."""
+    for rec in msp.request_many(IDENTIFICATION_CODES):
+        msp.decode(rec)
+    codes = [block.get for block in CONFIG_BLOCKS] + list(EXTRA_CODES)
+    blocks = {}
+    for code, rec in zip(codes, msp.request_many(codes)):
+        if rec.type == MspRecType.RESPONSE:
+            blocks[code.name] = bytes(rec.payload).hex()
+    return {
+        'format': SNAPSHOT_FORMAT,
+        'version': SNAPSHOT_VERSION,
+        'api_version': msp.data.api_version,
+        'firmware': f'{msp.data.flight_controller_identifier} {msp.data.flight_controller_version}',
+        'board': msp.data.board_name,
+        'blocks': blocks,
+    }
+
+def restore_requests(snapshot: dict) -> list[tuple]:
+    """``(code, *data)`` SET requests that write the snapshot back, without the final EEPROM write."""
+    blocks = {name: bytes.fromhex(data) for name, data in snapshot['blocks'].items()}
+    extra = blocks.get(MspCodes.MSP_MODE_RANGES_EXTRA.name)
+    requests = []
+    for block in CONFIG_BLOCKS:
+        data = blocks.get(block.get.name)
+        if data is None:
+            continue
+        if not block.record_size:
+            requests.append((block.set, *(value for idx, value in enumerate(data) if idx not in block.get_only)))
+            continue
+        for index, offset in enumerate(range(0, len(data) - block.record_size + 1, block.record_size)):
+            record = data[offset:offset + block.record_size]
+            if block.get == MspCodes.MSP_MODE_RANGES and extra and index < extra[0]:
+                start = 1 + index * MODE_RANGE_EXTRA_SIZE
+                record += extra[start + 1:start + MODE_RANGE_EXTRA_SIZE]
+            requests.append((block.set, index, *record))
+    return requests
+
+def write_snapshot(msp: MspCtr, snapshot: dict) -> list[str]:
+    """Write a snapshot taken on the same API version and save it to EEPROM, return the rejected blocks."""
+    if snapshot.get('format') != SNAPSHOT_FORMAT or snapshot.get('version') != SNAPSHOT_VERSION:
+        raise ValueError('Not an MSP config snapshot')
+    for rec in msp.request_many(IDENTIFICATION_CODES):
+        msp.decode(rec)
+    # Block layouts change between API versions, raw payloads are only valid for the one they were read from
+    if snapshot['api_version'] != msp.data.api_version:
+        raise ValueError(f'Snapshot API version {snapshot["api_version"]} does not match the board {msp.data.api_version}')
+
+    requests = restore_requests(snapshot)
+    errors = [getattr(rec.code, 'name', str(rec.code)) for rec in msp.request_many(requests)
+              if rec.type != MspRecType.RESPONSE]
+    rec = msp.request(MspCodes.MSP_EEPROM_WRITE)
+    if rec.type != MspRecType.RESPONSE:
+        errors.append(MspCodes.MSP_EEPROM_WRITE.name)
+    return errors
+
+def save_snapshot(snapshot: dict, path: str) -> None:
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.tmp_')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(snapshot, f, indent=2)
+    os.replace(tmp, path)
+
+def load_snapshot(path: str) -> dict:
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
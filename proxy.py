@@ -1,53 +1,112 @@
+#!/usr/bin/env python3
+
+import argparse
 import os
+import selectors
+import sys
 import threading
+import time
+from typing import Callable, Optional
+
 import serial
 
+from capture import CAPTURE_EXT, FC_TO_HOST, HOST_TO_FC, CaptureWriter
+from msp import MspFramer
+from msp_data import MspRec
+from msp_schema import decode_payload
 
-SRC_PORT = '/dev/ttyAMA0' # mac
-DST_PORT = '/dev/ttyACM0' # betaflight
 BAUDRATE = 115200
+CHUNK_SIZE = 64 * 1024
+POLL_INTERVAL = 0.1
+DIRECTION_NAMES = ('host>fc', 'fc>host')
 
-src = serial.Serial(SRC_PORT, baudrate=BAUDRATE)
-dst = serial.Serial(DST_PORT, baudrate=BAUDRATE)
-is_work = True
+FrameCallback = Callable[[int, float, MspRec], None] # direction, seconds since start, frame
 
-def src2dst():
-    global is_work
-    dump = os.open('src2dst.dat', os.O_WRONLY | os.O_CREAT)
-    while is_work:
-        try:
-            byte = src.read()
-            dst.write(byte)
-            os.write(dump, byte)
-            os.sync()
-        except Exception as e:
-            os.sync()
-            print(e)
-            is_work = False
-
-def dst2src():
-    global is_work
-    dump = os.open('dst2src.dat', os.O_WRONLY | os.O_CREAT)
-    while is_work:
+
+class Proxy:
+    """Forwards between the host side and the flight controller side of a link.
+
+    Both ports are watched with a selector and whatever is readable is forwarded in one
+    chunk before it is captured or decoded, so the sniffer adds no per byte latency.
+    Works on POSIX, where serial ports are selectable.
+    """
+
+    def __init__(self, host: serial.Serial, fc: serial.Serial, capture: Optional[CaptureWriter] = None,
+                 on_frame: Optional[FrameCallback] = None) -> None:
+        self.ports = (host, fc)
+        self.capture = capture
+        self.on_frame = on_frame
+        self.framers = (MspFramer(), MspFramer())
+        self.bytes = [0, 0]
+        self.chunks = [0, 0]
+        self._stop = threading.Event()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def run(self) -> None:
+        started = time.monotonic()
+        selector = selectors.DefaultSelector()
+        host, fc = self.ports
+        selector.register(host.fileno(), selectors.EVENT_READ, (HOST_TO_FC, fc))
+        selector.register(fc.fileno(), selectors.EVENT_READ, (FC_TO_HOST, host))
         try:
-            byte = dst.read()
-            src.write(byte)
-            os.write(dump, byte)
-        except Exception as e:
-            os.sync()
-            print(e)
-            is_work = False
-
-try:
-    th1 = threading.Thread(target=src2dst, name='src2dst')
-    th2 = threading.Thread(target=dst2src, name='dst2src')
-
-    th1.start()
-    th2.start()
-    th2.join()
-except KeyboardInterrupt:
-    is_work = False
-finally:
-    os.sync()
-    dst.close()
-    src.close()
+            while not self._stop.is_set():
+                for key, _ in selector.select(POLL_INTERVAL):
+                    direction, target = key.data
+                    try:
+                        data = os.read(key.fd, CHUNK_SIZE)
+                    except BlockingIOError:
+                        continue
+                    if not data:
+                        raise ConnectionError(f'{DIRECTION_NAMES[direction]} side closed')
+                    target.write(data)
+                    self.bytes[direction] += len(data)
+                    self.chunks[direction] += 1
+                    if self.capture:
+                        self.capture.write(direction, data)
+                    if self.on_frame:
+                        framer = self.framers[direction]
+                        framer.feed(data)
+                        while (frame := framer.next_frame()) is not None:
+                            self.on_frame(direction, time.monotonic() - started, MspRec(frame))
+                if self.capture:
+                    self.capture.tick()
+        finally:
+            selector.close()
+
+
+def print_frame(direction: int, timestamp: float, rec: MspRec) -> None:
+    code = getattr(rec.code, 'name', rec.code)
+    values = decode_payload(rec.code, rec.payload) if direction == FC_TO_HOST else None
+    print(f'{timestamp:10.4f} {DIRECTION_NAMES[direction]} {rec.type.name:<11} {code} [{len(rec.payload)}]'
+          f'{" " + str(values) if values else ""}')
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='MSP serial link sniffer')
+    parser.add_argument('host', help='Port the configurator or host software is connected to')
+    parser.add_argument('fc', help='Flight controller port')
+    parser.add_argument('-b', dest='baudrate', type=int, default=BAUDRATE, help='Baud rate of both ports')
+    parser.add_argument('-o', dest='output', required=False, help=f'Capture file, {CAPTURE_EXT}')
+    parser.add_argument('--decode', action='store_true', help='Print the MSP frames passing through')
+    args = parser.parse_args()
+
+    host = serial.Serial(args.host, baudrate=args.baudrate, timeout=0)
+    fc = serial.Serial(args.fc, baudrate=args.baudrate, timeout=0)
+    capture = CaptureWriter(args.output) if args.output else None
+    proxy = Proxy(host, fc, capture, print_frame if args.decode else None)
+    try:
+        proxy.run()
+    except KeyboardInterrupt:
+        pass
+    except (ConnectionError, serial.SerialException, OSError) as e:
+        print(f'ERROR: {e}', file=sys.stderr)
+    finally:
+        if capture:
+            capture.close()
+        host.close()
+        fc.close()
+        print(f'host>fc {proxy.bytes[HOST_TO_FC]} bytes, fc>host {proxy.bytes[FC_TO_HOST]} bytes')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Optional
+
+from artifact_cache import ArtifactCache
+
+# Release lists change with every release, build info and firmware of a release do not
+INDEX_MAX_AGE = 6 * 3600
+BUILD_MAX_AGE = 30 * 86400
+WORKERS = 8
+
+
+class ReleaseIndex:
+    """Targets, releases and build info of the build server, kept in the artifact cache.
+
+    Online, an entry older than its max age is revalidated with its ETag, and a failed
+    request falls back to the cached copy. Offline, every lookup is answered from the
+    cache and a missing entry raises ``LookupError``. The bulk methods fetch on a
+    thread pool over the cache's single pooled session.
+    """
+
+    def __init__(self, cache: ArtifactCache, build_url: str, offline: bool = False, workers: int = WORKERS) -> None:
+        self.cache = cache
+        self.build_url = build_url
+        self.api_url = f'{build_url}/api'
+        self.offline = offline
+        self.workers = workers
+
+    def _fetch(self, key: str, url: str, max_age: float) -> str:
+        if self.offline:
+            path = self.cache.get_path(key)
+            if not path:
+                raise LookupError(f'{key} is not in the offline index, run prefetch first')
+            return path
+        return self.cache.fetch(key, url, max_age)
+
+    def _json(self, key: str, url: str, max_age: float):
+        with open(self._fetch(key, url, max_age), encoding='utf-8') as f:
+            return json.load(f)
+
+    def targets(self) -> list[str]:
+        items = self._json(ArtifactCache.key('index', 'targets'), f'{self.api_url}/targets', INDEX_MAX_AGE)
+        return sorted(item if isinstance(item, str) else item.get('target', '') for item in items)
+
+    def releases(self, target: str) -> list[dict]:
+        key = ArtifactCache.key('releases', target)
+        return self._json(key, f'{self.api_url}/targets/{target}', INDEX_MAX_AGE).get('releases') or []
+
+    def stable(self, target: str) -> list[str]:
+        return [item.get('release') for item in self.releases(target) if item.get('type') == 'Stable']
+
+    def _cached(self, key: str) -> Optional[dict]:
+        # Read without touching the access time, listings would rewrite the cache index for every entry
+        entry = self.cache.entry(key)
+        if not entry:
+            return None
+        with open(self.cache.object_path(entry['hash']), encoding='utf-8') as f:
+            return json.load(f)
+
+    def cached_stable(self, target: str) -> list[str]:
+        """Stable releases from the cache only, empty when the target was never fetched."""
+        releases = (self._cached(ArtifactCache.key('releases', target)) or {}).get('releases') or []
+        return [item.get('release') for item in releases if item.get('type') == 'Stable']
+
+    def build_info(self, target: str, release: str) -> dict:
+        key = ArtifactCache.key('build', target, release)
+        return self._json(key, f'{self.api_url}/builds/{release}/{target}', BUILD_MAX_AGE)
+
+    def firmware(self, target: str, release: str, build_info: dict) -> str:
+        """Path of the cached firmware hex of a build."""
+        url = build_info.get('url')
+        if not url:
+            raise LookupError(f'No firmware URL for target: {target} {release}')
+        if url.startswith('/'):
+            url = self.build_url + url
+        return self._fetch(ArtifactCache.key('hex', target, release), url, BUILD_MAX_AGE)
+
+    def cached_targets(self) -> list[str]:
+        """Targets with a cached release list, when the full target list was never fetched."""
+        targets = []
+        for key in self.cache.keys('releases/'):
+            data = self._cached(key)
+            if data is not None:
+                targets.append(data.get('target') or key.split('/', 1)[1])
+        return sorted(targets)
+
+    def search(self, query: str = '') -> list[str]:
+        try:
+            targets = self.targets()
+        except LookupError:
+            targets = self.cached_targets()
+        query = query.lower()
+        return [target for target in targets if query in target.lower()]
+
+    def _map(self, func, items: Iterable) -> list:
+        """``(item, result or exception)`` for every item, fetched in parallel."""
+        def call(item):
+            try:
+                return item, func(*item) if isinstance(item, tuple) else func(item)
+            except Exception as e:
+                return item, e
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            return list(pool.map(call, items))
+
+    def prefetch(self, targets: Iterable[str], all_releases: bool = False, firmware: bool = False) -> dict:
+        """Warm the index for ``targets``: release lists, build info of the latest stable release
+        or of every stable release, and optionally the firmware. Returns the errors by item."""
+        errors = {}
+        builds = []
+        for target, releases in self._map(self.stable, list(targets)):
+            if isinstance(releases, Exception):
+                errors[target] = releases
+            elif releases:
+                builds += [(target, release) for release in (releases if all_releases else releases[:1])]
+        infos = []
+        for item, info in self._map(self.build_info, builds):
+            if isinstance(info, Exception):
+                errors[item] = info
+            else:
+                infos.append((*item, info))
+        if firmware:
+            errors.update((item[:2], path) for item, path in self._map(self.firmware, infos) if isinstance(path, Exception))
+        return errors
@@ -0,0 +1,171 @@
+import struct
+import time
+from array import array
+from typing import Callable, NamedTuple, Optional
+
+from msp import MspCtr
+from msp_codes import MspCodes
+from msp_data import MspRec, MspRecType
+from msp_schema import compiled, parse_version
+
+MOTOR_TELEMETRY = struct.Struct('<IHBHHH') # rpm, invalid percent, temperature, voltage, current, consumption
+MOTOR_FIELDS = ('rpm', 'invalid', 'temperature', 'voltage', 'current', 'consumption')
+MAX_MOTORS = 8
+CAPACITY = 4096
+
+
+def motor_telemetry(payload: bytes) -> tuple:
+    """Per motor fields flattened, motors the board does not have are zero."""
+    count = min(payload[0], MAX_MOTORS) if payload else 0
+    values = [value for motor in MOTOR_TELEMETRY.iter_unpack(payload[1:1 + count * MOTOR_TELEMETRY.size]) for value in motor]
+    return (*values, *(0,) * ((MAX_MOTORS - count) * len(MOTOR_FIELDS)))
+
+
+class Channel(NamedTuple):
+    fields: tuple[str, ...]
+    decode: Callable[[bytes], tuple] # payload to one value per field, raw firmware units
+
+
+TELEMETRY_CODES = (
+    MspCodes.MSP_STATUS_EX,
+    MspCodes.MSP_RAW_IMU,
+    MspCodes.MSP_ATTITUDE,
+    MspCodes.MSP_ANALOG,
+    MspCodes.MSP_MOTOR_TELEMETRY,
+)
+MOTOR_CHANNEL = Channel(tuple(f'{name}_{motor}' for motor in range(MAX_MOTORS) for name in MOTOR_FIELDS), motor_telemetry)
+
+
+def channel(code: int, api_version: str) -> Channel:
+    """Sample layout of a code, the leading fixed size fields of its schema."""
+    if code == MspCodes.MSP_MOTOR_TELEMETRY:
+        return MOTOR_CHANNEL
+    schema = compiled(code, parse_version(api_version))
+    return Channel(schema.row_fields(), schema.row)
+
+
+class RingBuffer:
+    """Fixed size sample store, timestamps and rows of ``width`` doubles in preallocated arrays."""
+
+    def __init__(self, width: int, capacity: int = CAPACITY) -> None:
+        self.width = width
+        self.capacity = capacity
+        self.times = array('d', bytes(8 * capacity))
+        self.values = array('d', bytes(8 * capacity * width))
+        self.head = 0
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def append(self, timestamp: float, row: tuple) -> None:
+        idx = self.head
+        self.times[idx] = timestamp
+        self.values[idx * self.width:(idx + 1) * self.width] = array('d', row)
+        self.head = (idx + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def latest(self) -> Optional[tuple]:
+        if not self.count:
+            return None
+        idx = (self.head - 1) % self.capacity
+        return tuple(self.values[idx * self.width:(idx + 1) * self.width])
+
+    def column(self, index: int) -> array:
+        """One field of every stored sample, oldest first."""
+        start = (self.head - self.count) % self.capacity
+        column = self.values[index::self.width]
+        return column[start:] + column[:start] if self.count == self.capacity else column[start:start + self.count]
+
+    def timestamps(self) -> array:
+        start = (self.head - self.count) % self.capacity
+        return self.times[start:] + self.times[:start] if self.count == self.capacity else self.times[start:start + self.count]
+
+
+class ChannelStats(NamedTuple):
+    target_hz: float
+    achieved_hz: float
+    received: int
+    dropped: int
+
+
+class TelemetryPoller:
+    """Polls MSP codes at a rate per code, sample layouts follow the API version in ``msp.data``.
+
+    The requests due at the same tick go out in one write. A request still unanswered
+    when its code is due again is counted as dropped and replaced, so a slow link
+    lowers the achieved rate instead of queueing up stale requests.
+    """
+
+    def __init__(self, msp: MspCtr, rates: dict, capacity: int = CAPACITY) -> None:
+        self.msp = msp
+        self.rates = {MspCodes(code): hz for code, hz in rates.items()}
+        self.channels = {code: channel(code, msp.data.api_version) for code in self.rates}
+        self.buffers = {code: RingBuffer(len(self.channels[code].fields), capacity) for code in self.rates}
+        self.received = dict.fromkeys(self.rates, 0)
+        self.dropped = dict.fromkeys(self.rates, 0)
+        self.elapsed = 0.0
+        self._requests = {code: msp.encode(code) for code in self.rates}
+        self._pending = dict.fromkeys(self.rates, False)
+
+    def field(self, code: int, name: str) -> array:
+        return self.buffers[code].column(self.channels[code].fields.index(name))
+
+    def _receive(self, rec: MspRec, timestamp: float) -> None:
+        code = rec.code
+        if code not in self._pending or not self._pending[code]:
+            return
+        self._pending[code] = False
+        if rec.type != MspRecType.RESPONSE:
+            self.dropped[code] += 1
+            return
+        try:
+            row = self.channels[code].decode(rec.payload)
+        except struct.error:
+            self.dropped[code] += 1
+            return
+        self.buffers[code].append(timestamp, row)
+        self.received[code] += 1
+
+    def run(self, duration: float, on_tick: Optional[Callable[['TelemetryPoller'], None]] = None) -> dict:
+        port = self.msp.port
+        framer = self.msp.framer
+        started = time.monotonic()
+        end = started + duration
+        due = dict.fromkeys(self.rates, started)
+        port_timeout = port.timeout
+        try:
+            while True:
+                now = time.monotonic()
+                if now >= end:
+                    break
+                batch = bytearray()
+                for code, at in due.items():
+                    if at <= now:
+                        if self._pending[code]:
+                            self.dropped[code] += 1
+                        self._pending[code] = True
+                        batch += self._requests[code]
+                        # Keep the schedule on the grid, skipping ticks that were missed entirely
+                        period = 1 / self.rates[code]
+                        due[code] = at + period if at + period > now else now + period
+                if batch:
+                    port.write(batch)
+                    if on_tick:
+                        on_tick(self)
+
+                port.timeout = max(min(min(due.values()), end) - time.monotonic(), 0)
+                framer.feed(port.read(port.in_waiting or 1))
+                timestamp = time.monotonic() - started
+                while (frame := framer.next_frame()) is not None:
+                    self._receive(MspRec(frame), timestamp)
+        finally:
+            port.timeout = port_timeout
+
+        self.elapsed = time.monotonic() - started
+        return self.stats()
+
+    def stats(self) -> dict:
+        elapsed = max(self.elapsed, 1e-6)
+        return {code: ChannelStats(hz, self.received[code] / elapsed, self.received[code], self.dropped[code])
+                for code, hz in self.rates.items()}
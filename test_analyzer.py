@@ -0,0 +1,93 @@
+import contextlib
+import io
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+import analyzer
+from analyzer import ReplaySerial, analyze, format_report, load_raw, load_streams
+from capture import FC_TO_HOST, HOST_TO_FC, CaptureWriter
+from fake_serial import response_v1
+from msp import MspCodec, MspCtr
+from msp_codes import MspCodes
+
+MS = 1_000_000
+
+
+class TestAnalyzer(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'link.bfcap')
+        codec = MspCodec()
+        with CaptureWriter(self.path) as capture:
+            for i in range(10):
+                t = i * 10 * MS
+                capture.write(HOST_TO_FC, codec.encode(MspCodes.MSP_STATUS_EX) + codec.encode(MspCodes.MSP_ATTITUDE), t)
+                status = response_v1(MspCodes.MSP_STATUS_EX, bytes(22))
+                # Split one response across two chunks, its time is the time of the last byte
+                capture.write(FC_TO_HOST, status[:5], t + 1 * MS)
+                capture.write(FC_TO_HOST, status[5:], t + 2 * MS)
+                attitude = bytearray(response_v1(MspCodes.MSP_ATTITUDE, bytes(6)))
+                if i == 9:
+                    attitude[-1] ^= 0xFF
+                capture.write(FC_TO_HOST, bytes(attitude) + b'\x00noise', t + 3 * MS)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_analyze(self):
+        _, streams = load_streams(self.path)
+        report = analyze(streams)
+        self.assertAlmostEqual(report.duration, 0.093)
+        self.assertEqual(report.frames, (20, 19))
+        self.assertEqual(report.checksum_errors, (0, 1))
+        self.assertEqual(report.counts[(HOST_TO_FC, MspCodes.MSP_STATUS_EX)], 10)
+        self.assertEqual(report.counts[(FC_TO_HOST, MspCodes.MSP_ATTITUDE)], 9)
+        self.assertEqual(report.latencies[MspCodes.MSP_STATUS_EX], [2 * MS] * 10)
+        self.assertEqual(report.latencies[MspCodes.MSP_ATTITUDE], [3 * MS] * 9)
+        self.assertEqual(report.unanswered, {MspCodes.MSP_ATTITUDE: 1})
+        text = format_report(report)
+        self.assertIn('MSP_STATUS_EX', text)
+        self.assertIn('MSP_ATTITUDE x1', text)
+
+    def test_raw_dumps(self):
+        _, streams = load_streams(self.path)
+        paths = []
+        for name, stream in zip(('src2dst.dat', 'dst2src.dat'), streams):
+            paths.append(os.path.join(self.tmp.name, name))
+            with open(paths[-1], 'wb') as f:
+                f.write(stream.data)
+        _, raw = load_raw(*paths)
+        report = analyze(raw)
+        self.assertEqual(report.frames, (20, 19))
+        self.assertEqual(len(report.latencies[MspCodes.MSP_STATUS_EX]), 10)
+
+    def test_too_many_files(self):
+        output = io.StringIO()
+        with mock.patch('sys.argv', ['analyzer.py', self.path, self.path, self.path]), \
+             contextlib.redirect_stderr(output), self.assertRaises(SystemExit):
+            analyzer.main()
+        self.assertIn('expected one capture file or the two raw dump files', output.getvalue())
+
+    def test_replay(self):
+        _, streams = load_streams(self.path)
+        msp = MspCtr(ReplaySerial(streams[FC_TO_HOST]), timeout=1)
+        codes = [msp.read_rec().code for _ in range(19)]
+        self.assertEqual(codes[:2], [MspCodes.MSP_STATUS_EX, MspCodes.MSP_ATTITUDE])
+        with self.assertRaises(TimeoutError):
+            msp.read(timeout=0.01)
+
+    def test_replay_realtime(self):
+        _, streams = load_streams(self.path)
+        port = ReplaySerial(streams[FC_TO_HOST], realtime=True)
+        port.timeout = 1
+        started = time.monotonic()
+        data = b''
+        while len(data) < len(streams[FC_TO_HOST].data):
+            data += port.read(4096)
+        self.assertEqual(data, streams[FC_TO_HOST].data)
+        self.assertGreater(time.monotonic() - started, 0.09)
+
+if __name__ == '__main__':
+    unittest.main()
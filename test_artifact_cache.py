@@ -0,0 +1,107 @@
+import os
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from artifact_cache import ArtifactCache
+
+FILES = {
+    '/builds/4.5.1/STM32F405': b'{"url": "/builds/abc/hex"}',
+    '/builds/abc/hex': b':00000001FF\n' * 100,
+}
+
+
+class Handler(BaseHTTPRequestHandler):
+    hits = []
+
+    def do_GET(self):
+        Handler.hits.append(self.path)
+        etag = f'"{hash(FILES[self.path])}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = FILES[self.path]
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestArtifactCache(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        cls.url = f'http://127.0.0.1:{cls.server.server_address[1]}'
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        Handler.hits.clear()
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_fetch_and_revalidate(self):
+        cache = ArtifactCache(self.tmp.name)
+        key = ArtifactCache.key('build', 'STM32F405', '4.5.1')
+        path = cache.fetch(key, self.url + '/builds/4.5.1/STM32F405')
+        self.assertEqual(open(path, 'rb').read(), FILES['/builds/4.5.1/STM32F405'])
+        self.assertEqual(cache.fetch(key, self.url + '/builds/4.5.1/STM32F405'), path)
+        self.assertEqual(len(Handler.hits), 1)
+
+        # Expired entry is revalidated with the ETag and answered with 304
+        cache = ArtifactCache(self.tmp.name)
+        self.assertEqual(cache.fetch(key, self.url + '/builds/4.5.1/STM32F405', max_age=0), path)
+        self.assertEqual(len(Handler.hits), 2)
+        self.assertFalse([f for f in os.listdir(self.tmp.name) if f.startswith('.tmp_')])
+
+    def test_offline_fallback(self):
+        cache = ArtifactCache(self.tmp.name)
+        key = ArtifactCache.key('hex', 'STM32F405', '4.5.1')
+        path = cache.fetch(key, self.url + '/builds/abc/hex')
+        self.assertEqual(cache.fetch(key, 'http://127.0.0.1:1/builds/abc/hex', max_age=0), path)
+
+    def test_lru_eviction(self):
+        cache = ArtifactCache(self.tmp.name, max_size=250)
+        cache.put('a', b'a' * 100)
+        cache.put('b', b'b' * 100)
+        cache.get('a')
+        cache.put('c', b'c' * 100)
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('c'))
+        self.assertEqual(len(os.listdir(os.path.join(self.tmp.name, ArtifactCache.OBJECTS))), 2)
+
+    def test_larger_than_max_size(self):
+        cache = ArtifactCache(self.tmp.name, max_size=250)
+        cache.put('a', b'a' * 100)
+        path = cache.put('big', b'b' * 300)
+        self.assertTrue(os.path.isfile(path))
+        self.assertEqual(cache.get('big'), b'b' * 300)
+        self.assertIsNone(cache.get('a'))
+
+    def test_hits_do_not_rewrite_index(self):
+        cache = ArtifactCache(self.tmp.name)
+        cache.put('a', b'a')
+        index = os.path.join(self.tmp.name, ArtifactCache.INDEX)
+        saved = os.stat(index).st_mtime_ns
+        atime = cache.entry('a')['atime']
+        for _ in range(10):
+            cache.get_path('a')
+        self.assertEqual(os.stat(index).st_mtime_ns, saved)
+        cache.flush()
+        self.assertGreater(ArtifactCache(self.tmp.name).entry('a')['atime'], atime)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from batch import Board, Job, load_batch, match_boards, run_batch
+
+MANIFEST = '''
+[defaults]
+target = "STM32F405"
+release = "4.5.1"
+config = "quad.txt"
+
+[[board]]
+serial = "A1"
+
+[[board]]
+location = "1-2.3"
+hex = "custom.hex"
+cfg_diff = true
+'''
+
+
+class Status:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.phases = []
+
+    def update(self, board: str, phase: str, error: str = '') -> None:
+        with self.lock:
+            self.phases.append((board, phase, error))
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        for name in ('quad.txt', 'custom.hex'):
+            open(os.path.join(self.tmp.name, name), 'w').close()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, name: str, text: str) -> str:
+        path = os.path.join(self.tmp.name, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        return path
+
+    def test_load(self):
+        jobs = load_batch(self.write('batch.toml', MANIFEST))
+        self.assertEqual(jobs[0], Job(serial='A1', target='STM32F405', release='4.5.1',
+                                      config=os.path.join(self.tmp.name, 'quad.txt')))
+        self.assertEqual(jobs[1].hex, os.path.join(self.tmp.name, 'custom.hex'))
+        self.assertTrue(jobs[1].cfg_diff)
+        self.assertEqual(jobs[1].name, 'usb 1-2.3')
+
+        manifest = {'boards': [{'serial': 'A1', 'config': 'quad.txt'}]}
+        self.assertEqual(load_batch(self.write('batch.json', json.dumps(manifest)))[0].firmware, None)
+
+    def test_invalid(self):
+        for boards in ([{'config': 'quad.txt'}], [{'serial': 'A1'}], [{'serial': 'A1', 'target': 'STM32F405'}],
+                       [{'serial': 'A1', 'config': 'missing.txt'}], [{'serial': 'A1', 'config': 'quad.txt', 'baud': 1}],
+                       [{'serial': 'A1', 'config': 'quad.txt'}] * 2, []):
+            with self.assertRaises(ValueError, msg=boards):
+                load_batch(self.write('batch.json', json.dumps({'boards': boards})))
+
+    def test_match(self):
+        jobs = [Job(serial='A1', config='c'), Job(location='1-2.3', config='c'), Job(serial='C3', config='c')]
+        boards = [Board('B2', '/dev/ttyACM1', '1-2.3:1.0'), Board('A1', None, '1-4')]
+        pairs, missing = match_boards(jobs, boards)
+        self.assertEqual([(job.serial, board.port) for job, board in pairs], [('A1', None), ('B2', '/dev/ttyACM1')])
+        self.assertEqual(missing, [jobs[2]])
+
+    def test_run(self):
+        fetched = []
+        started = {}
+        attempts = {}
+
+        def fetch(job):
+            fetched.append(job.firmware)
+            if job.hex:
+                return job.hex, {}
+            time.sleep(0.2)
+            return f'{job.target}_{job.release}.hex', {'configuration': []}
+
+        def run_job(job, board, hex_file, build_info):
+            started.setdefault(job.serial, time.monotonic())
+            attempts[job.serial] = attempts.get(job.serial, 0) + 1
+            if job.serial == 'B' and attempts['B'] < 2:
+                raise RuntimeError('DFU device not found')
+            if job.serial == 'C':
+                raise RuntimeError('Flash failed')
+
+        jobs = [Job(serial=sn, target='STM32F405', release='4.5.1') for sn in 'ABC'] + [Job(serial='D', hex='d.hex')]
+        status = Status()
+        begin = time.monotonic()
+        failed = run_batch([(job, Board(job.serial, None, None)) for job in jobs], fetch, run_job, status,
+                           retries=1, retry_delay=0, refresh=lambda sn: Board(sn, '/dev/ttyACM0', None))
+        self.assertEqual(failed, 1)
+        self.assertCountEqual(fetched, [(None, 'STM32F405', '4.5.1'), ('d.hex', None, None)])
+        self.assertEqual(attempts, {'A': 1, 'B': 2, 'C': 2, 'D': 1})
+        # The board with its own hex does not wait for the download of the others
+        self.assertLess(started['D'] - begin, started['A'] - begin)
+        self.assertIn(('C', 'FAILED', 'Flash failed'), status.phases)
+        self.assertIn(('B', 'retry 1', 'DFU device not found'), status.phases)
+
+    def test_interrupt(self):
+        def run_job(job, board, hex_file, build_info):
+            raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            run_batch([(Job(serial='A', hex='a.hex'), Board('A', None, None))], lambda job: (job.hex, {}), run_job,
+                      Status(), retry_delay=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+import bf_flash
+from batch import Board
+from fc_sim import open_sim
+from firmware import FirmwareImage
+from test_firmware import make_hex
+
+CONFIG = 'set small_angle = 60\nfeature GPS\n'
+GET_ITERM_RELAX = os.path.join(os.path.dirname(__file__), 'test_data', 'get_iterm_relax.txt')
+restore_config = bf_flash.restore_config
+
+
+class TestFlashAll(unittest.TestCase):
+    def setUp(self):
+        self.ports = []
+        self.sims = {}
+        for serial_number in ('A1', 'B2', 'C3'):
+            sim, path = open_sim()
+            self.addCleanup(sim.close)
+            self.sims[path] = sim
+            self.ports.append(SimpleNamespace(serial_number=serial_number, device=path))
+        fd, self.cfg = tempfile.mkstemp(suffix='.txt')
+        with os.fdopen(fd, 'w') as f:
+            f.write(CONFIG)
+        self.addCleanup(os.remove, self.cfg)
+
+    def flash_all(self, ports: list, restore=restore_config) -> tuple[int, str]:
+        output = io.StringIO()
+        with mock.patch.object(bf_flash, 'vcp_ports', return_value=ports), \
+             mock.patch.object(bf_flash, 'dfu_devices', return_value=[]), \
+             mock.patch.object(bf_flash, 'restore_config', restore), \
+             contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+            failed = bf_flash.flash_all(None, None, self.cfg, jobs=None)
+        return failed, output.getvalue()
+
+    def test_restore_every_board(self):
+        bad = self.ports[2].device
+
+        def restore(port, cfg, diff):
+            if port == bad:
+                raise RuntimeError('CLI prompt not received')
+            restore_config(port, cfg, diff)
+
+        failed, output = self.flash_all(self.ports, restore)
+        self.assertEqual(failed, 1)
+        self.assertIn('Summary: 2 done, 1 failed', output)
+        for port in self.ports[:2]:
+            sim = self.sims[port.device]
+            self.assertEqual((sim.settings['small_angle'], sim.saved), ('60', 1))
+        self.assertEqual(self.sims[bad].saved, 0)
+
+    def test_interrupt(self):
+        def restore(port, cfg, diff):
+            raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            self.flash_all(self.ports[:1], restore)
+
+    def test_duplicate_serial(self):
+        self.ports[1].serial_number = 'A1'
+        failed, output = self.flash_all(self.ports)
+        self.assertEqual(failed, 1)
+        self.assertIn('Summary: 1 done, 1 failed', output)
+        self.assertIn('reported by 2 boards', output)
+        # Neither board sharing the serial is touched
+        self.assertEqual([self.sims[port.device].saved for port in self.ports], [0, 0, 1])
+
+
+class TestFlashBatch(unittest.TestCase):
+    def setUp(self):
+        self.sim, self.port = open_sim()
+        self.addCleanup(self.sim.close)
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        with open(os.path.join(self.dir.name, 'quad.txt'), 'w') as f:
+            f.write(CONFIG)
+        self.manifest = os.path.join(self.dir.name, 'batch.json')
+        with open(self.manifest, 'w') as f:
+            json.dump({'boards': [{'serial': 'A1', 'config': 'quad.txt'}]}, f)
+
+    def test_retry(self):
+        # The port is gone on the first attempt, wait_port gives up and the board is found again
+        gone = os.path.join(self.dir.name, 'ttyACM9')
+        boards = [[Board('A1', gone, None)], [Board('A1', self.port, None)]]
+        output = io.StringIO()
+        with mock.patch.object(bf_flash, 'attached_boards', side_effect=boards), \
+             mock.patch.object(bf_flash.hotplug, 'wait_for', return_value=None), \
+             contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+            failed = bf_flash.flash_batch(self.manifest, jobs=None, retries=1)
+        self.assertEqual(failed, 0)
+        self.assertIn('retry 1', output.getvalue())
+        self.assertIn(f'COM port not found: {gone}', output.getvalue())
+        self.assertIn('Summary: 1 done, 0 failed', output.getvalue())
+        self.assertEqual((self.sim.settings['small_angle'], self.sim.saved), ('60', 1))
+
+
+class TestFlashManifest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.image = os.path.join(self.dir.name, f'firmware{bf_flash.IMAGE_EXT}')
+        FirmwareImage.from_hex_text(make_hex(64 * 1024, (0, 0))).save(self.image)
+        for name, value in (('cache_dir', self.dir.name), ('usb_serial', 'A1')):
+            patcher = mock.patch.object(bf_flash, name, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        bf_flash.save_manifest('A1', {0: 'old'})
+
+    def flash(self, flash_device) -> bool:
+        with mock.patch.object(bf_flash, 'flash_device', flash_device), \
+             contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            return bf_flash.flash(self.image, {}, device=object(), progress=None, diff='manifest')
+
+    def test_failed_flash_clears_manifest(self):
+        def flash_device(device, data, address, progress, diff, manifest):
+            self.assertEqual(manifest, {0: 'old'})
+            self.assertIsNone(bf_flash.load_manifest('A1'))
+            raise RuntimeError('device disconnected')
+
+        self.assertFalse(self.flash(flash_device))
+        self.assertIsNone(bf_flash.load_manifest('A1'))
+
+    def test_saved_after_flash(self):
+        self.assertTrue(self.flash(lambda *args, **kwargs: {0: 'new'}))
+        self.assertEqual(bf_flash.load_manifest('A1'), {0: 'new'})
+
+
+class TestDefaultValue(unittest.TestCase):
+    def test_get_matches_substrings(self):
+        # get iterm_relax of the 4.6 SITL lists iterm_relax_type and the changed iterm_relax_cutoff too
+        with open(GET_ITERM_RELAX, encoding='ascii') as f:
+            output = f.read()
+        self.assertIsNone(bf_flash.default_value(output, 'iterm_relax'))
+        self.assertEqual(bf_flash.default_value(output, 'iterm_relax_cutoff'), '15')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import os
+import random
+import struct
+import tempfile
+import unittest
+import serial
+import blackbox
+import huffman
+from fake_serial import FakeSerial, response_v1
+from fc_sim import dataflash_reply
+from msp import MspCtr, MspFramer
+from msp_codes import MspCodes
+
+
+def response_jumbo(code: int, payload: bytes) -> bytes:
+    frame = MspCtr(None).encode_v1(code, *payload)
+    return frame[:2] + b'>' + frame[3:]
+
+
+class FakeDataflash(FakeSerial):
+    """Dataflash behind MSP, replies are cut at ``max_read`` like the firmware buffer does."""
+    def __init__(self, content: bytes, max_read: int = 4096, drop_after: int = 0, huffman: bool = False) -> None:
+        super().__init__(chunk=65536)
+        self.content = content
+        self.max_read = max_read
+        self.huffman = huffman
+        self.drop_after = drop_after
+        self.reads = 0
+        self.erased = False
+
+    def write(self, data: bytes) -> int:
+        framer = MspFramer()
+        framer.feed(data)
+        while (frame := framer.next_frame()) is not None:
+            code, payload = frame[4], frame[5:-1]
+            if code == MspCodes.MSP_DATAFLASH_SUMMARY:
+                summary = struct.pack('<BIII', 3, 64, 1 << 20, 0 if self.erased else len(self.content))
+                self.data += response_v1(code, summary)
+            elif code == MspCodes.MSP_DATAFLASH_ERASE:
+                self.erased = True
+                self.data += response_v1(code, b'')
+            elif code == MspCodes.MSP_DATAFLASH_READ:
+                self.reads += 1
+                if self.drop_after and self.reads > self.drop_after:
+                    raise serial.SerialException('device disconnected')
+                address, size, compress = struct.unpack('<IHB', payload)
+                reply = dataflash_reply(self.content, address, min(size, self.max_read), compress and self.huffman)
+                self.data += response_jumbo(code, reply)
+        return super().write(data)
+
+
+class TestBlackbox(unittest.TestCase):
+    def setUp(self):
+        self.content = random.Random(1).randbytes(300_000)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'log.bbl')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def read_file(self) -> bytes:
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def test_download(self):
+        progress = []
+        size = blackbox.download_file(lambda: MspCtr(FakeDataflash(self.content), timeout=1), self.path,
+                                      lambda done, total, rate: progress.append((done, total)))
+        self.assertEqual(size, len(self.content))
+        self.assertEqual(self.read_file(), self.content)
+        self.assertEqual(progress[-1], (len(self.content), len(self.content)))
+
+    def test_short_replies(self):
+        fc = FakeDataflash(self.content, max_read=1000)
+        blackbox.download_file(lambda: MspCtr(fc, timeout=1), self.path)
+        self.assertEqual(self.read_file(), self.content)
+
+    def test_resume_after_disconnect(self):
+        connections = []
+        def connect():
+            # The first connection drops in the middle of a batch
+            connections.append(FakeDataflash(self.content, drop_after=40 if not connections else 0))
+            return MspCtr(connections[-1], timeout=1)
+        blackbox.download_file(connect, self.path)
+        self.assertEqual(len(connections), 2)
+        self.assertEqual(self.read_file(), self.content)
+
+    def test_resume_file(self):
+        with open(self.path, 'wb') as f:
+            f.write(self.content[:123_456])
+        fc = FakeDataflash(self.content)
+        blackbox.download_file(lambda: MspCtr(fc, timeout=1), self.path)
+        self.assertEqual(self.read_file(), self.content)
+        self.assertLess(fc.reads, 50)
+
+    def test_resume_other_log(self):
+        with open(self.path, 'wb') as f:
+            f.write(bytes(5000))
+        with self.assertRaises(RuntimeError):
+            blackbox.download_file(lambda: MspCtr(FakeDataflash(self.content), timeout=1), self.path)
+
+    def test_huffman(self):
+        # Logs are mostly small deltas, the firmware code is shortest for small byte values
+        rnd = random.Random(2)
+        content = bytes(min(int(rnd.expovariate(0.3)), 255) for _ in range(200_000))
+        fc = FakeDataflash(content, huffman=True)
+        blackbox.download_file(lambda: MspCtr(fc, timeout=1), self.path)
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), content)
+        self.assertLess(fc.reads, len(content) // blackbox.READ_SIZE)
+
+        # A compressed reply covers more than asked for, nothing past the end is returned
+        chunks = blackbox.read_chunks(MspCtr(FakeDataflash(content, huffman=True), timeout=1), 1000, 3000)
+        self.assertEqual(b''.join(chunks), content[1000:3000])
+
+    def test_erase(self):
+        fc = FakeDataflash(self.content)
+        msp = MspCtr(fc, timeout=1)
+        blackbox.erase(msp)
+        self.assertEqual(blackbox.read_summary(msp).used_size, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import os
+import select
+import threading
+import time
+import tty
+import unittest
+import serial
+from cli import CliSession
+
+
+class CliSim(threading.Thread):
+    """Betaflight like CLI on the master side of a pty: echo, prompt, set, diff and save."""
+
+    def __init__(self, fd: int) -> None:
+        super().__init__(daemon=True)
+        self.fd = fd
+        self.settings = {f'setting_{i}': '0' for i in range(1000)}
+        self.saved = False
+        self.stopped = False
+        self.pause = 0.0 # inside the diff output, right after a '# '
+
+    def stop(self) -> None:
+        self.stopped = True
+        self.join()
+
+    def write(self, text: str) -> None:
+        os.write(self.fd, text.encode('ascii'))
+
+    def execute(self, line: str) -> str:
+        if line.startswith('set '):
+            name, _, value = line[4:].partition('=')
+            name, value = name.strip(), value.strip()
+            if name not in self.settings:
+                return f'###ERROR IN set: INVALID NAME: {name}###'
+            self.settings[name] = value
+            return f'{name} set to {value}'
+        if line == 'diff':
+            changed = [f'set {k} = {v}' for k, v in self.settings.items() if v != '0']
+            self.write('# diff\r\n\r\n# ')
+            time.sleep(self.pause)
+            return '\r\n'.join(['master', *changed])
+        if line.startswith('#'):
+            return ''
+        return f'###ERROR IN {line.split()[0]}: UNKNOWN COMMAND###'
+
+    def run(self) -> None:
+        in_cli = False
+        buf = ''
+        while not self.stopped:
+            if not select.select([self.fd], [], [], 0.01)[0]:
+                continue
+            for c in os.read(self.fd, 1024).decode('ascii'):
+                if not in_cli:
+                    if c == '#':
+                        in_cli = True
+                        self.write("\r\nEntering CLI Mode, type 'exit' to return, or 'help'\r\n\r\n# ")
+                elif c in '\r\n' and buf:
+                    self.write('\r\n')
+                    if buf == 'save':
+                        self.saved = True
+                        self.write('# saving\r\nRebooting')
+                        in_cli = False
+                    else:
+                        output = self.execute(buf)
+                        self.write(f'{output}\r\n# ' if output else '# ')
+                    buf = ''
+                elif 32 <= ord(c) <= 126:
+                    buf += c
+                    self.write(c)
+
+
+class TestCliSession(unittest.TestCase):
+    def setUp(self):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.master)
+        self.sim = CliSim(self.master)
+        self.sim.start()
+        self.cli = CliSession(serial.Serial(os.ttyname(self.slave), 115200), timeout=2)
+
+    def tearDown(self):
+        self.cli.close()
+        self.sim.stop()
+        os.close(self.master)
+        os.close(self.slave)
+
+    def test_restore(self):
+        lines = [f'set setting_{i} = {i}' for i in range(500)]
+        lines.insert(100, 'set no_such_setting = 1')
+        self.cli.enter()
+        results = self.cli.run(lines)
+
+        self.assertEqual(len(results), len(lines))
+        self.assertEqual([(r.line, r.error) for r in results if r.error],
+                         [('set no_such_setting = 1', '###ERROR IN set: INVALID NAME: no_such_setting###')])
+        self.assertEqual(results[0].output, 'setting_0 set to 0')
+        self.assertEqual(self.sim.settings['setting_499'], '499')
+        self.assertIsNone(self.cli.save())
+        self.assertTrue(self.sim.saved)
+
+    def test_comment_lines_are_not_prompts(self):
+        self.cli.enter()
+        self.cli.run(['set setting_1 = 5', 'set setting_2 = 7'])
+        result = self.cli.command('diff')
+        self.assertEqual(result.output, '# diff\r\n\r\n# master\r\nset setting_1 = 5\r\nset setting_2 = 7')
+        self.assertEqual(self.cli.command('set setting_3 = 1').output, 'setting_3 set to 1')
+
+    def test_pause_after_comment(self):
+        self.cli.enter()
+        self.cli.command('set setting_1 = 5')
+        self.sim.pause = 0.2
+        result = self.cli.command('diff')
+        self.assertEqual(result.output, '# diff\r\n\r\n# master\r\nset setting_1 = 5')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import unittest
+from cli_config import MASTER, BetaflightConfig
+
+DIFF_ALL = os.path.join(os.path.dirname(__file__), 'test_data', 'diff_all.txt')
+
+def load() -> BetaflightConfig:
+    with open(DIFF_ALL, encoding='ascii') as f:
+        return BetaflightConfig.parse(f)
+
+
+class TestBetaflightConfig(unittest.TestCase):
+    def test_parse(self):
+        # diff all of the Betaflight 4.6 SITL build
+        config = load()
+        entries = config.entries
+        self.assertEqual(entries[(MASTER, 'set', 'motor_pwm_protocol')], 'set motor_pwm_protocol = DSHOT600')
+        self.assertEqual(entries[(('profile', 0), 'set', 'p_pitch')], 'set p_pitch = 50')
+        self.assertEqual(entries[(('profile', 1), 'set', 'p_pitch')], 'set p_pitch = 60')
+        self.assertEqual(entries[(('rateprofile', 0), 'set', 'roll_srate')], 'set roll_srate = 70')
+        self.assertEqual(entries[(MASTER, 'feature', 'GPS')], 'feature -GPS')
+        self.assertEqual(entries[(MASTER, 'serial', 'UART2')], 'serial UART2 64 115200 57600 0 115200')
+        self.assertEqual(entries[(MASTER, 'aux', '2')], 'aux 2 13 2 1700 2100 0 0')
+        self.assertNotIn((MASTER, 'mcu_id', ''), entries)
+        self.assertEqual(config.selected, {'profile': 0, 'rateprofile': 0})
+        self.assertEqual(len(entries), 22)
+
+    def test_board_lines(self):
+        # Hardware lines of a flight controller dump, the SITL build has no resources or vtx table
+        entries = BetaflightConfig.parse([
+            'board_name MATEKF405', 'resource MOTOR 5 A09', 'timer A09 AF1', 'dma ADC 1 1',
+            'vtxtable band 2 BOSCAM_B B FACTORY 5733 5752 5771 5790 5809 5828 5847 5866',
+            'vtxtable powervalues 14 20 26 30', 'set name = QUAD-07',
+        ]).entries
+        self.assertEqual(entries[(MASTER, 'resource', 'MOTOR 5')], 'resource MOTOR 5 A09')
+        self.assertIn((MASTER, 'board_name', ''), entries)
+        self.assertIn((MASTER, 'timer', 'A09'), entries)
+        self.assertIn((MASTER, 'dma', 'ADC 1'), entries)
+        self.assertIn((MASTER, 'vtxtable', 'band 2'), entries)
+        self.assertIn((MASTER, 'vtxtable', 'powervalues'), entries)
+
+    def test_identical(self):
+        changed, extra = load().diff(load())
+        self.assertEqual((changed, extra), ([], []))
+
+    def test_diff(self):
+        backup = load()
+        with open(DIFF_ALL, encoding='ascii') as f:
+            text = f.read()
+        text = text.replace('set p_pitch = 60', 'set p_pitch = 65')
+        text = text.replace('feature -GPS', 'feature GPS')
+        text = text.replace('set motor_pwm_protocol = DSHOT600', 'set motor_pwm_protocol = dshot600')
+        text = text.replace('aux 2 13 2 1700 2100 0 0\n', '')
+        text = text.replace('set small_angle = 180', 'set small_angle = 180\nset yaw_motors_reversed = ON')
+        current = BetaflightConfig.parse_text(text)
+
+        changed, extra = backup.diff(current)
+        self.assertEqual(extra, [(MASTER, 'set', 'yaw_motors_reversed')])
+        self.assertEqual(backup.restore_lines(changed, current.selected), [
+            'feature -GPS',
+            'aux 2 13 2 1700 2100 0 0',
+            'profile 1',
+            'set p_pitch = 60',
+            'profile 0',
+            'rateprofile 0',
+        ])
+
+    def test_text_setting_case(self):
+        backup = BetaflightConfig.parse(['set craft_name = Quad', 'set pilot_name = bob', 'set gyro_lpf1_type = PT1'])
+        current = BetaflightConfig.parse(['set craft_name = QUAD', 'set pilot_name = bob', 'set gyro_lpf1_type = pt1'])
+        changed, _ = backup.diff(current)
+        self.assertEqual([line for _, line in changed], ['set craft_name = Quad'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+import random
+import struct
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+from pyfu_usb import descriptor
+from pyfu_usb.descriptor import DfuSeMemoryLayout
+import dfu_flash
+
+LAYOUT = [
+    DfuSeMemoryLayout(addr=0x08000000, last_addr=0x0800FFFF, size=0x10000, num_pages=4, page_size=0x4000),
+    DfuSeMemoryLayout(addr=0x08010000, last_addr=0x0801FFFF, size=0x10000, num_pages=1, page_size=0x10000),
+]
+
+
+class FakeDfuDevice:
+    """Emulates a DfuSe flash with the layout above and records every command."""
+    BASE = 0x08000000
+
+    def __init__(self, transfer_size: int = 2048) -> None:
+        self.transfer_size = transfer_size
+        self.requests = []
+        self.flash = bytearray(b'\xff') * 0x20000
+        self.address = None
+
+    def ctrl_transfer(self, request_type, request, value, index, data=None, timeout=None):
+        if request == dfu_flash.DFU_GETSTATUS:
+            return bytes((0, 0, 0, 0, dfu_flash.DFU_STATE_DNLOAD_IDLE, 0))
+        if request == dfu_flash.DFU_UPLOAD:
+            offset = self.address - self.BASE + (value - dfu_flash.DFUSE_FIRST_BLOCK) * self.transfer_size
+            self.requests.append(('read', offset + self.BASE, data))
+            return bytes(self.flash[offset:offset + data])
+        if request == dfu_flash.DFU_DNLOAD:
+            data = bytes(data) if data is not None else b''
+            if value == 0 and data:
+                command, address = struct.unpack('<BI', data)
+                self.requests.append((command, address))
+                if command == dfu_flash.DFUSE_SET_ADDRESS:
+                    self.address = address
+                elif command == dfu_flash.DFUSE_ERASE:
+                    page = next(p for p in dfu_flash.erase_pages(LAYOUT, address, 1))
+                    size = 0x4000 if page < 0x08010000 else 0x10000
+                    self.flash[page - self.BASE:page - self.BASE + size] = b'\xff' * size
+            elif value >= dfu_flash.DFUSE_FIRST_BLOCK:
+                address = self.address + (value - dfu_flash.DFUSE_FIRST_BLOCK) * self.transfer_size
+                self.requests.append(('write', address, len(data)))
+                self.flash[address - self.BASE:address - self.BASE + len(data)] = data
+            else:
+                self.requests.append(('leave',))
+        return None
+
+
+class FakePlainDfuDevice:
+    """Plain DFU 1.1 bootloader, writes the blocks in order to its own application start."""
+
+    def __init__(self) -> None:
+        self.requests = []
+        self.flash = bytearray()
+
+    def ctrl_transfer(self, request_type, request, value, index, data=None, timeout=None):
+        if request == dfu_flash.DFU_GETSTATUS:
+            return bytes((0, 0, 0, 0, dfu_flash.DFU_STATE_DNLOAD_IDLE, 0))
+        if request == dfu_flash.DFU_DNLOAD:
+            data = bytes(data) if data is not None else b''
+            self.requests.append((value, len(data)))
+            self.flash += data
+        return None
+
+
+class TestDfuFlash(unittest.TestCase):
+    def test_chunk_sequence(self):
+        data = bytes(range(256)) * 20 # 5 KB, 3 blocks of 2 KB
+        device = FakeDfuDevice()
+        reports = []
+        dfu_flash.download(device, 0, data, 0x08000000, 2048, LAYOUT, lambda done, total, rate: reports.append(done))
+        self.assertEqual(device.requests, [
+            (dfu_flash.DFUSE_ERASE, 0x08000000),
+            (dfu_flash.DFUSE_SET_ADDRESS, 0x08000000),
+            ('write', 0x08000000, 2048),
+            ('write', 0x08000800, 2048),
+            ('write', 0x08001000, 1024),
+            (dfu_flash.DFUSE_SET_ADDRESS, 0x08000000),
+            ('leave',),
+        ])
+        self.assertEqual(device.flash[:len(data)], data)
+        self.assertEqual(reports, [2048, 4096, 5120])
+
+    def test_diff(self):
+        rnd = random.Random(1)
+        old = bytearray(rnd.randbytes(0x14000))
+        old[0x8000:0xC000] = b'\xff' * 0x4000 # blank config page
+        device = FakeDfuDevice()
+        dfu_flash.download(device, 0, old, 0x08000000, 2048, LAYOUT)
+        manifest = dfu_flash.page_hashes(LAYOUT, old, 0x08000000)
+
+        new = bytearray(old)
+        new[0x4100] ^= 0xFF
+        new[0x12000] ^= 0xFF
+        self.assertEqual(dfu_flash.diff_readback(device, 0, new, 0x08000000, 2048, LAYOUT), [0x08004000, 0x08010000])
+        self.assertEqual(dfu_flash.diff_manifest(LAYOUT, new, 0x08000000, manifest), [0x08004000, 0x08008000, 0x08010000])
+
+        device.requests.clear()
+        dfu_flash.download(device, 0, new, 0x08000000, 2048, LAYOUT, pages=[0x08004000, 0x08010000], verify=True)
+        self.assertEqual(device.flash[:len(new)], new)
+        self.assertEqual([r[0] for r in device.requests if r[0] in (dfu_flash.DFUSE_ERASE, 'write')],
+                         [dfu_flash.DFUSE_ERASE] * 2 + ['write'] * 16)
+
+    def flash_device(self, device, version: int, diff=None) -> dict:
+        dfu_desc = SimpleNamespace(bcdDFUVersion=version, wTransferSize=2048)
+        with mock.patch('usb.util.claim_interface'), mock.patch('usb.util.dispose_resources'), \
+             mock.patch.object(descriptor, 'get_dfu_descriptor', return_value=dfu_desc), \
+             mock.patch.object(descriptor, 'get_memory_layout', return_value=LAYOUT), \
+             mock.patch('builtins.print'):
+            return dfu_flash.flash_device(device, bytes(range(256)) * 20, 0x08000000, diff=diff)
+
+    def test_plain_dfu(self):
+        data = bytes(range(256)) * 20
+        device = FakePlainDfuDevice()
+        self.assertEqual(self.flash_device(device, 0x0110, diff='readback'), {})
+        # No DfuSe address or erase commands, block numbers count from 0 and an empty block ends it
+        self.assertEqual(device.requests, [(0, 2048), (1, 2048), (2, 1024), (0, 0)])
+        self.assertEqual(device.flash, data)
+
+        device = FakeDfuDevice()
+        self.assertEqual(list(self.flash_device(device, dfu_flash.DFUSE_VERSION)), [0x08000000])
+        self.assertEqual(device.flash[:len(data)], data)
+
+    def test_erase_pages(self):
+        self.assertEqual(dfu_flash.erase_pages(LAYOUT, 0x08003FFF, 2), [0x08000000, 0x08004000])
+        self.assertEqual(dfu_flash.erase_pages(LAYOUT, 0x0800C000, 0x8000), [0x0800C000, 0x08010000])
+
+if __name__ == '__main__':
+    unittest.main()
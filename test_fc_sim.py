@@ -0,0 +1,125 @@
+import os
+import random
+import tempfile
+import time
+import unittest
+import serial
+import blackbox
+import dfu_flash
+from cli import CliSession
+from fc_sim import SimulatedDfuDevice, open_sim
+from msp import MspCtr
+from msp_codes import MspCodes
+from msp_data import MspRecType
+from msp_snapshot import CONFIG_BLOCKS, read_snapshot, write_snapshot
+from telemetry import TelemetryPoller
+
+
+class TestSimulatedFc(unittest.TestCase):
+    def open(self, **kwargs) -> serial.Serial:
+        sim, path = open_sim(**kwargs)
+        self.sim = sim
+        port = serial.Serial(path, timeout=2)
+        self.addCleanup(sim.close)
+        self.addCleanup(port.close)
+        return port
+
+    def test_identification(self):
+        msp = MspCtr(self.open(), timeout=2)
+        codes = (MspCodes.MSP_API_VERSION, MspCodes.MSP_FC_VARIANT, MspCodes.MSP_FC_VERSION,
+                 MspCodes.MSP_BUILD_INFO, MspCodes.MSP_BOARD_INFO)
+        for rec in msp.request_many(codes):
+            msp.decode(rec)
+        self.assertEqual(msp.data.api_version, '1.46.0')
+        self.assertEqual(msp.data.flight_controller_identifier, 'BTFL')
+        self.assertEqual(msp.data.flight_controller_version, '4.5.1')
+        self.assertEqual(msp.data.board_name, 'SIMF405')
+        self.assertEqual(msp.request(MspCodes.MSP_RC).type, MspRecType.UNSUPPORTED)
+
+    def test_cli(self):
+        cli = CliSession(self.open())
+        cli.enter()
+        results = cli.run(['set small_angle = 60', 'feature GPS', 'set no_such = 1', 'get small_angle'])
+        self.assertEqual([r.error is None for r in results], [True, True, False, True])
+        self.assertIn('Default value: 25', results[3].output)
+        diff = cli.command('diff all').output
+        self.assertIn('set small_angle = 60', diff)
+        self.assertIn('feature GPS', diff)
+        self.assertNotIn('setting_0', diff)
+        self.assertIsNone(cli.save())
+        self.assertEqual((self.sim.saved, self.sim.reboots), (1, 1))
+        self.assertEqual(self.sim.settings['small_angle'], '60')
+
+    def test_snapshot_round_trip(self):
+        msp = MspCtr(self.open(), timeout=2)
+        snapshot = read_snapshot(msp)
+        self.assertEqual(len(snapshot['blocks']), 29)
+        original = dict(self.sim.blocks)
+        get_only = {block.get: block.get_only for block in CONFIG_BLOCKS}
+        self.sim.blocks = {code: bytes(value if idx in get_only[code] else 0 for idx, value in enumerate(data))
+                           for code, data in original.items()}
+        self.assertEqual(write_snapshot(msp, snapshot), [])
+        self.assertEqual(self.sim.blocks, original)
+        self.assertEqual(self.sim.saved, 1)
+
+    def test_blackbox(self):
+        msp = MspCtr(self.open(dataflash_size=100_000), timeout=2)
+        with tempfile.TemporaryFile() as f:
+            size = blackbox.download(msp, f, blackbox.read_summary(msp).used_size)
+            f.seek(0)
+            self.assertEqual(f.read(), self.sim.dataflash)
+        self.assertEqual(size, 100_000)
+
+    def test_telemetry(self):
+        msp = MspCtr(self.open(), timeout=2)
+        msp.decode(msp.request(MspCodes.MSP_API_VERSION))
+        poller = TelemetryPoller(msp, {MspCodes.MSP_ATTITUDE: 100, MspCodes.MSP_MOTOR_TELEMETRY: 20})
+        stats = poller.run(0.5)
+        self.assertGreater(stats[MspCodes.MSP_ATTITUDE].received, 30)
+        self.assertEqual(poller.buffers[MspCodes.MSP_MOTOR_TELEMETRY].latest()[0], 18000)
+
+    def test_baud_throttling(self):
+        # 4 x 4 KB replies at 11520 bytes/s take 1.4 s, a loaded machine only makes that slower
+        msp = MspCtr(self.open(baudrate=115200), timeout=10)
+        started = time.monotonic()
+        reads = [(MspCodes.MSP_DATAFLASH_READ, *(0).to_bytes(4, 'little'), 0, 16, 0)] * 4
+        self.assertTrue(all(rec.type == MspRecType.RESPONSE for rec in msp.request_many(reads)))
+        self.assertGreater(time.monotonic() - started, 1.3)
+
+    def test_latency(self):
+        msp = MspCtr(self.open(latency=0.05), timeout=2)
+        started = time.monotonic()
+        for _ in range(4):
+            msp.request(MspCodes.MSP_API_VERSION)
+        self.assertGreater(time.monotonic() - started, 0.2)
+
+    def test_reboot_to_bootloader(self):
+        cli = CliSession(self.open())
+        cli.enter()
+        cli.port.write(b'bl\n')
+        deadline = time.monotonic() + 2
+        while self.sim.dfu is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertIsInstance(self.sim.dfu, SimulatedDfuDevice)
+        self.assertEqual((self.sim.reboots, self.sim.saved), (1, 0))
+
+
+class TestSimulatedDfuDevice(unittest.TestCase):
+    def test_download(self):
+        device = SimulatedDfuDevice()
+        data = random.Random(3).randbytes(0x30000)
+        dfu_flash.download(device, 0, data, 0x08000000, device.transfer_size, device.layout, verify=True)
+        self.assertEqual(bytes(device.flash[:len(data)]), data)
+        self.assertEqual(device.erased_pages, [0x08000000, 0x08004000, 0x08008000, 0x0800C000, 0x08010000, 0x08020000])
+        self.assertTrue(device.left)
+        manifest = dfu_flash.page_hashes(device.layout, data, 0x08000000)
+        changed = bytearray(data)
+        changed[0x10000] ^= 1
+        pages = dfu_flash.diff_manifest(device.layout, changed, 0x08000000, manifest)
+        self.assertEqual(pages, [0x08010000])
+        dfu_flash.download(device, 0, changed, 0x08000000, device.transfer_size, device.layout, pages=pages)
+        self.assertEqual(bytes(device.flash[:len(data)]), changed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import io
+import os
+import random
+import tempfile
+import unittest
+from intelhex import IntelHex
+from firmware import FirmwareImage
+
+CUSTOM_DEFAULTS_POINTER_ADDRESS = 0x08002800
+
+def make_hex(size: int, gap: tuple, seed: int = 1) -> str:
+    """Intel HEX text for a firmware at 0x08000000 with a hole ``gap = (offset, length)``."""
+    rnd = random.Random(seed)
+    ih = IntelHex()
+    data = rnd.randbytes(size)
+    ih.frombytes(data[:gap[0]], offset=0x08000000)
+    ih.frombytes(data[gap[0] + gap[1]:], offset=0x08000000 + gap[0] + gap[1])
+    out = io.StringIO()
+    ih.write_hex_file(out)
+    return out.getvalue()
+
+def intelhex_build(text: str, config: bytes) -> bytes:
+    """The previous todict() based path of bf_flash.flash()."""
+    intel_hex = IntelHex(io.StringIO(text))
+    firmware = intel_hex.todict()
+    start = 0
+    size = 0
+    prk = intel_hex.minaddr()
+    for k in sorted(filter(lambda k : isinstance(k, int), firmware)):
+        if prk >= CUSTOM_DEFAULTS_POINTER_ADDRESS and k - prk > 1:
+            start = prk + 1
+            size = k - start
+        prk = k
+    if start and size and len(config) <= size:
+        for b in config:
+            firmware[start] = b
+            start += 1
+        intel_hex = IntelHex(firmware)
+    return intel_hex.tobinstr()
+
+def image_build(text: str, config: bytes) -> bytes:
+    image = FirmwareImage.from_hex_text(text)
+    start, size = image.find_gap(CUSTOM_DEFAULTS_POINTER_ADDRESS)
+    if start and size and len(config) <= size:
+        image.write(start, config)
+    return image.tobinary()
+
+
+class TestFirmwareImage(unittest.TestCase):
+    def test_matches_intelhex(self):
+        config = b'# Betaflight\nset gyro_lpf1_static_hz = 250\0'
+        text = make_hex(64 * 1024, (40 * 1024, 8 * 1024))
+        self.assertEqual(bytes(image_build(text, config)), intelhex_build(text, config))
+        image = FirmwareImage.from_hex_text(text)
+        self.assertEqual(len(image.segments), 2)
+        self.assertEqual(image.find_gap(CUSTOM_DEFAULTS_POINTER_ADDRESS), (0x08000000 + 40 * 1024, 8 * 1024))
+
+    def test_write_merges_segments(self):
+        image = FirmwareImage([(0x100, b'\x01\x02'), (0x108, b'\x03')])
+        image.write(0x101, b'\xAA' * 7)
+        self.assertEqual(image.segments, [[0x100, bytearray(b'\x01' + b'\xAA' * 7 + b'\x03')]])
+        image.write(0x104, b'\xBB')
+        self.assertEqual(bytes(image.tobinary()), b'\x01\xAA\xAA\xAA\xBB\xAA\xAA\xAA\x03')
+
+    def test_image_file(self):
+        config = b'# Betaflight\nset gyro_lpf1_static_hz = 250\0'
+        text = make_hex(64 * 1024, (40 * 1024, 8 * 1024))
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'fw.bfimg')
+            FirmwareImage.from_hex_text(text).save(path)
+            image = FirmwareImage.load(path)
+            self.assertEqual([s[0] for s in image.segments], [0x08000000, 0x08000000 + 48 * 1024])
+            start, size = image.find_gap(CUSTOM_DEFAULTS_POINTER_ADDRESS)
+            image.write(start, config)
+            self.assertEqual(bytes(image.tobinary()), intelhex_build(text, config))
+            # Copy on write mapping, the file is untouched
+            self.assertEqual(FirmwareImage.load(path).dumps(), FirmwareImage.from_hex_text(text).dumps())
+
+    def test_bad_checksum(self):
+        with self.assertRaisesRegex(ValueError, 'checksum'):
+            FirmwareImage.from_hex_text(':0100000001FF\n')
+
+if __name__ == '__main__':
+    unittest.main()
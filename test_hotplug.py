@@ -0,0 +1,75 @@
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+import bf_flash
+from fc_sim import open_sim
+from hotplug import UeventMonitor, parse_uevent, wait_for
+
+UEVENT = (b'add@/devices/pci0000:00/0000:00:14.0/usb1/1-2\0ACTION=add\0DEVPATH=/devices/pci0000:00/0000:00:14.0/usb1/1-2\0'
+          b'SUBSYSTEM=usb\0DEVTYPE=usb_device\0PRODUCT=483/df11/2200\0SEQNUM=4711\0')
+
+
+class TestHotplug(unittest.TestCase):
+    def setUp(self):
+        self.kernel, sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.monitor = UeventMonitor(sock)
+
+    def tearDown(self):
+        self.monitor.close()
+        self.kernel.close()
+
+    def test_parse(self):
+        event = parse_uevent(UEVENT)
+        self.assertEqual((event['ACTION'], event['SUBSYSTEM'], event['PRODUCT']), ('add', 'usb', '483/df11/2200'))
+
+    def test_wakes_on_event(self):
+        devices = []
+        def arrive():
+            time.sleep(0.1)
+            self.kernel.send(b'add@/devices/virtual/net/lo\0ACTION=add\0SUBSYSTEM=net\0')
+            devices.append('dfu')
+            self.kernel.send(UEVENT)
+        threading.Thread(target=arrive).start()
+        started = time.monotonic()
+        self.assertEqual(wait_for(lambda: list(devices), timeout=5, monitor=self.monitor), ['dfu'])
+        self.assertLess(time.monotonic() - started, 0.5)
+
+    def test_settles_after_event(self):
+        # The device node shows up after the kernel event
+        checks = []
+        self.kernel.send(UEVENT)
+        self.assertTrue(wait_for(lambda: checks.append(1) or len(checks) > 3, timeout=5, monitor=self.monitor))
+
+    def test_timeout(self):
+        started = time.monotonic()
+        self.assertIsNone(wait_for(lambda: None, timeout=0.1, monitor=self.monitor))
+        self.assertLess(time.monotonic() - started, 0.5)
+
+    def test_wait_port(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            port = os.path.join(tmp, 'ttyACM0')
+            def arrive():
+                open(port, 'w').close()
+                self.kernel.send(UEVENT.replace(b'SUBSYSTEM=usb', b'SUBSYSTEM=tty'))
+            threading.Timer(0.1, arrive).start()
+            started = time.monotonic()
+            with mock.patch.object(UeventMonitor, 'open', return_value=self.monitor):
+                self.assertEqual(bf_flash.wait_port(port), port)
+            self.assertLess(time.monotonic() - started, 0.5)
+
+    def test_reboot_to_dfu(self):
+        sim, port = open_sim()
+        self.addCleanup(sim.close)
+        started = time.monotonic()
+        bf_flash.reboot_to_dfu(port)
+        while sim.dfu is None and time.monotonic() - started < 2:
+            time.sleep(0.005)
+        self.assertLess(time.monotonic() - started, 0.4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,22 @@
+import random
+import unittest
+import huffman
+
+
+class TestHuffman(unittest.TestCase):
+    def test_firmware_codes(self):
+        # 0x00 11, 0x01 101, 0xFF 001010000 in the firmware table
+        self.assertEqual(huffman.encode(bytes((0x00, 0x01, 0xFF))), bytes((0b11101001, 0b01000000)))
+        self.assertEqual(huffman.decode(bytes((0b11101001, 0b01000000)), 3), bytes((0x00, 0x01, 0xFF)))
+
+    def test_round_trip(self):
+        data = random.Random(1).randbytes(10_000)
+        self.assertEqual(huffman.decode(huffman.encode(data), len(data)), data)
+
+    def test_truncated(self):
+        with self.assertRaises(ValueError):
+            huffman.decode(huffman.encode(b'BTFL'), 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import unittest
+import bf_flash
+from bench_import import BUDGET_MS, COMMANDS, HEAVY_MODULES, LIGHT_COMMANDS, Bench
+
+
+class TestImportTime(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.bench = Bench()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.bench.close()
+
+    def loaded(self, command: str) -> set[str]:
+        return {name.split('.')[0] for name in self.bench.run(command)}
+
+    def test_no_heavy_modules(self):
+        for command in LIGHT_COMMANDS:
+            self.assertFalse(self.loaded(command) & set(HEAVY_MODULES), command)
+
+    def test_lazy_modules_available(self):
+        # The flash path gets to the DFU device, so the HTTP and USB stacks must have been imported
+        loaded = self.loaded('flash')
+        self.assertIn('urllib3', loaded)
+        self.assertIn('usb', loaded)
+        self.assertIn('usb', self.loaded('batch'))
+
+    def test_budget_per_command(self):
+        self.assertEqual(set(BUDGET_MS), set(COMMANDS))
+        self.assertLessEqual(set(LIGHT_COMMANDS), set(COMMANDS))
+
+    def test_lazy_helpers(self):
+        self.assertTrue(bf_flash.cache_dir().endswith(bf_flash.APP_NAME))
+
+
+if __name__ == '__main__':
+    unittest.main()
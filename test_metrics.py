@@ -0,0 +1,77 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+import dfu_flash
+import metrics
+from fc_sim import SimulatedDfuDevice
+from metrics import Metrics
+
+
+class TestMetrics(unittest.TestCase):
+    def test_spans(self):
+        m = Metrics()
+        with m.span('board', board='A1'):
+            with m.span('flash'):
+                m.count('dfu_bytes_written', 2048)
+            with self.assertRaises(RuntimeError):
+                with m.span('restore'):
+                    raise RuntimeError('no prompt')
+        self.assertEqual([(s.name, s.labels, s.ok) for s in m.spans], [
+            ('board/flash', (('board', 'A1'),), True),
+            ('board/restore', (('board', 'A1'),), False),
+            ('board', (('board', 'A1'),), True),
+        ])
+        self.assertEqual(m.counters[('dfu_bytes_written', (('board', 'A1'),))], 2048)
+
+    def test_threads(self):
+        m = Metrics()
+        def worker(serial_number):
+            with m.span('board', board=serial_number):
+                for _ in range(1000):
+                    m.count('msp_frames_sent')
+        threads = [threading.Thread(target=worker, args=(sn,)) for sn in ('A', 'B')]
+        with m.span('batch'):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(sorted(s.name for s in m.spans), ['batch', 'board', 'board'])
+        self.assertEqual(m.counters[('msp_frames_sent', (('board', 'A'),))], 1000)
+
+    def test_prometheus(self):
+        m = Metrics()
+        with m.span('flash', board='A"1'):
+            pass
+        m.count('retries', phase='blackbox')
+        text = m.prometheus()
+        self.assertIn('# TYPE bf_flash_phase_seconds_total counter', text)
+        self.assertIn('bf_flash_phase_calls_total{phase="flash",board="A\\"1"} 1', text)
+        self.assertIn('bf_flash_retries_total{phase="blackbox"} 1', text)
+
+    def test_write(self):
+        m = Metrics()
+        with m.span('wait_port'):
+            m.count('wait_seconds', 0.5, reason='hotplug')
+        with tempfile.TemporaryDirectory() as tmp:
+            m.write(os.path.join(tmp, 'run.jsonl'))
+            with open(os.path.join(tmp, 'run.jsonl'), encoding='utf-8') as f:
+                records = [json.loads(line) for line in f]
+            m.write(os.path.join(tmp, 'run.prom'))
+            with open(os.path.join(tmp, 'run.prom'), encoding='utf-8') as f:
+                self.assertIn('bf_flash_wait_seconds_total{reason="hotplug"} 0.5', f.read())
+        self.assertEqual([(r['type'], r['name']) for r in records], [('span', 'wait_port'), ('counter', 'wait_seconds')])
+
+    def test_dfu_download(self):
+        device = SimulatedDfuDevice()
+        before = metrics.metrics.counters[('dfu_bytes_written', (('board', 'SIM'),))]
+        with metrics.span('board', board='SIM'):
+            dfu_flash.download(device, 0, b'\x01' * 0x5000, 0x08000000, device.transfer_size, device.layout)
+        self.assertEqual(metrics.metrics.counters[('dfu_bytes_written', (('board', 'SIM'),))] - before, 0x5000)
+        names = {s.name for s in metrics.metrics.spans}
+        self.assertTrue({'board/dfu_erase', 'board/dfu_write'} <= names)
+
+
+if __name__ == '__main__':
+    unittest.main()
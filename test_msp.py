@@ -1,5 +1,30 @@
 import unittest
-from msp import MspCtr
+from fake_serial import FakeSerial, random_frames, response_v1
+from msp import MspCtr, MspFramer, crc8_dvb_s2, xor_checksum
+from msp_codes import MspCodes
+from msp_data import MspData, MspRec
+
+
+class RespondingSerial(FakeSerial):
+    """Answers every request frame written, optionally holding back replies to reorder them."""
+    def __init__(self, responses: dict, reverse: bool = False) -> None:
+        super().__init__(chunk=4096)
+        self.responses = responses
+        self.reverse = reverse
+        self.writes = 0
+
+    def write(self, data: bytes) -> int:
+        self.writes += 1
+        framer = MspFramer()
+        framer.feed(data.replace(b'$M<', b'$M>'))
+        replies = []
+        while (frame := framer.next_frame()) is not None:
+            code = frame[4]
+            if code in self.responses:
+                replies.append(response_v1(code, self.responses[code]))
+        self.data += b''.join(reversed(replies) if self.reverse else replies)
+        return super().write(data)
+
 
 class TestMainController(unittest.TestCase):
     def test_encode_v1(self):
@@ -8,5 +33,109 @@ class TestMainController(unittest.TestCase):
             buffer = msp.encode_v1(code)
             self.assertEqual(buffer, bytearray((36, 77, 60, 0, code, code)))
 
+    def test_crc8_dvb_s2(self):
+        self.assertEqual(crc8_dvb_s2(b''), 0)
+        self.assertEqual(crc8_dvb_s2(b'123456789'), 0xBC)
+        self.assertEqual(crc8_dvb_s2(bytes((0, 0x64, 0, 0, 0))), 0x8F)
+
+    def test_encode_v2(self):
+        msp = MspCtr(None)
+        self.assertEqual(msp.encode_v2(100), bytes.fromhex('24583c00640000008f'))
+        self.assertEqual(msp.encode(MspCodes.MSP2_GET_TEXT, MspCodes.PILOT_NAME)[:8],
+                         bytes.fromhex('24583c0006300100'))
+
+    def test_encode_jumbo(self):
+        msp = MspCtr(None)
+        payload = bytes(range(256)) * 12
+        buffer = msp.encode_v1(MspCodes.MSP_SET_OSD_CANVAS, *payload)
+        self.assertEqual(buffer[:7], bytes((36, 77, 60, 255, MspCodes.MSP_SET_OSD_CANVAS, 0, 12)))
+        self.assertEqual(buffer[-1], xor_checksum(buffer[3:-1]))
+
+    def test_framer_v2_and_jumbo(self):
+        msp = MspCtr(None)
+        payload = bytes(range(256)) * 20
+        v2 = bytearray(msp.encode_v2(MspCodes.MSP2_SENSOR_CONFIG_ACTIVE, *payload))
+        v2[2] = ord('>')
+        v2[-1] = crc8_dvb_s2(v2[3:-1])
+        jumbo = bytearray(msp.encode_v1(MspCodes.MSP_DATAFLASH_READ, *payload[:4000]))
+        jumbo[2] = ord('>')
+        framer = MspFramer()
+        msp.port = FakeSerial(b'\0$X' + bytes(v2) + bytes(jumbo), chunk=1000)
+        msp.framer = framer
+        rec = msp.read_rec()
+        self.assertEqual((rec.version, rec.code, bytes(rec.payload)), (2, MspCodes.MSP2_SENSOR_CONFIG_ACTIVE, payload))
+        rec = msp.read_rec()
+        self.assertEqual((rec.version, rec.code, bytes(rec.payload)), (1, MspCodes.MSP_DATAFLASH_READ, payload[:4000]))
+        self.assertEqual(framer.checksum_errors, 0)
+
+    def test_read_resync(self):
+        good = response_v1(MspCodes.MSP_API_VERSION, bytes((0, 1, 46)))
+        broken = bytearray(response_v1(MspCodes.MSP_FC_VARIANT, b'BTFL'))
+        broken[-1] ^= 0xFF
+        msp = MspCtr(FakeSerial(b'noise$$M' + bytes(broken) + good, chunk=3))
+        rec = msp.read_rec()
+        self.assertEqual(rec.code, MspCodes.MSP_API_VERSION)
+        self.assertEqual(bytes(rec.payload), bytes((0, 1, 46)))
+        self.assertEqual(msp.framer.checksum_errors, 1)
+
+    def test_read_timeout(self):
+        port = FakeSerial(response_v1(MspCodes.MSP_FC_VARIANT, b'BTFL')[:-2])
+        port.timeout = 2
+        msp = MspCtr(port)
+        with self.assertRaises(TimeoutError):
+            msp.read(timeout=0.05)
+        self.assertEqual(port.timeout, 2)
+        port.data += response_v1(MspCodes.MSP_API_VERSION, bytes((0, 1, 46)))
+        msp.read(timeout=1)
+        self.assertEqual(port.timeout, 2)
+
+    def test_request_many(self):
+        port = RespondingSerial({
+            MspCodes.MSP_API_VERSION: bytes((0, 1, 46)),
+            MspCodes.MSP_FC_VARIANT: b'BTFL',
+            MspCodes.MSP_FC_VERSION: bytes((4, 5, 1)),
+        }, reverse=True)
+        msp = MspCtr(port, timeout=1)
+        codes = (MspCodes.MSP_API_VERSION, MspCodes.MSP_FC_VARIANT, MspCodes.MSP_FC_VERSION, MspCodes.MSP_API_VERSION)
+        for rec in msp.request_many(codes):
+            msp.decode(rec)
+        self.assertEqual(port.writes, 1)
+        self.assertEqual(msp.data.api_version, '1.46.0')
+        self.assertEqual(msp.data.flight_controller_identifier, 'BTFL')
+        self.assertEqual(msp.data.flight_controller_version, '4.5.1')
+
+        recs = msp.request_many(codes, window=2)
+        self.assertEqual([rec.code for rec in recs], list(codes))
+        self.assertGreater(port.writes, 2)
+
+    def test_request_timeout(self):
+        msp = MspCtr(RespondingSerial({MspCodes.MSP_API_VERSION: bytes((0, 1, 46))}))
+        with self.assertRaisesRegex(TimeoutError, 'MSP_FC_VARIANT'):
+            msp.request_many((MspCodes.MSP_API_VERSION, MspCodes.MSP_FC_VARIANT), timeout=0.05)
+
+    def test_read_back_to_back(self):
+        # Frames split across and packed into 512 byte port reads, bench_msp.py times the same stream
+        frames = random_frames(2000)
+        msp = MspCtr(FakeSerial(b''.join(frames), chunk=512))
+        for frame in frames:
+            self.assertEqual(msp.read(timeout=1), frame)
+
+    def test_rec_payload_view(self):
+        frame = response_v1(MspCodes.MSP_FC_VARIANT, b'BTFL')
+        rec = MspRec(frame)
+        self.assertIsInstance(rec.payload, memoryview)
+        self.assertIs(rec.payload.obj, frame)
+        self.assertEqual(rec.payload, b'BTFL')
+        self.assertEqual(rec.read_string(4), 'BTFL')
+        self.assertFalse(hasattr(rec, '__dict__'))
+
+    def test_data_instances(self):
+        first, second = MspData(), MspData()
+        first.build_options.append(1)
+        self.assertEqual(second.build_options, [])
+        self.assertIsNot(first.pid_profile_names, second.pid_profile_names)
+        with self.assertRaises(AttributeError):
+            first.unknown = 1
+
 if __name__ == '__main__':
     unittest.main()
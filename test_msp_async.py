@@ -0,0 +1,139 @@
+import asyncio
+import os
+import tty
+import unittest
+from fake_serial import response_v1
+from msp import MspFramer
+from msp_async import AsyncMspCtr, MspProtocol, open_msp
+from msp_codes import MspCodes
+
+RESPONSES = {
+    MspCodes.MSP_API_VERSION: bytes((0, 1, 46)),
+    MspCodes.MSP_FC_VARIANT: b'BTFL',
+    MspCodes.MSP_FC_VERSION: bytes((4, 5, 1)),
+}
+
+def answer(data: bytes) -> bytes:
+    framer = MspFramer()
+    framer.feed(data.replace(b'$M<', b'$M>'))
+    replies = bytearray()
+    while (frame := framer.next_frame()) is not None:
+        if frame[4] in RESPONSES:
+            replies += response_v1(frame[4], RESPONSES[frame[4]])
+    return bytes(replies)
+
+
+class MemoryTransport(asyncio.Transport):
+    def __init__(self, protocol: MspProtocol) -> None:
+        super().__init__()
+        self.protocol = protocol
+        self.closing = False
+
+    def write(self, data: bytes) -> None:
+        reply = answer(data)
+        # Deliver in two pieces to exercise reassembly across data_received calls
+        loop = asyncio.get_running_loop()
+        loop.call_soon(self.protocol.data_received, reply[:3])
+        loop.call_soon(self.protocol.data_received, reply[3:])
+
+    def is_closing(self) -> bool:
+        return self.closing
+
+    def close(self) -> None:
+        self.closing = True
+        asyncio.get_running_loop().call_soon(self.protocol.connection_lost, None)
+
+
+class TestAsyncMspCtr(unittest.TestCase):
+    def test_memory_transport(self):
+        async def run():
+            protocol = MspProtocol()
+            transport = MemoryTransport(protocol)
+            msp = AsyncMspCtr(transport, protocol, timeout=1)
+            for rec in await msp.request_many(RESPONSES):
+                msp.decode(rec)
+            with self.assertRaisesRegex(TimeoutError, 'MSP_BOARD_INFO'):
+                await msp.request(MspCodes.MSP_BOARD_INFO, timeout=0.05)
+            await msp.close()
+            return msp.data
+
+        data = asyncio.run(run())
+        self.assertEqual(data.api_version, '1.46.0')
+        self.assertEqual(data.flight_controller_identifier, 'BTFL')
+        self.assertEqual(data.flight_controller_version, '4.5.1')
+
+    def test_late_reply_dropped(self):
+        async def run():
+            protocol = MspProtocol()
+            transport = MemoryTransport(protocol)
+            msp = AsyncMspCtr(transport, protocol, timeout=1)
+            transport.write = lambda data: None # the first reply is late
+            with self.assertRaises(TimeoutError):
+                await msp.request(MspCodes.MSP_FC_VARIANT, timeout=0.05)
+            second = asyncio.ensure_future(msp.request(MspCodes.MSP_FC_VARIANT))
+            await asyncio.sleep(0)
+            protocol.data_received(response_v1(MspCodes.MSP_FC_VARIANT, b'LATE'))
+            await asyncio.sleep(0.05)
+            self.assertFalse(second.done())
+            protocol.data_received(response_v1(MspCodes.MSP_FC_VARIANT, b'BTFL'))
+            rec = await second
+            await msp.close()
+            return bytes(rec.payload)
+
+        self.assertEqual(asyncio.run(run()), b'BTFL')
+
+    def test_lost_reply(self):
+        async def run():
+            protocol = MspProtocol()
+            transport = MemoryTransport(protocol)
+            msp = AsyncMspCtr(transport, protocol, timeout=0.05)
+            write = transport.write
+            transport.write = lambda data: None # this reply never comes
+            with self.assertRaises(TimeoutError):
+                await msp.request(MspCodes.MSP_FC_VARIANT)
+            transport.write = write
+            # The next reply is taken for the lost one, that request fails but owes nothing
+            with self.assertRaises(TimeoutError):
+                await msp.request(MspCodes.MSP_FC_VARIANT)
+            self.assertFalse(any(protocol._late.values()))
+            rec = await msp.request(MspCodes.MSP_FC_VARIANT)
+
+            # A late reply is only waited for as long as its request was
+            transport.write = lambda data: None
+            with self.assertRaises(TimeoutError):
+                await msp.request(MspCodes.MSP_FC_VARIANT)
+            transport.write = write
+            await asyncio.sleep(0.1)
+            await msp.request(MspCodes.MSP_FC_VARIANT)
+            await msp.close()
+            return bytes(rec.payload)
+
+        self.assertEqual(asyncio.run(run()), b'BTFL')
+
+    def test_pty(self):
+        master, slave = os.openpty()
+        tty.setraw(master)
+        port = os.ttyname(slave)
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            loop.add_reader(master, lambda: os.write(master, answer(os.read(master, 1024))))
+            msp = await open_msp(port, timeout=1)
+            try:
+                msp.decode(await msp.request(MspCodes.MSP_API_VERSION))
+                msp.decode(await msp.request(MspCodes.MSP_FC_VARIANT))
+                return msp.data
+            finally:
+                loop.remove_reader(master)
+                await msp.close()
+
+        try:
+            data = asyncio.run(run())
+        finally:
+            os.close(master)
+            os.close(slave)
+        self.assertEqual(data.api_version, '1.46.0')
+        self.assertEqual(data.flight_controller_identifier, 'BTFL')
+
+if __name__ == '__main__':
+    unittest.main()
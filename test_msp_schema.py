@@ -0,0 +1,71 @@
+import struct
+import unittest
+from fake_serial import response_v1
+from msp import MspCodec
+from msp_codes import MspCodes
+from msp_data import MspRec
+from msp_schema import SCHEMAS, compiled, decode_payload, encode_payload, parse_version
+
+BOARD_INFO = (b'S405' + struct.pack('<HBB', 0, 2, 0x35) + b'\x09STM32F405\x09MATEKF405\x04MTKS'
+              + bytes(range(32)) + bytes((1, 2)) + struct.pack('<HI', 8000, 4))
+
+
+class TestMspSchema(unittest.TestCase):
+    def test_board_info_versions(self):
+        values = decode_payload(MspCodes.MSP_BOARD_INFO, BOARD_INFO, '1.46.0')
+        self.assertEqual(values['board_identifier'], 'S405')
+        self.assertEqual(values['target_capabilities'], 0x35)
+        self.assertEqual((values['target_name'], values['board_name'], values['manufacturer_id']),
+                         ('STM32F405', 'MATEKF405', 'MTKS'))
+        self.assertEqual(values['signature'], bytes(range(32)))
+        self.assertEqual((values['configuration_state'], values['sample_rate_hz'], values['configuration_problems']), (2, 8000, 4))
+
+        values = decode_payload(MspCodes.MSP_BOARD_INFO, BOARD_INFO, '1.41.0')
+        self.assertEqual(values['mcu_type_id'], 1)
+        self.assertNotIn('configuration_state', values)
+
+    def test_truncated(self):
+        values = decode_payload(MspCodes.MSP_BOARD_INFO, BOARD_INFO[:20], '1.46.0')
+        self.assertEqual(values['target_name'], 'STM32F405')
+        self.assertNotIn('board_name', values)
+
+    def test_repeated_and_prefixed(self):
+        self.assertEqual(decode_payload(MspCodes.MSP_RC, struct.pack('<5H', 1500, 1500, 1000, 1500, 2000)),
+                         {'channels': (1500, 1500, 1000, 1500, 2000)})
+        payload = struct.pack('<HHHIBHBB', 125, 0, 0x23, 1, 0, 150, 4, 1) + b'\x02\x10\x00' + struct.pack('<BIBH', 26, 1 << 25, 0, 41)
+        values = decode_payload(MspCodes.MSP_STATUS_EX, payload, '1.46.0')
+        self.assertEqual(values['mode_extra'], b'\x10\x00')
+        self.assertEqual((values['arming_disable_count'], values['arming_disable_flags'], values['cpu_temp']), (26, 1 << 25, 41))
+
+    def test_encode(self):
+        self.assertEqual(encode_payload(MspCodes.MSP_SET_BOARD_ALIGNMENT_CONFIG, {'roll': -90, 'pitch': 0, 'yaw': 180}),
+                         struct.pack('<hhh', -90, 0, 180))
+        self.assertEqual(encode_payload(MspCodes.MSP_SET_NAME, {'name': 'QUAD'}), b'QUAD')
+        values = decode_payload(MspCodes.MSP_BOARD_INFO, BOARD_INFO, '1.46.0')
+        self.assertEqual(encode_payload(MspCodes.MSP_BOARD_INFO, values, '1.46.0'), BOARD_INFO)
+        with self.assertRaises(KeyError):
+            encode_payload(MspCodes.MSP_OSD_CONFIG, {})
+
+    def test_compiled_cache(self):
+        self.assertIs(compiled(MspCodes.MSP_ANALOG, parse_version('1.46.0')), compiled(MspCodes.MSP_ANALOG, parse_version('1.46.0')))
+        self.assertEqual(len(compiled(MspCodes.MSP_ANALOG, parse_version('1.40.0')).row_fields()), 4)
+        self.assertEqual(len(compiled(MspCodes.MSP_ANALOG, parse_version('1.46.0')).row_fields()), 5)
+        for code in SCHEMAS:
+            compiled(code, parse_version('1.46.0'))
+
+    def test_codec_decode(self):
+        codec = MspCodec()
+        for code, payload in ((MspCodes.MSP_API_VERSION, bytes((0, 1, 46))),
+                              (MspCodes.MSP_FC_VERSION, bytes((4, 5, 1))),
+                              (MspCodes.MSP_BUILD_INFO, b'Jun 15 202412:01:02'),
+                              (MspCodes.MSP_BOARD_INFO, BOARD_INFO)):
+            codec.decode(MspRec(response_v1(code, payload)))
+        self.assertEqual(codec.data.api_version, '1.46.0')
+        self.assertEqual(codec.data.flight_controller_version, '4.5.1')
+        self.assertEqual(codec.data.build_info, 'Jun 15 2024 12:01:02')
+        self.assertEqual(codec.data.board_name, 'MATEKF405')
+        self.assertEqual(codec.data.sample_rate_hz, 8000)
+        self.assertIsNone(codec.decode(MspRec(response_v1(MspCodes.MSP_OSD_CONFIG, b'\x00'))))
+
+if __name__ == '__main__':
+    unittest.main()
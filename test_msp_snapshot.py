@@ -0,0 +1,128 @@
+import os
+import struct
+import tempfile
+import unittest
+from fake_serial import FakeSerial, response_v1
+from msp import MspCtr, MspFramer
+from msp_codes import MspCodes
+from msp_snapshot import CONFIG_BLOCKS, load_snapshot, read_snapshot, restore_requests, save_snapshot, write_snapshot
+
+BOARD_INFO = b'S405' + bytes((0, 0, 2, 0)) + b'\x09STM32F405\x09MATEKF405\x04MTKS' + bytes(32) + bytes((1, 2, 0, 0, 0, 0, 0, 0))
+
+
+class FakeFc(FakeSerial):
+    """Config blocks by GET code, SET requests store their payload under the matching GET code."""
+    def __init__(self, api: tuple, blocks: dict) -> None:
+        super().__init__(chunk=4096)
+        self.api = api
+        self.blocks = dict(blocks)
+        self.sets = []
+        self.eeprom_writes = 0
+
+    def reply(self, code: int, payload: bytes, error: bool = False) -> bytes:
+        frame = response_v1(code, payload)
+        return frame[:2] + b'!' + frame[3:] if error else frame
+
+    def write(self, data: bytes) -> int:
+        framer = MspFramer()
+        framer.feed(data)
+        set_codes = {block.set: block.get for block in CONFIG_BLOCKS}
+        while (frame := framer.next_frame()) is not None:
+            code, payload = frame[4], frame[5:-1]
+            if code == MspCodes.MSP_API_VERSION:
+                self.data += self.reply(code, bytes((0, *self.api)))
+            elif code == MspCodes.MSP_FC_VARIANT:
+                self.data += self.reply(code, b'BTFL')
+            elif code == MspCodes.MSP_FC_VERSION:
+                self.data += self.reply(code, bytes((4, 5, 1)))
+            elif code == MspCodes.MSP_BOARD_INFO:
+                self.data += self.reply(code, BOARD_INFO)
+            elif code == MspCodes.MSP_EEPROM_WRITE:
+                self.eeprom_writes += 1
+                self.data += self.reply(code, b'')
+            elif code in set_codes:
+                self.sets.append((code, bytes(payload)))
+                self.data += self.reply(code, b'', error=set_codes[code] not in self.blocks)
+            else:
+                self.data += self.reply(code, self.blocks.get(code, b''), error=code not in self.blocks)
+        return super().write(data)
+
+
+BLOCKS = {
+    MspCodes.MSP_FEATURE_CONFIG: bytes((0x08, 0x04, 0x30, 0x20)),
+    MspCodes.MSP_BATTERY_CONFIG: bytes(range(14)),
+    MspCodes.MSP_RX_MAP: bytes((1, 0, 3, 2, 4, 5, 6, 7)),
+    MspCodes.MSP_MODE_RANGES: bytes((0, 0, 32, 48, 1, 1, 16, 32)),
+    MspCodes.MSP_MODE_RANGES_EXTRA: bytes((2, 0, 0, 0, 1, 1, 0)),
+}
+
+# Betaflight 4.5 msp.c layouts, the GET handlers write status bytes the SET handlers do not read
+FIRMWARE_BLOCKS = {
+    # supported, device, rate num, rate denom, p_ratio, sample_rate, fields disabled
+    MspCodes.MSP_BLACKBOX_CONFIG: struct.pack('<BBBBHBI', 1, 1, 1, 2, 2, 3, 0x40),
+    # minthrottle, maxthrottle, mincommand, motor count, motor_poles, dshot_bidir, ESC sensor
+    MspCodes.MSP_MOTOR_CONFIG: struct.pack('<HHHBBBB', 1070, 2000, 1000, 4, 14, 1, 0),
+    # gyro, acc, mag, detected gyros, gyro_to_use, gyro_1_align, gyro_2_align
+    MspCodes.MSP_SENSOR_ALIGNMENT: bytes((2, 2, 0, 1, 0, 2, 0)),
+}
+# Fields in the order the SET handlers read them
+SET_LAYOUTS = {
+    MspCodes.MSP_SET_BLACKBOX_CONFIG: '<BBBHBI', # device, rate num, rate denom, p_ratio, sample_rate, fields disabled
+    MspCodes.MSP_SET_MOTOR_CONFIG: '<HHHBB', # minthrottle, maxthrottle, mincommand, motor_poles, dshot_bidir
+    MspCodes.MSP_SET_SENSOR_ALIGNMENT: '<6B', # gyro, acc, mag, gyro_to_use, gyro_1_align, gyro_2_align
+}
+
+
+class TestMspSnapshot(unittest.TestCase):
+    def test_read_snapshot(self):
+        snapshot = read_snapshot(MspCtr(FakeFc((1, 46), BLOCKS), timeout=1))
+        self.assertEqual(snapshot['api_version'], '1.46.0')
+        self.assertEqual(snapshot['board'], 'MATEKF405')
+        self.assertEqual(snapshot['firmware'], 'BTFL 4.5.1')
+        self.assertEqual(snapshot['blocks'], {code.name: data.hex() for code, data in BLOCKS.items()})
+
+    def test_restore_requests(self):
+        snapshot = read_snapshot(MspCtr(FakeFc((1, 46), BLOCKS), timeout=1))
+        self.assertEqual(restore_requests(snapshot), [
+            (MspCodes.MSP_SET_FEATURE_CONFIG, 0x08, 0x04, 0x30, 0x20),
+            (MspCodes.MSP_SET_BATTERY_CONFIG, *range(14)),
+            (MspCodes.MSP_SET_RX_MAP, 1, 0, 3, 2, 4, 5, 6, 7),
+            (MspCodes.MSP_SET_MODE_RANGE, 0, 0, 0, 32, 48, 0, 0),
+            (MspCodes.MSP_SET_MODE_RANGE, 1, 1, 1, 16, 32, 1, 0),
+        ])
+
+    def test_round_trip(self):
+        snapshot = read_snapshot(MspCtr(FakeFc((1, 46), BLOCKS), timeout=1))
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'quad.bfsnap')
+            save_snapshot(snapshot, path)
+            snapshot = load_snapshot(path)
+
+        fc = FakeFc((1, 46), {code: b'' for code in BLOCKS})
+        self.assertEqual(write_snapshot(MspCtr(fc, timeout=1), snapshot), [])
+        self.assertEqual(len(fc.sets), 5)
+        self.assertEqual(fc.sets[1], (MspCodes.MSP_SET_BATTERY_CONFIG, bytes(range(14))))
+        self.assertEqual(fc.eeprom_writes, 1)
+
+        fc = FakeFc((1, 46), {MspCodes.MSP_FEATURE_CONFIG: b''})
+        self.assertEqual(write_snapshot(MspCtr(fc, timeout=1), snapshot), [
+            'MSP_SET_BATTERY_CONFIG', 'MSP_SET_RX_MAP', 'MSP_SET_MODE_RANGE', 'MSP_SET_MODE_RANGE'])
+
+    def test_firmware_layouts(self):
+        snapshot = read_snapshot(MspCtr(FakeFc((1, 46), FIRMWARE_BLOCKS), timeout=1))
+        fields = {code: struct.unpack(SET_LAYOUTS[code], bytes(data)) for code, *data in restore_requests(snapshot)}
+        self.assertEqual(fields, {
+            MspCodes.MSP_SET_BLACKBOX_CONFIG: (1, 1, 2, 2, 3, 0x40),
+            MspCodes.MSP_SET_SENSOR_ALIGNMENT: (2, 2, 0, 0, 2, 0),
+            MspCodes.MSP_SET_MOTOR_CONFIG: (1070, 2000, 1000, 14, 1),
+        })
+
+    def test_api_version_mismatch(self):
+        snapshot = read_snapshot(MspCtr(FakeFc((1, 45), BLOCKS), timeout=1))
+        fc = FakeFc((1, 46), BLOCKS)
+        with self.assertRaises(ValueError):
+            write_snapshot(MspCtr(fc, timeout=1), snapshot)
+        self.assertEqual((fc.sets, fc.eeprom_writes), ([], 0))
+
+if __name__ == '__main__':
+    unittest.main()
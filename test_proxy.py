@@ -0,0 +1,91 @@
+import os
+import select
+import tempfile
+import threading
+import time
+import tty
+import unittest
+import serial
+from capture import FC_TO_HOST, HOST_TO_FC, CaptureWriter, read_capture
+from fake_serial import response_v1
+from msp import MspCodec
+from msp_codes import MspCodes
+from proxy import Proxy
+
+
+def open_pty() -> tuple[int, serial.Serial]:
+    master, slave = os.openpty()
+    tty.setraw(master)
+    tty.setraw(slave)
+    port = serial.Serial(os.ttyname(slave), timeout=0)
+    os.close(slave)
+    return master, port
+
+def read_exactly(fd: int, size: int, timeout: float = 2) -> bytes:
+    result = b''
+    deadline = time.monotonic() + timeout
+    while len(result) < size and select.select([fd], [], [], max(deadline - time.monotonic(), 0))[0]:
+        result += os.read(fd, size - len(result))
+    return result
+
+
+class TestProxy(unittest.TestCase):
+    def setUp(self):
+        self.host, host_port = open_pty()
+        self.fc, fc_port = open_pty()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'link.bfcap')
+        self.capture = CaptureWriter(self.path, buffer_size=256)
+        self.frames = []
+        self.proxy = Proxy(host_port, fc_port, self.capture, lambda *args: self.frames.append(args))
+        self.thread = threading.Thread(target=self.proxy.run, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.proxy.stop()
+        self.thread.join()
+        self.capture.close()
+        for port in self.proxy.ports:
+            port.close()
+        os.close(self.host)
+        os.close(self.fc)
+        self.tmp.cleanup()
+
+    def test_forward_and_capture(self):
+        request = MspCodec().encode(MspCodes.MSP_API_VERSION)
+        response = response_v1(MspCodes.MSP_API_VERSION, bytes((0, 1, 46)))
+        bulk = os.urandom(20000)
+
+        os.write(self.host, request)
+        self.assertEqual(read_exactly(self.fc, len(request)), request)
+        os.write(self.fc, response)
+        self.assertEqual(read_exactly(self.host, len(response)), response)
+        os.write(self.fc, bulk)
+        self.assertEqual(read_exactly(self.host, len(bulk)), bulk)
+
+        self.proxy.stop()
+        self.thread.join()
+        self.capture.close()
+        records = list(read_capture(self.path))
+        self.assertEqual(b''.join(data for _, direction, data in records if direction == HOST_TO_FC), request)
+        self.assertEqual(b''.join(data for _, direction, data in records if direction == FC_TO_HOST), response + bulk)
+        timestamps = [timestamp for timestamp, _, _ in records]
+        self.assertEqual(timestamps, sorted(timestamps))
+        self.assertEqual(self.proxy.bytes, [len(request), len(response) + len(bulk)])
+
+        self.assertEqual([(direction, rec.code) for direction, _, rec in self.frames[:2]],
+                         [(HOST_TO_FC, MspCodes.MSP_API_VERSION), (FC_TO_HOST, MspCodes.MSP_API_VERSION)])
+
+    def test_latency(self):
+        request = MspCodec().encode(MspCodes.MSP_STATUS_EX)
+        delays = []
+        for _ in range(50):
+            started = time.perf_counter()
+            os.write(self.host, request)
+            read_exactly(self.fc, len(request))
+            delays.append(time.perf_counter() - started)
+        delays.sort()
+        self.assertLess(delays[len(delays) // 2], 0.005)
+
+if __name__ == '__main__':
+    unittest.main()
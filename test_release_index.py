@@ -0,0 +1,101 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from artifact_cache import ArtifactCache
+from release_index import ReleaseIndex
+
+TARGETS = [f'TARGET{i:02d}' for i in range(20)]
+RELEASES = [{'release': '4.5.1', 'type': 'Stable'}, {'release': '4.6.0-RC1', 'type': 'ReleaseCandidate'},
+            {'release': '4.5.0', 'type': 'Stable'}]
+
+
+def body(path: str) -> bytes:
+    if path == '/api/targets':
+        return json.dumps([{'target': target} for target in TARGETS]).encode()
+    if path.startswith('/api/targets/'):
+        return json.dumps({'target': path.rsplit('/', 1)[1], 'releases': RELEASES}).encode()
+    if path.startswith('/api/builds/'):
+        _, _, _, release, target = path.split('/')
+        return json.dumps({'url': f'/hex/{target}_{release}.hex'}).encode()
+    return b':00000001FF\n'
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    hits = []
+    clients = set()
+
+    def do_GET(self):
+        Handler.hits.append(self.path)
+        Handler.clients.add(self.client_address)
+        data = body(self.path)
+        self.send_response(200)
+        self.send_header('ETag', f'"{hash(data)}"')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestReleaseIndex(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        cls.url = f'http://127.0.0.1:{cls.server.server_address[1]}'
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        Handler.hits.clear()
+        Handler.clients.clear()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = ArtifactCache(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_prefetch_pooled(self):
+        index = ReleaseIndex(self.cache, self.url, workers=4)
+        self.assertEqual(index.prefetch(TARGETS, firmware=True), {})
+        self.assertEqual(len(Handler.hits), 60)
+        # 60 requests over the keep-alive connections of one session
+        self.assertLessEqual(len(Handler.clients), 4)
+        self.assertTrue(os.path.isfile(self.cache.get_path(ArtifactCache.key('hex', 'TARGET03', '4.5.1'))))
+
+        index.prefetch(TARGETS[:2], all_releases=True)
+        self.assertEqual(len(Handler.hits), 62) # release lists are fresh, only the 4.5.0 builds are new
+
+    def test_offline(self):
+        ReleaseIndex(self.cache, self.url).prefetch(TARGETS[:3])
+        offline = ReleaseIndex(ArtifactCache(self.tmp.name), 'http://127.0.0.1:1', offline=True)
+        self.assertEqual(offline.stable('TARGET01'), ['4.5.1', '4.5.0'])
+        self.assertEqual(offline.build_info('TARGET01', '4.5.1'), {'url': '/hex/TARGET01_4.5.1.hex'})
+        self.assertEqual(offline.search('target0'), ['TARGET00', 'TARGET01', 'TARGET02'])
+        self.assertEqual(offline.cached_stable('TARGET09'), [])
+        with self.assertRaises(LookupError):
+            offline.stable('TARGET09')
+        with self.assertRaises(LookupError):
+            offline.firmware('TARGET01', '4.5.1', {'url': '/hex/TARGET01_4.5.1.hex'})
+
+    def test_search(self):
+        index = ReleaseIndex(self.cache, self.url)
+        self.assertEqual(index.search('et1'), TARGETS[10:])
+        self.assertEqual(ReleaseIndex(self.cache, self.url, offline=True).search('19'), ['TARGET19'])
+
+    def test_prefetch_errors(self):
+        index = ReleaseIndex(self.cache, 'http://127.0.0.1:1', workers=2)
+        errors = index.prefetch(['TARGET00'])
+        self.assertEqual(list(errors), ['TARGET00'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import struct
+import time
+import unittest
+from fake_serial import FakeSerial, response_v1
+from msp import MspCtr, MspFramer
+from msp_codes import MspCodes
+from telemetry import MAX_MOTORS, RingBuffer, TelemetryPoller, motor_telemetry
+
+ATTITUDE = struct.pack('<hhh', -15, 30, 270)
+
+
+class PolledSerial(FakeSerial):
+    """Answers the codes it knows, blocks for the read timeout like a real port when idle."""
+    def __init__(self, responses: dict) -> None:
+        super().__init__(chunk=4096)
+        self.responses = responses
+
+    def read(self, size: int = 1) -> bytes:
+        if not self.data and self.timeout:
+            time.sleep(self.timeout)
+        return super().read(size)
+
+    def write(self, data: bytes) -> int:
+        framer = MspFramer()
+        framer.feed(data)
+        while (frame := framer.next_frame()) is not None:
+            if frame[4] in self.responses:
+                self.data += response_v1(frame[4], self.responses[frame[4]])
+        return super().write(data)
+
+
+class TestTelemetry(unittest.TestCase):
+    def test_ring_buffer(self):
+        ring = RingBuffer(2, capacity=4)
+        self.assertIsNone(ring.latest())
+        for i in range(6):
+            ring.append(i / 10, (i, -i))
+        self.assertEqual(len(ring), 4)
+        self.assertEqual(ring.latest(), (5, -5))
+        self.assertEqual(list(ring.column(0)), [2, 3, 4, 5])
+        self.assertEqual(list(ring.column(1)), [-2, -3, -4, -5])
+        self.assertEqual(list(ring.timestamps()), [0.2, 0.3, 0.4, 0.5])
+
+    def test_motor_telemetry(self):
+        payload = bytes((2,)) + struct.pack('<IHBHHH', 12000, 1, 40, 1600, 250, 10) * 2
+        values = motor_telemetry(payload)
+        self.assertEqual(len(values), MAX_MOTORS * 6)
+        self.assertEqual(values[:7], (12000, 1, 40, 1600, 250, 10, 12000))
+        self.assertEqual(values[12:], (0,) * (MAX_MOTORS - 2) * 6)
+
+    def test_poll_rate(self):
+        port = PolledSerial({MspCodes.MSP_ATTITUDE: ATTITUDE})
+        poller = TelemetryPoller(MspCtr(port), {MspCodes.MSP_ATTITUDE: 100, MspCodes.MSP_ANALOG: 50})
+        port.timeout = 2
+        stats = poller.run(0.5)
+        self.assertEqual(port.timeout, 2)
+
+        attitude = stats[MspCodes.MSP_ATTITUDE]
+        self.assertGreater(attitude.achieved_hz, 80)
+        self.assertLess(attitude.achieved_hz, 110)
+        self.assertEqual(attitude.dropped, 0)
+        self.assertEqual(poller.buffers[MspCodes.MSP_ATTITUDE].latest(), (-15, 30, 270))
+        self.assertEqual(set(poller.field(MspCodes.MSP_ATTITUDE, 'yaw')), {270})
+
+        # Never answered: every request but the last one pending is dropped
+        analog = stats[MspCodes.MSP_ANALOG]
+        self.assertEqual(analog.received, 0)
+        self.assertGreater(analog.dropped, 15)
+
+if __name__ == '__main__':
+    unittest.main()